@@ -34,8 +34,11 @@
     'depends': ['account',
                 'report_webkit'],
     'demo': [],
-    'data': ['account_view.xml',
+    'data': ['security/ir.model.access.csv',
+             'account_view.xml',
              'data/financial_webkit_header.xml',
+             'data/ledger_change_cron.xml',
+             'data/balance_snapshot_cron.xml',
              'report/report.xml',
              'wizard/wizard.xml',
              'wizard/balance_common_view.xml',
@@ -48,6 +51,7 @@
              'wizard/aged_partner_balance_wizard.xml',
              'wizard/print_journal_view.xml',
              'report_menus.xml',
+             'report_job_view.xml',
              ],
     # tests order matter
     'test': ['test/general_ledger.yml',
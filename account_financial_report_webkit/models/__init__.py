@@ -4,4 +4,11 @@
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
 
 from . import account
+from . import account_balance_snapshot
+from . import account_ledger_change
+from . import account_move
 from . import account_move_line
+from . import account_move_reconcile
+from . import account_period
+from . import account_report_job
+from . import ir_actions_report_xml
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
+
+import logging
+import threading
+from contextlib import contextmanager
+
+from psycopg2 import IntegrityError
+from psycopg2.extensions import TransactionRollbackError
+
+import openerp.addons.decimal_precision as dp
+from openerp import SUPERUSER_ID, api, fields, models, tools
+
+_logger = logging.getLogger(__name__)
+
+SNAPSHOT_COLUMNS = ('company_id', 'account_id', 'partner_id', 'period_id',
+                    'move_state', 'currency_id')
+
+# columns of the snapshot aggregated from account_move_line (aliased l)
+# joined to account_move (aliased m)
+SNAPSHOT_SELECT = """
+SELECT l.company_id, l.account_id, l.partner_id, l.period_id,
+       m.state AS move_state, l.currency_id,
+       SUM(COALESCE(l.debit, 0.0)) AS debit,
+       SUM(COALESCE(l.credit, 0.0)) AS credit,
+       SUM(COALESCE(l.amount_currency, 0.0)) AS amount_currency
+FROM account_move_line l
+JOIN account_move m ON (m.id = l.move_id)
+WHERE l.state = 'valid'
+"""
+
+# the sums of a key of the snapshot, the keys being unique among the rows
+# which are not pending
+SNAPSHOT_KEY_WHERE = """
+WHERE pending IS NOT TRUE
+AND COALESCE(company_id, 0) = COALESCE(%s, 0) AND account_id = %s
+AND COALESCE(partner_id, 0) = COALESCE(%s, 0) AND period_id = %s
+AND move_state = %s AND COALESCE(currency_id, 0) = COALESCE(%s, 0)
+"""
+
+
+# parameter storing whether the snapshot was maintained when the server
+# stopped, it is rebuilt when the option is enabled again
+SNAPSHOT_STATE_PARAM = 'account_financial_report_webkit.balance_snapshot'
+
+# moves whose changes are applied to the snapshot by an enclosing
+# `track_moves` of the thread
+_tracking = threading.local()
+
+
+def snapshot_enabled():
+    """The snapshot is maintained and used by the reports only when the
+    ``webkit_report_balance_snapshot`` option of the server configuration
+    file is set"""
+    return str(tools.config.get('webkit_report_balance_snapshot', False))\
+        .lower() in ('1', 'true', 'yes')
+
+
+def insert_snapshot_sums(cr, where='', params=()):
+    """Insert the sums of the valid move lines matching the condition
+    `where` (on account_move_line aliased l) in the snapshot"""
+    cr.execute("INSERT INTO account_webkit_balance_snapshot "
+               "(%s, debit, credit, amount_currency) %s %s "
+               "GROUP BY 1, 2, 3, 4, 5, 6" % (
+                   ', '.join(SNAPSHOT_COLUMNS), SNAPSHOT_SELECT, where),
+               params)
+
+
+def rebuild_snapshot(cr):
+    """Compute the whole snapshot again from the move lines"""
+    _logger.info('Rebuilding the balance snapshot of the webkit reports')
+    cr.execute("DELETE FROM account_webkit_balance_snapshot")
+    insert_snapshot_sums(cr)
+
+
+def get_move_sums(cr, move_ids):
+    """Return the sums of the valid lines of moves
+
+    :return: dict {key of the snapshot: (debit, credit, amount_currency)}
+    """
+    if not move_ids:
+        return {}
+    cr.execute(SNAPSHOT_SELECT + "AND l.move_id IN %s "
+               "GROUP BY 1, 2, 3, 4, 5, 6", (tuple(move_ids),))
+    return dict((row[:6], row[6:]) for row in cr.fetchall())
+
+
+def add_snapshot_sums(cr, deltas):
+    """Add signed amounts to the sums of the snapshot
+
+    The sums of a key are updated, or inserted when the key is missing,
+    under a lock of the account and period. With REPEATABLE READ, a
+    transaction does not see the sums committed by another one after it
+    started, even after waiting for the lock: the update is then refused
+    (serialization failure or duplicated key) and the amounts are inserted
+    as a pending row, merged in the sums by `merge_pending_sums`.
+
+    :param deltas: dict {key of the snapshot: (debit, credit,
+                   amount_currency)}
+    """
+    if not deltas:
+        return
+    keys = sorted(deltas)
+    locks = sorted(set((key[1], key[3]) for key in keys))
+    # the keys are locked in the same order to avoid deadlocks
+    cr.execute("SELECT pg_advisory_xact_lock(account_id, period_id) "
+               "FROM (SELECT unnest(%s) AS account_id, "
+               "             unnest(%s) AS period_id "
+               "      ORDER BY 1, 2) AS snapshot_keys",
+               [list(values) for values in zip(*locks)])
+    columns = ', '.join(SNAPSHOT_COLUMNS)
+    for key in keys:
+        params = tuple(deltas[key]) + key
+        try:
+            with cr.savepoint():
+                cr.execute("UPDATE account_webkit_balance_snapshot "
+                           "SET debit = debit + %s, credit = credit + %s, "
+                           "amount_currency = amount_currency + %s "
+                           + SNAPSHOT_KEY_WHERE, params,
+                           log_exceptions=False)
+                if not cr.rowcount:
+                    cr.execute("INSERT INTO account_webkit_balance_snapshot "
+                               "(debit, credit, amount_currency, %s) "
+                               "VALUES (%%s, %%s, %%s, %%s, %%s, %%s, %%s, "
+                               "%%s, %%s)" % columns, params,
+                               log_exceptions=False)
+        except (IntegrityError, TransactionRollbackError):
+            cr.execute("INSERT INTO account_webkit_balance_snapshot "
+                       "(debit, credit, amount_currency, %s, pending) "
+                       "VALUES (%%s, %%s, %%s, %%s, %%s, %%s, %%s, %%s, "
+                       "%%s, TRUE)" % columns, params)
+
+
+def merge_pending_sums(cr):
+    """Merge the pending rows of the snapshot in the sums of their key"""
+    cr.execute("SELECT %s, SUM(debit), SUM(credit), SUM(amount_currency) "
+               "FROM account_webkit_balance_snapshot WHERE pending "
+               "GROUP BY 1, 2, 3, 4, 5, 6" % ', '.join(SNAPSHOT_COLUMNS))
+    deltas = dict((row[:6], row[6:]) for row in cr.fetchall())
+    # only the rows summed above are visible to the transaction
+    cr.execute("DELETE FROM account_webkit_balance_snapshot WHERE pending")
+    add_snapshot_sums(cr, deltas)
+
+
+@contextmanager
+def track_moves(cr, move_ids, digits):
+    """Add to the snapshot the changes of the sums of the valid lines of
+    moves made in the block
+
+    The changes of the moves tracked by an enclosing block (the lines
+    validated when a move is posted...) are left to this block, so they are
+    added once.
+
+    :param digits: number of decimals of the amounts
+    """
+    tracked = getattr(_tracking, 'move_ids', frozenset())
+    move_ids = frozenset(move_ids) - tracked
+    if not move_ids or not snapshot_enabled():
+        yield
+        return
+    before = get_move_sums(cr, move_ids)
+    _tracking.move_ids = tracked | move_ids
+    try:
+        yield
+    finally:
+        _tracking.move_ids = tracked
+    after = get_move_sums(cr, move_ids)
+    deltas = {}
+    for key in set(before).union(after):
+        delta = tuple(
+            round(new - old, digits) for new, old in
+            zip(after.get(key, (0.0,) * 3), before.get(key, (0.0,) * 3)))
+        if any(delta):
+            deltas[key] = delta
+    add_snapshot_sums(cr, deltas)
+
+
+class AccountWebkitBalanceSnapshot(models.Model):
+    """
+    Sums of the valid move lines per company, account, partner, period, move
+    state and currency, used by the balance reports instead of the move
+    lines when filtering on periods.
+
+    The changes of the sums made by the transactions changing the move
+    lines are added to the snapshot, see `add_snapshot_sums`.
+    """
+
+    _name = 'account.webkit.balance.snapshot'
+    _description = 'Monthly balances for the financial reports'
+    _log_access = False
+
+    company_id = fields.Many2one('res.company', 'Company', readonly=True)
+    account_id = fields.Many2one('account.account', 'Account',
+                                 readonly=True, ondelete='cascade')
+    partner_id = fields.Many2one('res.partner', 'Partner', readonly=True,
+                                 ondelete='cascade')
+    period_id = fields.Many2one('account.period', 'Period', readonly=True,
+                                ondelete='cascade')
+    move_state = fields.Selection(
+        [('draft', 'Unposted'), ('posted', 'Posted')], 'Move Status',
+        readonly=True)
+    currency_id = fields.Many2one('res.currency', 'Currency', readonly=True)
+    debit = fields.Float('Debit', readonly=True,
+                         digits=dp.get_precision('Account'))
+    credit = fields.Float('Credit', readonly=True,
+                          digits=dp.get_precision('Account'))
+    amount_currency = fields.Float('Amount Currency', readonly=True,
+                                   digits=dp.get_precision('Account'))
+    pending = fields.Boolean(
+        'Pending', readonly=True, default=False,
+        help="Amounts added by a transaction which could not update the "
+             "sums of their key, they are merged in the sums by a cron.")
+
+    # pylint: disable=old-api7-method-defined
+    def init(self, cr):
+        # the sums are inserted in SQL
+        cr.execute("ALTER TABLE account_webkit_balance_snapshot "
+                   "ALTER COLUMN pending SET DEFAULT FALSE")
+        cr.execute("SELECT indexname FROM pg_indexes WHERE indexname = %s",
+                   ('account_webkit_balance_snapshot_account_period',))
+        if not cr.fetchone():
+            cr.execute("CREATE INDEX "
+                       "account_webkit_balance_snapshot_account_period "
+                       "ON account_webkit_balance_snapshot "
+                       "(account_id, period_id)")
+        cr.execute("SELECT indexname FROM pg_indexes WHERE indexname IN %s",
+                   (('account_webkit_balance_snapshot_key',
+                     'account_webkit_balance_snapshot_sums_key'),))
+        indexes = set(row[0] for row in cr.fetchall())
+        if 'account_webkit_balance_snapshot_sums_key' not in indexes:
+            if 'account_webkit_balance_snapshot_key' not in indexes:
+                # the snapshot is computed again since it could have
+                # duplicated keys before the index
+                cr.execute("DELETE FROM account_webkit_balance_snapshot")
+                self.pool['ir.config_parameter'].set_param(
+                    cr, SUPERUSER_ID, SNAPSHOT_STATE_PARAM, '0')
+            cr.execute("DROP INDEX IF EXISTS "
+                       "account_webkit_balance_snapshot_key")
+            cr.execute("CREATE UNIQUE INDEX "
+                       "account_webkit_balance_snapshot_sums_key "
+                       "ON account_webkit_balance_snapshot "
+                       "(account_id, period_id, COALESCE(partner_id, 0), "
+                       "COALESCE(currency_id, 0), COALESCE(company_id, 0), "
+                       "move_state) WHERE pending IS NOT TRUE")
+
+    # pylint: disable=old-api7-method-defined
+    def _register_hook(self, cr):
+        """Rebuild the snapshot when the option is enabled after the
+        entries changed without being reported in the snapshot"""
+        params = self.pool['ir.config_parameter']
+        maintained = params.get_param(cr, SUPERUSER_ID,
+                                      SNAPSHOT_STATE_PARAM) == '1'
+        if snapshot_enabled() and not maintained:
+            rebuild_snapshot(cr)
+            params.set_param(cr, SUPERUSER_ID, SNAPSHOT_STATE_PARAM, '1')
+        elif maintained and not snapshot_enabled():
+            params.set_param(cr, SUPERUSER_ID, SNAPSHOT_STATE_PARAM, '0')
+        return super(AccountWebkitBalanceSnapshot, self)._register_hook(cr)
+
+    @api.model
+    def rebuild(self):
+        """Compute the whole snapshot again from the move lines, to call
+        after enabling the snapshot"""
+        rebuild_snapshot(self.env.cr)
+        return True
+
+    @api.model
+    def track_moves(self, move_ids):
+        """Context manager adding to the snapshot the changes of the sums of
+        the moves made in its block, see `track_moves`"""
+        return track_moves(
+            self.env.cr, move_ids,
+            self.env['decimal.precision'].precision_get('Account'))
+
+    @api.model
+    def get_line_moves(self, line_ids):
+        """Return the ids of the moves of move lines"""
+        if not line_ids or not snapshot_enabled():
+            return set()
+        self.env.cr.execute("SELECT DISTINCT move_id "
+                            "FROM account_move_line WHERE id in %s",
+                            (tuple(line_ids),))
+        return set(row[0] for row in self.env.cr.fetchall())
+
+    @api.model
+    def _cron_merge_pending(self):
+        """Merge the pending rows in the sums of their key"""
+        if snapshot_enabled():
+            merge_pending_sums(self.env.cr)
+        return True
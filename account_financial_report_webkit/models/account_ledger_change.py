@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
+
+from openerp import api, models
+
+from ..report.result_cache import result_cache
+
+
+class AccountWebkitLedgerChange(models.Model):
+    """
+    Transactions which changed the entries or their reconciliations, used
+    as the version of the ledger in the key of the cached reports.
+
+    Each transaction adds one row when it changes the entries, so the
+    number of rows changes when it commits, whatever the order in which the
+    transactions commit and whatever they changed.
+    """
+
+    _name = 'account.webkit.ledger.change'
+    _description = 'Changes of the entries for the report cache'
+    _auto = False
+    _log_access = False
+
+    # pylint: disable=old-api7-method-defined
+    def init(self, cr):
+        cr.execute("CREATE TABLE IF NOT EXISTS account_webkit_ledger_change "
+                   "(id serial PRIMARY KEY, "
+                   " txid bigint NOT NULL UNIQUE)")
+
+    @api.model
+    def record(self):
+        """Record that the current transaction changes the ledger"""
+        if not result_cache.max_size:
+            return
+        self.env.cr.execute(
+            "INSERT INTO account_webkit_ledger_change (txid) "
+            "SELECT txid_current() WHERE NOT EXISTS "
+            "(SELECT 1 FROM account_webkit_ledger_change "
+            " WHERE txid = txid_current())")
+
+    @api.model
+    def _cron_compact(self, keep=10000):
+        """Delete the oldest changes, the version of the ledger changes
+        once more"""
+        self.env.cr.execute(
+            "DELETE FROM account_webkit_ledger_change "
+            "WHERE id <= (SELECT max(id) FROM account_webkit_ledger_change)"
+            " - %s", (keep,))
+        return True
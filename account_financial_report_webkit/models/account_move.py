@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
+
+from openerp import models
+
+
+class AccountMove(models.Model):
+    """
+    Keep the balance snapshot of the webkit reports up to date when the
+    moves are written, validated, posted, cancelled or deleted, and record
+    the changes of the moves in the version of the ledger used by the report
+    cache (the state of the moves is written in SQL by post and cancel)
+    """
+
+    _inherit = 'account.move'
+
+    def _track_balance_snapshot(self, cr, uid, ids, context=None):
+        self.pool['account.webkit.ledger.change'].record(cr, uid,
+                                                         context=context)
+        return self.pool['account.webkit.balance.snapshot'].track_moves(
+            cr, uid, ids, context=context)
+
+    # pylint: disable=old-api7-method-defined
+    def create(self, cr, uid, vals, context=None):
+        self.pool['account.webkit.ledger.change'].record(cr, uid,
+                                                         context=context)
+        return super(AccountMove, self).create(cr, uid, vals,
+                                               context=context)
+
+    # pylint: disable=old-api7-method-defined
+    def write(self, cr, uid, ids, vals, context=None):
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        with self._track_balance_snapshot(cr, uid, ids, context=context):
+            return super(AccountMove, self).write(cr, uid, ids, vals,
+                                                  context=context)
+
+    # pylint: disable=old-api7-method-defined
+    def validate(self, cr, uid, ids, context=None):
+        with self._track_balance_snapshot(cr, uid, ids, context=context):
+            return super(AccountMove, self).validate(cr, uid, ids,
+                                                     context=context)
+
+    # pylint: disable=old-api7-method-defined
+    def post(self, cr, uid, ids, context=None):
+        with self._track_balance_snapshot(cr, uid, ids, context=context):
+            return super(AccountMove, self).post(cr, uid, ids,
+                                                 context=context)
+
+    # pylint: disable=old-api7-method-defined
+    def button_cancel(self, cr, uid, ids, context=None):
+        with self._track_balance_snapshot(cr, uid, ids, context=context):
+            return super(AccountMove, self).button_cancel(cr, uid, ids,
+                                                          context=context)
+
+    # pylint: disable=old-api7-method-defined
+    def unlink(self, cr, uid, ids, context=None, check=True):
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        with self._track_balance_snapshot(cr, uid, ids, context=context):
+            return super(AccountMove, self).unlink(cr, uid, ids,
+                                                   context=context,
+                                                   check=check)
@@ -5,6 +5,11 @@
 
 from openerp import api, fields, models
 
+# fields of the move lines changing the sums of the balance snapshot
+SNAPSHOT_FIELDS = frozenset([
+    'account_id', 'period_id', 'partner_id', 'currency_id', 'company_id',
+    'debit', 'credit', 'amount_currency', 'move_id', 'state'])
+
 
 class AccountMoveLine(models.Model):
     """
@@ -38,3 +43,46 @@ class AccountMoveLine(models.Model):
                 move_lines = line.reconcile_partial_id.line_partial_ids
                 last_line = move_lines.sorted(lambda l: l.date)[-1]
                 line.last_rec_date = last_line.date
+
+    # pylint: disable=old-api7-method-defined
+    def create(self, cr, uid, vals, context=None, check=True):
+        self.pool['account.webkit.ledger.change'].record(cr, uid,
+                                                         context=context)
+        return super(AccountMoveLine, self).create(cr, uid, vals,
+                                                   context=context,
+                                                   check=check)
+
+    # pylint: disable=old-api7-method-defined
+    def write(self, cr, uid, ids, vals, context=None, check=True,
+              update_check=True):
+        self.pool['account.webkit.ledger.change'].record(cr, uid,
+                                                         context=context)
+        if not SNAPSHOT_FIELDS.intersection(vals):
+            return super(AccountMoveLine, self).write(
+                cr, uid, ids, vals, context=context, check=check,
+                update_check=update_check)
+        # lines moved to another move leave their previous sums in the
+        # balance snapshot
+        snapshot = self.pool['account.webkit.balance.snapshot']
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        move_ids = snapshot.get_line_moves(cr, uid, ids, context=context)
+        if vals.get('move_id'):
+            move_ids.add(vals['move_id'])
+        with snapshot.track_moves(cr, uid, move_ids, context=context):
+            return super(AccountMoveLine, self).write(
+                cr, uid, ids, vals, context=context, check=check,
+                update_check=update_check)
+
+    # pylint: disable=old-api7-method-defined
+    def unlink(self, cr, uid, ids, context=None, check=True):
+        self.pool['account.webkit.ledger.change'].record(cr, uid,
+                                                         context=context)
+        snapshot = self.pool['account.webkit.balance.snapshot']
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        move_ids = snapshot.get_line_moves(cr, uid, ids, context=context)
+        with snapshot.track_moves(cr, uid, move_ids, context=context):
+            return super(AccountMoveLine, self).unlink(cr, uid, ids,
+                                                       context=context,
+                                                       check=check)
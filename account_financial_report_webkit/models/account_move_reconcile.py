@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
+
+from openerp import models
+
+
+class AccountMoveReconcile(models.Model):
+    """
+    Record the reconciliations and unreconciliations of the entries in the
+    version of the ledger used by the report cache
+    """
+
+    _inherit = 'account.move.reconcile'
+
+    # pylint: disable=old-api7-method-defined
+    def create(self, cr, uid, vals, context=None):
+        self.pool['account.webkit.ledger.change'].record(cr, uid,
+                                                         context=context)
+        return super(AccountMoveReconcile, self).create(cr, uid, vals,
+                                                        context=context)
+
+    # pylint: disable=old-api7-method-defined
+    def write(self, cr, uid, ids, vals, context=None):
+        self.pool['account.webkit.ledger.change'].record(cr, uid,
+                                                         context=context)
+        return super(AccountMoveReconcile, self).write(cr, uid, ids, vals,
+                                                       context=context)
+
+    # pylint: disable=old-api7-method-defined
+    def unlink(self, cr, uid, ids, context=None):
+        self.pool['account.webkit.ledger.change'].record(cr, uid,
+                                                         context=context)
+        return super(AccountMoveReconcile, self).unlink(cr, uid, ids,
+                                                        context=context)
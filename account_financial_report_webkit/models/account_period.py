@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
+
+from openerp import api, models, tools
+
+
+class AccountPeriod(models.Model):
+    """
+    Cache the periods read by the webkit reports, the cache is cleared when
+    a period is created, modified or deleted
+    """
+
+    _inherit = 'account.period'
+
+    # pylint: disable=old-api7-method-defined
+    @tools.ormcache(skiparg=2)
+    def _get_webkit_report_periods(self, cr, uid):
+        """Return the periods as a tuple of dicts with the keys id,
+        date_start, date_stop, special, fiscalyear_id and company_id"""
+        period_ids = self.search(cr, uid, [])
+        return tuple(self.read(cr, uid, period_ids,
+                               ['date_start', 'date_stop', 'special',
+                                'fiscalyear_id', 'company_id'],
+                               load='_classic_write'))
+
+    @api.model
+    def create(self, vals):
+        self.clear_caches()
+        return super(AccountPeriod, self).create(vals)
+
+    @api.multi
+    def write(self, vals):
+        self.clear_caches()
+        return super(AccountPeriod, self).write(vals)
+
+    @api.multi
+    def unlink(self):
+        self.clear_caches()
+        return super(AccountPeriod, self).unlink()
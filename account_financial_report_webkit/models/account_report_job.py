@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
+
+import base64
+import json
+import logging
+import time
+import traceback
+from datetime import datetime, timedelta
+
+from psycopg2 import OperationalError, errorcodes
+
+from openerp import api, fields, models, tools
+from openerp.tools.translate import _
+
+_logger = logging.getLogger(__name__)
+
+# seconds after which a running job without progress is considered as
+# interrupted (worker killed, server restarted)
+JOB_TIMEOUT = int(tools.config.get('webkit_report_job_timeout', 7200))
+
+# errors of `FOR UPDATE NOWAIT` on a job locked by another transaction, or
+# changed by a transaction committed after the current one started
+LOCKED_JOB_ERRORS = (errorcodes.LOCK_NOT_AVAILABLE,
+                     errorcodes.SERIALIZATION_FAILURE)
+
+
+class AccountWebkitReportJob(models.Model):
+    """
+    Financial report printed in background.
+
+    The wizards enqueue the report action instead of returning it, the
+    pending jobs are rendered by the cron workers (or by `run_pending` in
+    the current transaction) and the result is stored as an attachment of
+    the job.
+    """
+
+    _name = 'account.webkit.report.job'
+    _description = 'Financial report printed in background'
+    _order = 'id desc'
+
+    name = fields.Char('Report', required=True, readonly=True)
+    report_name = fields.Char('Report Service', required=True,
+                              readonly=True)
+    data = fields.Text('Report Data', required=True, readonly=True)
+    state = fields.Selection(
+        [('pending', 'Pending'),
+         ('running', 'Running'),
+         ('done', 'Done'),
+         ('failed', 'Failed')],
+        'Status', required=True, readonly=True, default='pending')
+    user_id = fields.Many2one('res.users', 'User', required=True,
+                              readonly=True, default=lambda self: self._uid)
+    company_id = fields.Many2one(
+        'res.company', 'Company', readonly=True,
+        default=lambda self: self.env.user.company_id)
+    progress_done = fields.Integer('Accounts Done', readonly=True)
+    progress_total = fields.Integer('Accounts', readonly=True)
+    progress = fields.Float('Progress', compute='_compute_progress')
+    date_start = fields.Datetime('Started on', readonly=True)
+    date_done = fields.Datetime('Finished on', readonly=True)
+    attachment_id = fields.Many2one('ir.attachment', 'Result',
+                                    readonly=True, ondelete='set null')
+    error = fields.Text('Error', readonly=True)
+
+    @api.multi
+    @api.depends('state', 'progress_done', 'progress_total')
+    def _compute_progress(self):
+        for job in self:
+            if job.state == 'done':
+                job.progress = 100.0
+            elif job.progress_total:
+                job.progress = 100.0 * job.progress_done / job.progress_total
+
+    @api.model
+    def enqueue(self, report_name, data):
+        """Create the job printing the report `report_name` with `data`,
+        the datas of a report action
+
+        :return: id of the job
+        """
+        report = self.env['ir.actions.report.xml'].search(
+            [('report_name', '=', report_name)], limit=1)
+        job = self.create({
+            'name': report.name or report_name,
+            'report_name': report_name,
+            'data': json.dumps(data),
+        })
+        return job.id
+
+    @api.model
+    def report_progress(self, job_id, done, total):
+        """Store the progress of a job being rendered.
+
+        The progress is written and committed in its own transaction so it
+        is visible while the report is rendered. It is skipped when the job
+        is locked by the transaction rendering it, as in `run_pending`.
+        """
+        cr = self.pool.cursor()
+        try:
+            cr.execute("SELECT id FROM account_webkit_report_job "
+                       "WHERE id = %s FOR UPDATE NOWAIT", (job_id,),
+                       log_exceptions=False)
+            cr.execute("UPDATE account_webkit_report_job "
+                       "SET progress_done = %s, progress_total = %s, "
+                       "    write_date = now() at time zone 'UTC' "
+                       "WHERE id = %s", (done, total, job_id))
+            cr.commit()
+        except OperationalError, exc:
+            if exc.pgcode not in LOCKED_JOB_ERRORS:
+                raise
+        finally:
+            cr.close()
+
+    @api.multi
+    def _render(self):
+        """Render the report of the job with the rights and the language
+        of its user
+
+        :return: tuple (content, format, error), error is the traceback of
+                 the exception when the rendering failed
+        """
+        self.ensure_one()
+        data = json.loads(self.data)
+        cr, uid = self.env.cr, self.user_id.id
+        context = dict(self.pool['res.users'].context_get(cr, uid))
+        context['webkit_report_job_id'] = self.id
+        start = time.time()
+        try:
+            with cr.savepoint():
+                content, report_format = \
+                    self.pool['ir.actions.report.xml'].render_report(
+                        cr, uid, data.get('ids') or [], self.report_name,
+                        data, context=context)
+        except Exception:
+            _logger.exception('Report job %s failed', self.id)
+            return None, None, traceback.format_exc()
+        _logger.info('Report job %s (%s) rendered in %.2fs', self.id,
+                     self.report_name, time.time() - start)
+        return content, report_format, False
+
+    @api.multi
+    def _store_result(self, content, report_format, error):
+        """Attach the result of the rendering to the job"""
+        self.ensure_one()
+        vals = {'date_done': fields.Datetime.now()}
+        if error:
+            vals.update(state='failed', error=error)
+        else:
+            filename = '%s.%s' % (self.name, report_format)
+            attachment = self.env['ir.attachment'].create({
+                'name': filename,
+                'datas_fname': filename,
+                'datas': base64.b64encode(content),
+                'res_model': self._name,
+                'res_id': self.id,
+            })
+            vals.update(state='done', attachment_id=attachment.id,
+                        error=False)
+        self.write(vals)
+
+    @api.multi
+    def _run(self):
+        for job in self:
+            job.write({'state': 'running',
+                       'date_start': fields.Datetime.now(),
+                       'error': False})
+            job._store_result(*job._render())
+
+    @api.model
+    def run_pending(self, limit=None):
+        """Render the pending jobs in the current transaction, this is the
+        in-process worker"""
+        self.search([('state', '=', 'pending')], order='id',
+                    limit=limit)._run()
+        return True
+
+    @api.model
+    def _cron_run_pending(self, limit=None):
+        """Render the pending jobs, each in its own transactions so the
+        cron workers share the queue and the progress is visible.
+
+        The job is marked as running and committed before the rendering,
+        the result is stored in a new transaction so it does not conflict
+        with the progress written meanwhile.
+        """
+        self._fail_stale_jobs()
+        done = 0
+        while not limit or done < limit:
+            cr = self.pool.cursor()
+            try:
+                jobs = self.with_env(self.env(cr=cr))
+                job_id = jobs._claim_pending()
+                if not job_id:
+                    break
+                cr.commit()
+                job = jobs.browse(job_id)
+                result = job._render()
+                cr.commit()
+                job.invalidate_cache()
+                job._store_result(*result)
+                cr.commit()
+            finally:
+                cr.close()
+            done += 1
+        return True
+
+    @api.model
+    def _claim_pending(self):
+        """Mark as running the first pending job not claimed by another
+        worker
+
+        The jobs are locked with `FOR UPDATE NOWAIT`, a job locked or
+        claimed meanwhile by another worker is skipped.
+
+        :return: id of the job, None when no job is pending
+        """
+        cr = self.env.cr
+        cr.execute("SELECT id FROM account_webkit_report_job "
+                   "WHERE state = 'pending' ORDER BY id")
+        for job_id, in cr.fetchall():
+            try:
+                with cr.savepoint():
+                    cr.execute("SELECT id FROM account_webkit_report_job "
+                               "WHERE id = %s AND state = 'pending' "
+                               "FOR UPDATE NOWAIT", (job_id,),
+                               log_exceptions=False)
+                    claimed = bool(cr.fetchone())
+                    if claimed:
+                        cr.execute(
+                            "UPDATE account_webkit_report_job "
+                            "SET state = 'running', error = NULL, "
+                            "date_start = now() at time zone 'UTC', "
+                            "write_date = now() at time zone 'UTC' "
+                            "WHERE id = %s", (job_id,))
+            except OperationalError, exc:
+                if exc.pgcode not in LOCKED_JOB_ERRORS:
+                    raise
+                claimed = False
+            if claimed:
+                return job_id
+        return None
+
+    @api.multi
+    def _is_stale(self):
+        """Whether the job is running without progress for longer than
+        the timeout, its rendering was interrupted"""
+        self.ensure_one()
+        limit = datetime.utcnow() - timedelta(seconds=JOB_TIMEOUT)
+        return self.state == 'running' and \
+            fields.Datetime.from_string(self.write_date) < limit
+
+    @api.model
+    def _fail_stale_jobs(self):
+        """Mark as failed the running jobs without progress for longer than
+        the timeout, so they can be retried"""
+        cr = self.env.cr
+        cr.execute("UPDATE account_webkit_report_job "
+                   "SET state = 'failed', error = %s, "
+                   "    date_done = now() at time zone 'UTC', "
+                   "    write_date = now() at time zone 'UTC' "
+                   "WHERE state = 'running' "
+                   "AND write_date < (now() at time zone 'UTC') - "
+                   "    interval '1 second' * %s "
+                   "RETURNING id",
+                   (_('The rendering of the report was interrupted '
+                      '(worker killed or server restarted).'),
+                    JOB_TIMEOUT))
+        job_ids = [row[0] for row in cr.fetchall()]
+        if job_ids:
+            self.browse(job_ids).invalidate_cache()
+            _logger.warning('Report jobs %s interrupted, marked as failed',
+                            job_ids)
+        return job_ids
+
+    @api.multi
+    def button_retry(self):
+        self.filtered(
+            lambda job: job.state == 'failed' or job._is_stale()).write(
+            {'state': 'pending', 'progress_done': 0, 'error': False})
+        return True
+
+    @api.multi
+    def button_download(self):
+        self.ensure_one()
+        return {
+            'type': 'ir.actions.act_url',
+            'url': '/web/binary/saveas?model=ir.attachment&field=datas'
+                   '&filename_field=datas_fname&id=%s' %
+                   self.attachment_id.id,
+            'target': 'self',
+        }
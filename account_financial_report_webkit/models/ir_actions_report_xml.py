@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
+
+import logging
+
+from openerp import models
+
+from ..report.common_reports import CommonReportHeaderWebkit
+from ..report.pdf_renderers import PDF_RENDERER
+from ..report.result_cache import cache_key, result_cache
+
+_logger = logging.getLogger(__name__)
+
+# the ledger changes when the entries or their reconciliations change (see
+# account.webkit.ledger.change), or when the accounts and periods are
+# modified; the report itself changes with its definition and its header
+LEDGER_WATERMARK_QUERY = """
+SELECT (SELECT count(*) FROM account_webkit_ledger_change),
+       (SELECT min(id) FROM account_webkit_ledger_change),
+       (SELECT max(id) FROM account_webkit_ledger_change),
+       (SELECT max(write_date) FROM account_account),
+       (SELECT max(write_date) FROM account_period),
+       r.write_date, h.write_date
+FROM ir_act_report_xml r
+LEFT JOIN ir_header_webkit h ON (h.id = r.webkit_header)
+WHERE r.report_name = %s
+"""
+
+
+class IrActionsReportXml(models.Model):
+    """
+    Reuse the financial reports already rendered with the same wizard
+    parameters, by users having the same access rights, while the ledger
+    did not change
+    """
+
+    _inherit = 'ir.actions.report.xml'
+
+    # pylint: disable=old-api7-method-defined
+    def _get_webkit_report_cache_key(self, cr, uid, res_ids, name, data,
+                                     context=None):
+        """Key of a financial report in the result cache, False when the
+        report is not cached"""
+        if not result_cache.max_size or not (data or {}).get('form'):
+            return False
+        parser = getattr(self._lookup_report(cr, name), 'parser', None)
+        if not isinstance(parser, type) or \
+                not issubclass(parser, CommonReportHeaderWebkit):
+            return False
+        cr.execute(LEDGER_WATERMARK_QUERY, (name,))
+        watermark = cr.fetchone()
+        if not watermark:
+            return False
+        user = self.pool['res.users'].browse(cr, uid, uid, context=context)
+        access = (sorted(user.groups_id.ids), user.company_id.id,
+                  sorted(user.company_ids.ids))
+        context = context or {}
+        return cache_key(name, res_ids, data, access, watermark,
+                         context.get('lang'), context.get('tz'),
+                         context.get('webkit_pdf_renderer') or PDF_RENDERER)
+
+    # pylint: disable=old-api7-method-defined
+    def render_report(self, cr, uid, res_ids, name, data, context=None):
+        key = self._get_webkit_report_cache_key(cr, uid, res_ids, name, data,
+                                                context=context)
+        if key:
+            result = result_cache.get(key)
+            if result is not None:
+                _logger.debug('Report %s served from the cache', name)
+                return result
+        result = super(IrActionsReportXml, self).render_report(
+            cr, uid, res_ids, name, data, context=context)
+        if key:
+            result_cache.set(key, result)
+        return result
@@ -1,3 +1,13 @@
+from . import account_tree
+from . import aging
+from . import html_stream
+from . import pdf_chunks
+from . import pdf_renderers
+from . import native_pdf
+from . import period_calendar
+from . import progress
+from . import result_cache
+from . import wkhtmltopdf_pool
 from . import common_reports
 from . import common_partner_reports
 from . import common_balance_reports
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+from collections import defaultdict
+
+
+class AccountTree(object):
+
+    """Structure of a set of accounts kept in memory.
+
+    Children are indexed by parent once, so walking the tree does not need
+    to scan the whole list of accounts at each node. The consolidation
+    children of an account are considered as being on the same level as its
+    regular children.
+    """
+
+    def __init__(self, accounts_data=None):
+        self.accounts = {}
+        self._children = defaultdict(list)
+        self._consol_children = defaultdict(list)
+        self._sorted_children = {}
+        if accounts_data:
+            self.add(accounts_data)
+
+    def add(self, accounts_data):
+        """Add accounts to the tree
+
+        :param accounts_data: list of dicts with at least the keys id,
+            parent_id, code, level and child_consol_ids as returned by
+            `account.account.read`
+        """
+        for account in accounts_data:
+            if account['id'] in self.accounts:
+                continue
+            self.accounts[account['id']] = account
+            parent_id = account['parent_id']
+            if isinstance(parent_id, (list, tuple)):
+                parent_id = parent_id[0]
+            if parent_id:
+                self._children[parent_id].append(account['id'])
+            for child_id in account.get('child_consol_ids') or []:
+                self._consol_children[account['id']].append(child_id)
+        self._sorted_children = {}
+
+    def __contains__(self, account_id):
+        return account_id in self.accounts
+
+    def children(self, account_id, account_ids=None):
+        """Return the children and the consolidation children of an account
+        sorted by code
+
+        :param account_ids: if given, only the children in this set are
+            returned
+        """
+        children = self._sorted_children.get(account_id)
+        if children is None:
+            children = [
+                child_id for child_id in
+                self._children.get(account_id, []) +
+                self._consol_children.get(account_id, [])
+                if child_id in self.accounts]
+            children.sort(
+                key=lambda child_id: self.accounts[child_id]['code'])
+            self._sorted_children[account_id] = children
+        if account_ids is not None:
+            return [child_id for child_id in children
+                    if child_id in account_ids]
+        return children
+
+    def sort(self, root_account_ids, account_ids):
+        """Return account_ids ordered depth-first, the children of an
+        account being sorted by code.
+
+        Only the accounts reachable from root_account_ids are returned.
+        An account reachable by several paths is returned once per path.
+        """
+        root_account_ids = set(root_account_ids)
+        roots = [account_id for account_id in account_ids
+                 if account_id in root_account_ids and account_id in self]
+        account_ids = set(account_ids)
+        sorted_accounts = []
+        stack = list(reversed(roots))
+        while stack:
+            account_id = stack.pop()
+            sorted_accounts.append(account_id)
+            # stop on cycles, the result will be rejected by the caller as
+            # its length won't match
+            if len(sorted_accounts) > len(account_ids):
+                break
+            stack.extend(reversed(self.children(account_id, account_ids)))
+        return sorted_accounts
+
+    def descendants(self, account_id, account_ids=None):
+        """Return the account and all its children and consolidation
+        children recursively, like `_get_children_and_consol`"""
+        res = []
+        seen = set()
+        stack = [account_id]
+        while stack:
+            current_id = stack.pop()
+            if current_id in seen:
+                continue
+            seen.add(current_id)
+            res.append(current_id)
+            stack.extend(self.children(current_id, account_ids))
+        return res
+
+    def rollup(self, values, keys):
+        """Sum the amounts of each account into all its ancestors.
+
+        Each account is visited once, children before their parents, so the
+        cost is linear in the number of accounts of the tree.
+
+        :param values: dict {account_id: {key: amount}}
+        :param keys: keys of the amounts to sum
+        :return: dict {account_id: {key: amount of the account and all its
+                 descendants}} for all the accounts of the tree
+        """
+        totals = {}
+        visiting = set()
+        for root_id in self.accounts:
+            if root_id in totals:
+                continue
+            stack = [(root_id, False)]
+            while stack:
+                account_id, children_done = stack.pop()
+                if children_done:
+                    visiting.discard(account_id)
+                    account_values = values.get(account_id) or {}
+                    total = dict((key, account_values.get(key) or 0.0)
+                                 for key in keys)
+                    for child_id in self.children(account_id):
+                        child_total = totals.get(child_id)
+                        if child_total is None:
+                            continue
+                        for key in keys:
+                            total[key] += child_total[key]
+                    totals[account_id] = total
+                elif account_id not in totals and \
+                        account_id not in visiting:
+                    visiting.add(account_id)
+                    stack.append((account_id, True))
+                    stack.extend((child_id, False) for child_id
+                                 in self.children(account_id)
+                                 if child_id not in totals)
+        return totals
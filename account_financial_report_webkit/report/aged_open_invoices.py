@@ -24,8 +24,8 @@ from __future__ import division
 from datetime import datetime
 
 from openerp.modules.registry import RegistryManager
-from openerp.tools import DEFAULT_SERVER_DATE_FORMAT
 from openerp.tools.translate import _
+from .aging import DateOrdinals, classify_delay, range_bounds
 from .open_invoices import PartnersOpenInvoicesWebkit
 from .webkit_parser_header_fix import HeaderFooterTextWebKitParser
 
@@ -48,6 +48,8 @@ def make_ranges(top, offset):
 
 # list of overdue ranges
 RANGES = make_ranges(120, 30)
+# upper bounds of the overdue ranges
+RANGES_BOUNDS = range_bounds(RANGES)
 
 
 def make_ranges_titles():
@@ -79,6 +81,7 @@ class AccountAgedOpenInvoicesWebkit(PartnersOpenInvoicesWebkit):
                                                             context=context)
         self.pool = RegistryManager.get(self.cr.dbname)
         self.cursor = self.cr
+        self._date_ordinals = DateOrdinals()
         company = self.pool.get('res.users').browse(self.cr, uid, uid,
                                                     context=context).company_id
 
@@ -95,6 +98,7 @@ class AccountAgedOpenInvoicesWebkit(PartnersOpenInvoicesWebkit):
             'ranges': self._get_ranges(),
             'ranges_titles': self._get_ranges_titles(),
             'report_name': _('Aged Open Invoices'),
+            'track_progress': self._track_progress,
             'additional_args': [
                 ('--header-font-name', 'Helvetica'),
                 ('--footer-font-name', 'Helvetica'),
@@ -148,6 +152,7 @@ class AccountAgedOpenInvoicesWebkit(PartnersOpenInvoicesWebkit):
         for classif in self.localcontext['ranges']:
             aged_dict[classif] = 0.0
 
+        end_date = self._get_end_date(data)
         for acc in self.objects:
             aged_open_inv[acc.id] = aged_dict.copy()
             aged_open_inv[acc.id]['balance'] = 0.0
@@ -159,7 +164,8 @@ class AccountAgedOpenInvoicesWebkit(PartnersOpenInvoicesWebkit):
                 aged_open_inv[acc.id][part_id]['lines'] = list(partner_lines)
                 for line in aged_open_inv[acc.id][part_id]['lines']:
                     line.update(aged_dict)
-                    self.compute_aged_line(part_id, line, data)
+                    self.compute_aged_line(part_id, line, data,
+                                           end_date=end_date)
                     aged_open_inv[acc.id][part_id]['balance'] +=\
                         line['balance']
                     aged_open_inv[acc.id]['balance'] += line['balance']
@@ -174,7 +180,8 @@ class AccountAgedOpenInvoicesWebkit(PartnersOpenInvoicesWebkit):
         })
         return res
 
-    def compute_aged_line(self, partner_id, ledger_line, data):
+    def compute_aged_line(self, partner_id, ledger_line, data,
+                          end_date=None):
         """Add classification to accounts browse records
 
         contained in :attr:`objects` for a given partner
@@ -182,14 +189,21 @@ class AccountAgedOpenInvoicesWebkit(PartnersOpenInvoicesWebkit):
         :param: partner_id: current partner
         :param ledger_line: generated by parent
                  :class:`.open_invoices.PartnersOpenInvoicesWebkit`
+        :param end_date: end date of the delays, computed from data when
+                 not given
 
         :returns: dict of computed aged lines
                   eg {'balance': 1000.0,
                        'aged_lines': {(90, 120): 0.0, ...}
 
         """
-        end_date = self._get_end_date(data)
-        reconcile_lookup = self.get_reconcile_count_lookup([ledger_line])
+        if end_date is None:
+            end_date = self._get_end_date(data)
+        # a single line cannot belong to a partial reconcile of several
+        # lines, no need to count them in the database
+        reconcile_lookup = {}
+        if ledger_line['reconcile_partial_id']:
+            reconcile_lookup[ledger_line['rec_id']] = 1
         compute_method = self.get_compute_method(reconcile_lookup,
                                                  partner_id,
                                                  ledger_line)
@@ -236,10 +250,8 @@ class AccountAgedOpenInvoicesWebkit(PartnersOpenInvoicesWebkit):
 
         :returns: delta in days
         """
-        from_date = datetime.strptime(line[key], DEFAULT_SERVER_DATE_FORMAT)
-        end_date = datetime.strptime(end_date, DEFAULT_SERVER_DATE_FORMAT)
-        delta = end_date - from_date
-        return delta.days
+        return (self._date_ordinals[end_date] -
+                self._date_ordinals[line[key]])
 
     def compute_delay_from_maturity(self, line, end_date, ledger_lines):
         """Compute overdue delay delta in days for line using attribute in key
@@ -349,9 +361,8 @@ class AccountAgedOpenInvoicesWebkit(PartnersOpenInvoicesWebkit):
     def classify_line(self, partner_id, overdue_days):
         """Return the overdue range for a given delay
 
-        We loop from smaller range to higher
-        This should be the most effective solution as generaly
-        customer tend to have one or two month of delay
+        The range is found by a binary search over the upper bounds of
+        :const:`RANGES`
 
         :param overdue_days: delay in days
         :param partner_id: current partner_id
@@ -359,10 +370,7 @@ class AccountAgedOpenInvoicesWebkit(PartnersOpenInvoicesWebkit):
         :returns: the correct range in :const:`RANGES`
 
         """
-        for drange in RANGES:
-            if overdue_days <= drange[1]:
-                return drange
-        return drange
+        return classify_delay(overdue_days, RANGES, RANGES_BOUNDS)
 
     def compute_balance(self, res, aged_lines):
         """Compute the total balance of aged line
@@ -19,11 +19,13 @@
 #
 ##############################################################################
 from __future__ import division
+from collections import defaultdict
 from datetime import datetime
 
+from openerp import tools
 from openerp.modules.registry import RegistryManager
-from openerp.tools import DEFAULT_SERVER_DATE_FORMAT
 from openerp.tools.translate import _
+from .aging import DateOrdinals, classify_delay, range_bounds
 from .open_invoices import PartnersOpenInvoicesWebkit
 from .webkit_parser_header_fix import HeaderFooterTextWebKitParser
 
@@ -46,6 +48,8 @@ def make_ranges(top, offset):
 
 # list of overdue ranges
 RANGES = make_ranges(120, 30)
+# upper bounds of the overdue ranges
+RANGES_BOUNDS = range_bounds(RANGES)
 
 
 def make_ranges_titles():
@@ -63,6 +67,10 @@ REC_PAY_TYPE = ('purchase', 'sale')
 # list of refund payable type
 REFUND_TYPE = ('purchase_refund', 'sale_refund')
 INV_TYPE = REC_PAY_TYPE + REFUND_TYPE
+# 'python' ages the lines of the open invoices report, 'sql' computes the
+# aged amounts in the database and only loads the lines of the partial
+# reconciliations with several lines
+AGING_MODE = tools.config.get('webkit_report_aging_mode', 'python')
 
 
 class AccountAgedTrialBalanceWebkit(PartnersOpenInvoicesWebkit):
@@ -77,6 +85,9 @@ class AccountAgedTrialBalanceWebkit(PartnersOpenInvoicesWebkit):
                                                             context=context)
         self.pool = RegistryManager.get(self.cr.dbname)
         self.cursor = self.cr
+        self._date_ordinals = DateOrdinals()
+        self._sql_aging_end_date = False
+        self._sql_aged_lines = None
         company = self.pool.get('res.users').browse(self.cr, uid, uid,
                                                     context=context).company_id
 
@@ -93,6 +104,7 @@ class AccountAgedTrialBalanceWebkit(PartnersOpenInvoicesWebkit):
             'ranges': self._get_ranges(),
             'ranges_titles': self._get_ranges_titles(),
             'report_name': _('Aged Partner Balance'),
+            'track_progress': self._track_progress,
             'additional_args': [
                 ('--header-font-name', 'Helvetica'),
                 ('--footer-font-name', 'Helvetica'),
@@ -132,6 +144,9 @@ class AccountAgedTrialBalanceWebkit(PartnersOpenInvoicesWebkit):
 
         """
 
+        if self._get_form_param('aging_mode', data,
+                                default=AGING_MODE) == 'sql':
+            self._sql_aging_end_date = self._get_end_date(data)
         res = super(AccountAgedTrialBalanceWebkit, self).set_context(
             objects,
             data,
@@ -143,19 +158,26 @@ class AccountAgedTrialBalanceWebkit(PartnersOpenInvoicesWebkit):
         agged_totals_accounts = {}
         agged_percents_accounts = {}
 
+        end_date = self._get_end_date(data)
         for acc in self.objects:
             agged_lines_accounts[acc.id] = {}
             agged_totals_accounts[acc.id] = {}
             agged_percents_accounts[acc.id] = {}
 
-            for part_id, partner_lines in\
-                    self.localcontext['ledger_lines'][acc.id].items():
-
-                aged_lines = self.compute_aged_lines(part_id,
-                                                     partner_lines,
-                                                     data)
-                if aged_lines:
-                    agged_lines_accounts[acc.id][part_id] = aged_lines
+            if self._sql_aged_lines is not None:
+                agged_lines_accounts[acc.id] = self._sql_aged_lines.get(
+                    acc.id, {})
+            else:
+                account_lines = self.localcontext['ledger_lines'][acc.id]
+                reconcile_index = self.get_reconcile_index(account_lines)
+                for part_id, partner_lines in account_lines.items():
+
+                    aged_lines = self.compute_aged_lines(
+                        part_id, partner_lines, data,
+                        reconcile_index=reconcile_index.get(part_id, {}),
+                        end_date=end_date)
+                    if aged_lines:
+                        agged_lines_accounts[acc.id][part_id] = aged_lines
             agged_totals_accounts[acc.id] = totals = self.compute_totals(
                 agged_lines_accounts[acc.id].values())
             agged_percents_accounts[acc.id] = self.compute_percents(totals)
@@ -170,7 +192,116 @@ class AccountAgedTrialBalanceWebkit(PartnersOpenInvoicesWebkit):
         del(self.localcontext['ledger_lines'])
         return res
 
-    def compute_aged_lines(self, partner_id, ledger_lines, data):
+    def _compute_open_transactions_lines(self, accounts_ids, main_filter,
+                                         target_move, start, stop,
+                                         date_until=False,
+                                         partner_filter=False):
+        """In sql aging mode, the aged lines are computed instead of the
+        open lines, which are returned empty per account and partner"""
+        if not self._sql_aging_end_date:
+            return super(AccountAgedTrialBalanceWebkit,
+                         self)._compute_open_transactions_lines(
+                accounts_ids, main_filter, target_move, start, stop,
+                date_until=date_until, partner_filter=partner_filter)
+        self._sql_aged_lines = self.compute_sql_aged_lines(
+            self._sql_aging_end_date, accounts_ids, main_filter, target_move,
+            start, stop, date_until=date_until,
+            partner_filter=partner_filter)
+        return dict((account_id, dict((partner_id, [])
+                                      for partner_id in partners))
+                    for account_id, partners
+                    in self._sql_aged_lines.iteritems())
+
+    def compute_sql_aged_lines(self, end_date, accounts_ids, main_filter,
+                               target_move, start, stop, date_until=False,
+                               partner_filter=False):
+        """Compute the aged lines of all the partners in the database
+
+        The lines are the ones of the open invoices report. The delay of
+        a line is computed from its maturity date for invoices having one
+        and from its date otherwise, like :meth:`get_compute_method`.
+        The lines of a partial reconcile with several lines of the same
+        partner are loaded and aged with
+        :meth:`compute_delay_from_partial_rec`.
+
+        The hooks :meth:`line_is_valid`, :meth:`get_compute_method` and
+        :meth:`classify_line` are not applied to the other lines.
+
+        :returns: dict {account_id: {partner_id: aged lines}}, the aged
+                  lines being the ones returned by :meth:`compute_aged_lines`
+        """
+        lines_sql, params = self._get_open_transactions_lines_query(
+            accounts_ids, main_filter, target_move, start, stop,
+            date_until=date_until, partner_filter=partner_filter)
+        buckets = ' '.join('WHEN delay <= %d THEN %d' % (bound, index)
+                           for index, bound
+                           in enumerate(RANGES_BOUNDS[:-1]))
+        sums = ', '.join('SUM(CASE WHEN bucket = %d THEN amount '
+                         'ELSE 0.0 END)' % index
+                         for index in range(len(RANGES)))
+        sql = (
+            "WITH report_lines AS (" + lines_sql + "), "
+            "aged AS ("
+            "  SELECT rl.id, rl.account_id, rl.partner_id,"
+            "    COALESCE(l.debit, 0.0) - COALESCE(l.credit, 0.0) AS amount,"
+            "    date(%(aging_end_date)s) - CASE"
+            "      WHEN j.type IN %(inv_types)s"
+            "        AND l.date_maturity IS NOT NULL THEN l.date_maturity"
+            "      ELSE l.date END AS delay,"
+            "    COUNT(l.reconcile_partial_id) OVER ("
+            "      PARTITION BY rl.account_id, rl.partner_id,"
+            "                   l.reconcile_partial_id) AS partial_count"
+            "  FROM report_lines rl"
+            "  INNER JOIN account_move_line l ON l.id = rl.id"
+            "  INNER JOIN account_journal j ON j.id = l.journal_id) "
+            "SELECT account_id, partner_id, partial_line_id, " + sums + " "
+            "FROM (SELECT account_id, partner_id, amount,"
+            "        CASE " + buckets + " ELSE %d END AS bucket," % (
+                len(RANGES) - 1) +
+            "        CASE WHEN partial_count > 1 THEN id"
+            "        END AS partial_line_id"
+            "      FROM aged) AS classified "
+            "GROUP BY account_id, partner_id, partial_line_id")
+        params.update({'aging_end_date': end_date,
+                       'inv_types': INV_TYPE})
+        self.cursor.execute(sql, params)
+
+        res = defaultdict(dict)
+        partial_groups = defaultdict(list)
+        for row in self.cursor.fetchall():
+            account_id, partner_id, partial_line_id = row[:3]
+            if partner_id not in res[account_id]:
+                res[account_id][partner_id] = {
+                    'aged_lines': dict.fromkeys(RANGES, 0.0)}
+            if partial_line_id:
+                partial_groups[partial_line_id].append(
+                    (account_id, partner_id))
+                continue
+            aged_lines = res[account_id][partner_id]['aged_lines']
+            for drange, amount in zip(RANGES, row[3:]):
+                aged_lines[drange] += amount
+
+        partial_lines = defaultdict(list)
+        for line in self._iter_move_line_datas(partial_groups.keys()):
+            for group in partial_groups[line['id']]:
+                partial_lines[group].append(line)
+        for (account_id, partner_id), lines in partial_lines.iteritems():
+            aged_lines = res[account_id][partner_id]['aged_lines']
+            reconcile_index = self.get_reconcile_index(
+                {partner_id: lines})[partner_id]
+            for line in lines:
+                delay = self.compute_delay_from_partial_rec(
+                    line, end_date, lines, reconcile_index=reconcile_index)
+                classification = self.classify_line(partner_id, delay)
+                aged_lines[classification] += line['debit'] - line['credit']
+
+        for account_res in res.itervalues():
+            for partner_res in account_res.itervalues():
+                self.compute_balance(partner_res, partner_res['aged_lines'])
+        return res
+
+    def compute_aged_lines(self, partner_id, ledger_lines, data,
+                           reconcile_index=None, end_date=None):
         """Add property aged_lines to accounts browse records
 
         contained in :attr:`objects` for a given partner
@@ -178,6 +309,11 @@ class AccountAgedTrialBalanceWebkit(PartnersOpenInvoicesWebkit):
         :param: partner_id: current partner
         :param ledger_lines: generated by parent
                  :class:`.open_invoices.PartnersOpenInvoicesWebkit`
+        :param reconcile_index: partial reconciliations of the partner
+                 as returned by :meth:`get_reconcile_index`, computed
+                 from ledger_lines when not given
+        :param end_date: end date of the delays, computed from data when
+                 not given
 
         :returns: dict of computed aged lines
                   eg {'balance': 1000.0,
@@ -186,15 +322,24 @@ class AccountAgedTrialBalanceWebkit(PartnersOpenInvoicesWebkit):
         """
         lines_to_age = self.filter_lines(partner_id, ledger_lines)
         res = {}
-        end_date = self._get_end_date(data)
+        if end_date is None:
+            end_date = self._get_end_date(data)
         aged_lines = dict.fromkeys(RANGES, 0.0)
-        reconcile_lookup = self.get_reconcile_count_lookup(lines_to_age)
+        if reconcile_index is None:
+            reconcile_index = self.get_reconcile_index(
+                {partner_id: ledger_lines}).get(partner_id, {})
+        reconcile_lookup = dict((rec_id, rec['count']) for rec_id, rec
+                                in reconcile_index.iteritems())
         res['aged_lines'] = aged_lines
         for line in lines_to_age:
             compute_method = self.get_compute_method(reconcile_lookup,
                                                      partner_id,
                                                      line)
-            delay = compute_method(line, end_date, ledger_lines)
+            if compute_method == self.compute_delay_from_partial_rec:
+                delay = compute_method(line, end_date, ledger_lines,
+                                       reconcile_index=reconcile_index)
+            else:
+                delay = compute_method(line, end_date, ledger_lines)
             classification = self.classify_line(partner_id, delay)
             aged_lines[classification] += line['debit'] - line['credit']
         self.compute_balance(res, aged_lines)
@@ -239,10 +384,8 @@ class AccountAgedTrialBalanceWebkit(PartnersOpenInvoicesWebkit):
 
         :returns: delta in days
         """
-        from_date = datetime.strptime(line[key], DEFAULT_SERVER_DATE_FORMAT)
-        end_date = datetime.strptime(end_date, DEFAULT_SERVER_DATE_FORMAT)
-        delta = end_date - from_date
-        return delta.days
+        return (self._date_ordinals[end_date] -
+                self._date_ordinals[line[key]])
 
     def compute_delay_from_maturity(self, line, end_date, ledger_lines):
         """Compute overdue delay delta in days for line using attribute in key
@@ -276,7 +419,8 @@ class AccountAgedTrialBalanceWebkit(PartnersOpenInvoicesWebkit):
                                             line,
                                             end_date)
 
-    def compute_delay_from_partial_rec(self, line, end_date, ledger_lines):
+    def compute_delay_from_partial_rec(self, line, end_date, ledger_lines,
+                                       reconcile_index=None):
         """Compute overdue delay delta in days for the case where move line
 
         is related to a partial reconcile with more than one reconcile line
@@ -285,17 +429,25 @@ class AccountAgedTrialBalanceWebkit(PartnersOpenInvoicesWebkit):
         :param end_date: end_date computed for wizard data
         :param ledger_lines: generated by parent
                  :class:`.open_invoices.PartnersOpenInvoicesWebkit`
+        :param reconcile_index: partial reconciliations of the partner
+                 as returned by :meth:`get_reconcile_index`, ledger_lines
+                 are scanned when not given
 
         :returns: delta in days
         """
-        sale_lines = [
-            x for x in ledger_lines if x['jtype'] in REC_PAY_TYPE and
-            line['rec_id'] == x['rec_id']
-        ]
-        refund_lines = [
-            x for x in ledger_lines if x['jtype'] in REFUND_TYPE and
-            line['rec_id'] == x['rec_id']
-        ]
+        if reconcile_index is not None:
+            reconcile = reconcile_index[line['rec_id']]
+            sale_lines = reconcile['sale_lines']
+            refund_lines = reconcile['refund_lines']
+        else:
+            sale_lines = [
+                x for x in ledger_lines if x['jtype'] in REC_PAY_TYPE and
+                line['rec_id'] == x['rec_id']
+            ]
+            refund_lines = [
+                x for x in ledger_lines if x['jtype'] in REFUND_TYPE and
+                line['rec_id'] == x['rec_id']
+            ]
         if len(sale_lines) == 1:
             reference_line = sale_lines[0]
         elif len(refund_lines) == 1:
@@ -354,9 +506,8 @@ class AccountAgedTrialBalanceWebkit(PartnersOpenInvoicesWebkit):
     def classify_line(self, partner_id, overdue_days):
         """Return the overdue range for a given delay
 
-        We loop from smaller range to higher
-        This should be the most effective solution as generaly
-        customer tend to have one or two month of delay
+        The range is found by a binary search over the upper bounds of
+        :const:`RANGES`
 
         :param overdue_days: delay in days
         :param partner_id: current partner_id
@@ -364,10 +515,7 @@ class AccountAgedTrialBalanceWebkit(PartnersOpenInvoicesWebkit):
         :returns: the correct range in :const:`RANGES`
 
         """
-        for drange in RANGES:
-            if overdue_days <= drange[1]:
-                return drange
-        return drange
+        return classify_delay(overdue_days, RANGES, RANGES_BOUNDS)
 
     def compute_balance(self, res, aged_lines):
         """Compute the total balance of aged line
@@ -398,6 +546,44 @@ class AccountAgedTrialBalanceWebkit(PartnersOpenInvoicesWebkit):
             percents[drange] = (totals[drange] / base) * 100.0
         return percents
 
+    def get_reconcile_index(self, ledger_lines_per_partner):
+        """Index the partial reconciliations of the lines of an account
+
+        The index is built in one pass over the lines, so the delay of
+        partially reconciled lines is computed without scanning the lines
+        of the partner again nor querying the database.
+
+        :param ledger_lines_per_partner: dict {partner_id: ledger lines}
+                generated by parent
+                :class:`.open_invoices.PartnersOpenInvoicesWebkit`
+
+        :returns: dict {partner_id: {rec_id: {'sale_lines': [...],
+                                              'refund_lines': [...],
+                                              'count': n}}}
+                  where count is the number of lines to age related to
+                  the partial reconcile, like
+                  :meth:`get_reconcile_count_lookup`
+        """
+        index = {}
+        for partner_id, lines in ledger_lines_per_partner.iteritems():
+            partner_index = index[partner_id] = {}
+            for line in lines:
+                rec_id = line['rec_id']
+                if not rec_id:
+                    continue
+                reconcile = partner_index.get(rec_id)
+                if reconcile is None:
+                    reconcile = partner_index[rec_id] = {
+                        'sale_lines': [], 'refund_lines': [], 'count': 0}
+                if line['jtype'] in REC_PAY_TYPE:
+                    reconcile['sale_lines'].append(line)
+                elif line['jtype'] in REFUND_TYPE:
+                    reconcile['refund_lines'].append(line)
+                if line['reconcile_partial_id'] and \
+                        self.line_is_valid(partner_id, line):
+                    reconcile['count'] += 1
+        return index
+
     def get_reconcile_count_lookup(self, lines):
         """Compute an lookup dict
 
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+"""Helpers used by the aged reports to classify lines by overdue delay"""
+from bisect import bisect_left
+from datetime import datetime
+
+from openerp.tools import DEFAULT_SERVER_DATE_FORMAT
+
+
+class DateOrdinals(dict):
+
+    """Day ordinals of dates in server format, each date is parsed once
+
+    The delay in days between two dates is the difference of their
+    ordinals.
+    """
+
+    def __missing__(self, date):
+        ordinal = datetime.strptime(
+            date, DEFAULT_SERVER_DATE_FORMAT).toordinal()
+        self[date] = ordinal
+        return ordinal
+
+
+def range_bounds(ranges):
+    """Return the upper bounds of sorted days ranges
+
+    :param ranges: list of sorted ranges tuples as returned by `make_ranges`
+    """
+    return [drange[1] for drange in ranges]
+
+
+def classify_delay(overdue_days, ranges, bounds):
+    """Return the first range whose upper bound is greater than or equal to
+    the delay, or the last range
+
+    :param overdue_days: delay in days
+    :param ranges: list of sorted ranges tuples
+    :param bounds: upper bounds of the ranges as returned by `range_bounds`
+    """
+    index = bisect_left(bounds, overdue_days)
+    return ranges[min(index, len(ranges) - 1)]
+
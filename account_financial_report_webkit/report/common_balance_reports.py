@@ -20,9 +20,8 @@
 #
 ##############################################################################
 
-from operator import add
-
 from .common_reports import CommonReportHeaderWebkit
+from ..models.account_balance_snapshot import snapshot_enabled
 from openerp import tools
 
 
@@ -55,39 +54,186 @@ class CommonBalanceReportHeaderWebkit(CommonReportHeaderWebkit):
         @return: dict of list containing accounts details, keys are
                  the account ids
         """
+        column = {
+            'fiscalyear': fiscalyear,
+            'main_filter': main_filter,
+            'start': start,
+            'stop': stop,
+            'initial_balance_mode': initial_balance_mode,
+        }
+        return self._get_accounts_details_by_columns(
+            account_ids, target_move, [column], context=context)[0]
+
+    def _get_accounts_details_by_columns(self, account_ids, target_move,
+                                         columns, context=None):
+        """
+        Get details of accounts for several columns (main column and
+        comparisons) at once: the debit and credit of all the columns are
+        computed in one grouped query, then summed in the parent accounts.
+        @param account_ids: ids of accounts to get details
+        @param target_move: selection filter for moves (all or posted)
+        @param columns: list of dicts with the keys fiscalyear, main_filter,
+               start, stop and initial_balance_mode, see
+               `_get_account_details`
+        @return: list of dicts of accounts details, one per column
+        """
         if context is None:
             context = {}
+        if not account_ids:
+            return [{} for column in columns]
 
         account_obj = self.pool.get('account.account')
-        period_obj = self.pool.get('account.period')
-        use_period_ids = main_filter in (
-            'filter_no', 'filter_period', 'filter_opening')
-
-        if use_period_ids:
-            if main_filter == 'filter_opening':
-                period_ids = [start.id]
-            else:
-                period_ids = period_obj.build_ctx_periods(
-                    self.cursor, self.uid, start.id, stop.id)
-                # never include the opening in the debit / credit amounts
-                period_ids = self.exclude_opening_periods(period_ids)
-
-        init_balance = False
+        all_account_ids = account_obj._get_children_and_consol(
+            self.cursor, self.uid, account_ids, context=context)
+        # amounts of the children in another currency are converted by the
+        # orm when summed in their parents
+        if not self._accounts_share_currency(all_account_ids):
+            return [self._read_account_details(account_ids, target_move,
+                                               column, context=context)
+                    for column in columns]
+
+        tree = self._get_account_tree(all_account_ids, context=context)
+        accounts = account_obj.read(
+            self.cursor, self.uid, account_ids,
+            ['type', 'code', 'name', 'parent_id', 'level', 'child_id'],
+            context=context)
+        amounts_by_columns = self._get_accounts_amounts_by_columns(
+            all_account_ids, target_move, columns)
+
+        res = []
+        for column, amounts in zip(columns, amounts_by_columns):
+            totals = tree.rollup(amounts, ('debit', 'credit', 'balance'))
+            init_balance = self._get_column_initial_balances(
+                all_account_ids, column)
+            if init_balance:
+                # sum for top level views accounts
+                init_balance_totals = tree.rollup(init_balance,
+                                                  ('init_balance',))
+            accounts_by_id = {}
+            for account in accounts:
+                account = dict(account, **totals[account['id']])
+                if init_balance:
+                    account['init_balance'] = \
+                        init_balance_totals[account['id']]['init_balance']
+                    account['balance'] = account['init_balance'] + \
+                        account['debit'] - account['credit']
+                accounts_by_id[account['id']] = account
+            res.append(accounts_by_id)
+        return res
+
+    def _accounts_share_currency(self, account_ids):
+        self.cursor.execute("SELECT DISTINCT c.currency_id"
+                            " FROM account_account a"
+                            " JOIN res_company c ON c.id = a.company_id"
+                            " WHERE a.id in %s",
+                            (tuple(account_ids),))
+        return len(self.cursor.fetchall()) <= 1
+
+    def _get_column_period_ids(self, column):
+        """Return the periods of the debit / credit amounts of a column
+        or None when the column is filtered by dates"""
+        main_filter = column['main_filter']
+        if main_filter not in ('filter_no', 'filter_period', 'filter_opening'):
+            return None
+        if main_filter == 'filter_opening':
+            return [column['start'].id]
+        period_ids = self.pool.get('account.period').build_ctx_periods(
+            self.cursor, self.uid, column['start'].id, column['stop'].id)
+        # never include the opening in the debit / credit amounts
+        return self.exclude_opening_periods(period_ids)
+
+    def _get_column_initial_balances(self, account_ids, column):
+        initial_balance_mode = column['initial_balance_mode']
         if initial_balance_mode == 'opening_balance':
-            init_balance = self._read_opening_balance(account_ids, start)
+            return self._read_opening_balance(account_ids, column['start'])
         elif initial_balance_mode:
-            init_balance = self._compute_initial_balances(
-                account_ids, start, fiscalyear)
+            return self._compute_initial_balances(
+                account_ids, column['start'], column['fiscalyear'])
+        return False
+
+    def _get_accounts_amounts_by_columns(self, account_ids, target_move,
+                                         columns):
+        """Compute the debit, credit and balance of the accounts (without
+        their children) for each column in one grouped query, each column
+        summing only the move lines matching its own periods or dates.
+
+        @return: list of dicts {account_id: {'debit', 'credit', 'balance'}},
+                 one per column
+        """
+        params = {'account_ids': tuple(account_ids)}
+        selects = []
+        conditions = []
+        from_snapshot = snapshot_enabled()
+        for index, column in enumerate(columns):
+            period_ids = self._get_column_period_ids(column)
+            if period_ids is None:
+                from_snapshot = False
+                condition = "(l.date >= %(date_from_{0})s" \
+                            " AND l.date <= %(date_to_{0})s)".format(index)
+                params.update({'date_from_%s' % index: column['start'],
+                               'date_to_%s' % index: column['stop']})
+            elif period_ids:
+                condition = "l.period_id in %(period_ids_{0})s".format(index)
+                params['period_ids_%s' % index] = tuple(period_ids)
+            else:
+                condition = "FALSE"
+            conditions.append(condition)
+            selects.append(
+                "SUM(CASE WHEN {1} THEN l.debit ELSE 0.0 END)"
+                " AS debit_{0},"
+                " SUM(CASE WHEN {1} THEN l.credit ELSE 0.0 END)"
+                " AS credit_{0}".format(index, condition))
+
+        sql = "SELECT l.account_id, " + ", ".join(selects)
+        # the sums of the snapshot can be used when all the columns are
+        # filtered by periods
+        if from_snapshot:
+            sql += " FROM account_webkit_balance_snapshot l" \
+                " WHERE l.account_id in %(account_ids)s"
+            if target_move == 'posted':
+                sql += " AND l.move_state = 'posted'"
+        else:
+            sql += " FROM account_move_line l" \
+                " JOIN account_move m ON (m.id = l.move_id)" \
+                " WHERE l.account_id in %(account_ids)s" \
+                " AND l.state <> 'draft'"
+            if target_move == 'posted':
+                sql += " AND m.state = 'posted'"
+        sql += " AND (" + " OR ".join(conditions) + ")" \
+            " GROUP BY l.account_id"
+        self.cursor.execute(sql, params)
+
+        res = [{} for column in columns]
+        for row in self.cursor.dictfetchall():
+            for index in range(len(columns)):
+                debit = row['debit_%s' % index] or 0.0
+                credit = row['credit_%s' % index] or 0.0
+                res[index][row['account_id']] = {'debit': debit,
+                                                 'credit': credit,
+                                                 'balance': debit - credit}
+        return res
+
+    def _read_account_details(self, account_ids, target_move, column,
+                              context=None):
+        """Get details of accounts of one column with the orm, used when
+        the amounts of children accounts have to be converted in the
+        currency of their parent"""
+        if context is None:
+            context = {}
+
+        account_obj = self.pool.get('account.account')
+        period_ids = self._get_column_period_ids(column)
+        init_balance = self._get_column_initial_balances(account_ids, column)
 
         ctx = context.copy()
         ctx.update({'state': target_move,
                     'all_fiscalyear': True})
 
-        if use_period_ids:
+        if period_ids is not None:
             ctx.update({'periods': period_ids})
-        elif main_filter == 'filter_date':
-            ctx.update({'date_from': start,
-                        'date_to': stop})
+        else:
+            ctx.update({'date_from': column['start'],
+                        'date_to': column['stop']})
 
         # in tests (when installing and testing at the same time),
         # the read below might fail because it relies on the order
@@ -103,21 +249,17 @@ class CommonBalanceReportHeaderWebkit(CommonReportHeaderWebkit):
                 'balance', 'parent_id', 'level', 'child_id'],
             context=ctx)
 
+        if init_balance:
+            # sum for top level views accounts
+            init_balance_totals = self._get_account_tree(
+                account_ids, context=ctx).rollup(init_balance,
+                                                 ('init_balance',))
+
         accounts_by_id = {}
         for account in accounts:
             if init_balance:
-                # sum for top level views accounts
-                child_ids = account_obj._get_children_and_consol(
-                    self.cursor, self.uid, account['id'], ctx)
-                if child_ids:
-                    child_init_balances = [
-                        init_bal['init_balance']
-                        for acnt_id, init_bal in init_balance.iteritems()
-                        if acnt_id in child_ids]
-                    top_init_balance = reduce(add, child_init_balances)
-                    account['init_balance'] = top_init_balance
-                else:
-                    account.update(init_balance[account['id']])
+                account['init_balance'] = init_balance_totals.get(
+                    account['id'], {}).get('init_balance', 0.0)
                 account['balance'] = account['init_balance'] + \
                     account['debit'] - account['credit']
             accounts_by_id[account['id']] = account
@@ -136,6 +278,26 @@ class CommonBalanceReportHeaderWebkit(CommonReportHeaderWebkit):
                 (ie. comp1_fiscalyear_id where 1 is the index)
         @return: dict of account details (key = account id)
         """
+        accounts_by_ids = {}
+        column, comp_params = self._get_comparison_column(
+            data, comparison_filter, index)
+        if column:
+            accounts_by_ids = self._get_accounts_details_by_columns(
+                account_ids, target_move, [column], context=context)[0]
+        return accounts_by_ids, comp_params
+
+    def _get_comparison_column(self, data, comparison_filter, index):
+        """
+        @param data: data of the wizard form
+        @param comparison_filter: selected filter on the form for
+               the comparison (filter_no, filter_year, filter_period,
+                               filter_date)
+        @param index: index of the fields to get
+                (ie. comp1_fiscalyear_id where 1 is the index)
+        @return: tuple (column for `_get_accounts_details_by_columns`,
+                 comparison params), column is False when there is no
+                 comparison
+        """
         fiscalyear = self._get_info(
             data, "comp%s_fiscalyear_id" % (index,), 'account.fiscalyear')
         start_period = self._get_info(
@@ -146,7 +308,7 @@ class CommonBalanceReportHeaderWebkit(CommonReportHeaderWebkit):
         stop_date = self._get_form_param("comp%s_date_to" % (index,), data)
         init_balance = self.is_initial_balance_enabled(comparison_filter)
 
-        accounts_by_ids = {}
+        column = False
         comp_params = {}
         details_filter = comparison_filter
         if comparison_filter != 'filter_no':
@@ -159,9 +321,13 @@ class CommonBalanceReportHeaderWebkit(CommonReportHeaderWebkit):
 
             initial_balance_mode = init_balance \
                 and self._get_initial_balance_mode(start) or False
-            accounts_by_ids = self._get_account_details(
-                account_ids, target_move, fiscalyear, details_filter,
-                start, stop, initial_balance_mode, context=context)
+            column = {
+                'fiscalyear': fiscalyear,
+                'main_filter': details_filter,
+                'start': start,
+                'stop': stop,
+                'initial_balance_mode': initial_balance_mode,
+            }
             comp_params = {
                 'comparison_filter': comparison_filter,
                 'fiscalyear': fiscalyear,
@@ -171,7 +337,7 @@ class CommonBalanceReportHeaderWebkit(CommonReportHeaderWebkit):
                 'initial_balance_mode': initial_balance_mode,
             }
 
-        return accounts_by_ids, comp_params
+        return column, comp_params
 
     def _get_diff(self, balance, previous_balance):
         """
@@ -275,20 +441,27 @@ class CommonBalanceReportHeaderWebkit(CommonReportHeaderWebkit):
         account_ids = self.get_all_accounts(
             new_ids, only_type=filter_report_type, context=ctx)
 
-        # get details for each account, total of debit / credit / balance
-        accounts_by_ids = self._get_account_details(
-            account_ids, target_move, fiscalyear, main_filter, start, stop,
-            initial_balance_mode, context=lang_ctx)
-
+        columns = [{
+            'fiscalyear': fiscalyear,
+            'main_filter': main_filter,
+            'start': start,
+            'stop': stop,
+            'initial_balance_mode': initial_balance_mode,
+        }]
         comparison_params = []
-        comp_accounts_by_ids = []
         for index in range(max_comparison):
             if comp_filters[index] != 'filter_no':
-                comparison_result, comp_params = self._get_comparison_details(
-                    data, account_ids, target_move, comp_filters[index], index,
-                    context=lang_ctx)
+                column, comp_params = self._get_comparison_column(
+                    data, comp_filters[index], index)
+                columns.append(column)
                 comparison_params.append(comp_params)
-                comp_accounts_by_ids.append(comparison_result)
+
+        # get details for each account, total of debit / credit / balance
+        # of the main column and all the comparisons at once
+        columns_accounts_by_ids = self._get_accounts_details_by_columns(
+            account_ids, target_move, columns, context=lang_ctx)
+        accounts_by_ids = columns_accounts_by_ids[0]
+        comp_accounts_by_ids = columns_accounts_by_ids[1:]
 
         objects = self.pool.get('account.account').browse(self.cursor,
                                                           self.uid,
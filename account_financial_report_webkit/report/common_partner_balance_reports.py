@@ -21,12 +21,12 @@
 ##############################################################################
 
 from collections import defaultdict
+from itertools import chain
 from operator import add
 
-from openerp.tools.float_utils import float_is_zero
-
 from .common_balance_reports import CommonBalanceReportHeaderWebkit
 from .common_partner_reports import CommonPartnersReportHeaderWebkit
+from ..models.account_balance_snapshot import snapshot_enabled
 
 
 class CommonPartnerBalanceReportHeaderWebkit(CommonBalanceReportHeaderWebkit,
@@ -40,97 +40,54 @@ class CommonPartnerBalanceReportHeaderWebkit(CommonBalanceReportHeaderWebkit,
                                       initial_balance_mode,
                                       partner_filter_ids=False,
                                       display_partner='all'):
-        res = {}
         filter_from = False
         if main_filter in ('filter_period', 'filter_no', 'filter_opening'):
             filter_from = 'period'
         elif main_filter == 'filter_date':
             filter_from = 'date'
-
-        partners_init_balances_by_ids = {}
-        for account_id, account_details in account_by_ids.iteritems():
-            partners_init_balances_by_ids.update(
-                self._get_partners_initial_balances(
-                    account_id, start, initial_balance_mode,
-                    partner_filter_ids=partner_filter_ids,
-                    # we'll never exclude reconciled entries in the legal
-                    # reports
-                    exclude_reconcile=False))
-            opening_mode = 'exclude_opening'
-            if main_filter == 'filter_opening':
-                opening_mode = 'include_opening'
-            # get credit and debit for partner
-            details = self._get_partners_totals_account(
-                filter_from,
-                account_id,
-                start,
-                stop,
-                target_move,
-                partner_filter_ids=partner_filter_ids,
-                mode=opening_mode)
-
-            # merge initial balances in partner details
-            if partners_init_balances_by_ids.get(account_id):
-                for partner_id, initial_balances in \
-                        partners_init_balances_by_ids[account_id].iteritems():
-                    if initial_balances.get('init_balance'):
-                        details[partner_id].update(
-                            {'init_balance': initial_balances['init_balance']})
-
-            # compute balance for the partner
-            for partner_id, partner_details in details.iteritems():
-                details[partner_id]['balance'] = details[partner_id].\
-                    get('init_balance', 0.0) + \
-                    details[partner_id].get('debit', 0.0) - \
-                    details[partner_id].get('credit', 0.0)
-
-            if display_partner == 'non-zero_balance':
-                details = {
-                    k: v
-                    for k, v in details.iteritems()
-                    if not float_is_zero(v['balance'], precision_digits=5)
-                }
-            res[account_id] = details
-
-        return res
-
-    def _get_partners_initial_balances(self, account_ids, start_period,
-                                       initial_balance_mode,
-                                       partner_filter_ids=None,
-                                       exclude_reconcile=False):
-        # we get the initial balance from the opening period (opening_balance)
-        # when the opening period is included in the start period and
-        # when there is at least one entry in the opening period. Otherwise we
-        # compute it from previous periods
-        if initial_balance_mode == 'opening_balance':
-            opening_period_selected = self.get_included_opening_period(
-                start_period)
-            res = self._compute_partners_initial_balances(
-                account_ids, start_period, partner_filter_ids,
-                force_period_ids=opening_period_selected,
-                exclude_reconcile=exclude_reconcile)
-        elif initial_balance_mode == 'initial_balance':
-            res = self._compute_partners_initial_balances(
-                account_ids, start_period, partner_filter_ids,
-                exclude_reconcile=exclude_reconcile)
-        else:
-            res = {}
-        return res
-
-    def _get_partners_totals_account(self, filter_from, account_id, start,
-                                     stop, target_move,
-                                     partner_filter_ids=None,
-                                     mode='exclude_opening'):
-        final_res = defaultdict(dict)
-
+        opening_mode = 'exclude_opening'
+        if main_filter == 'filter_opening':
+            opening_mode = 'include_opening'
+        return self._get_partners_balances(
+            account_by_ids.keys(), filter_from, start, stop, target_move,
+            initial_balance_mode, partner_filter_ids=partner_filter_ids,
+            mode=opening_mode,
+            non_zero_balance=display_partner == 'non-zero_balance')
+
+    def _get_partners_balances(self, account_ids, filter_from, start, stop,
+                               target_move, initial_balance_mode,
+                               partner_filter_ids=None,
+                               mode='exclude_opening',
+                               non_zero_balance=False):
+        """Compute the debit, credit, initial balance and balance of the
+        partners of all the accounts in one query: the totals of the period
+        and the initial balances are both grouped by account and partner and
+        joined together.
+
+        :return: dict {account_id: {partner_id: {'debit', 'credit',
+                 'init_balance', 'balance'}}}
+        """
+        res = dict((account_id, defaultdict(dict))
+                   for account_id in account_ids)
+        if not account_ids:
+            return res
+
+        # the snapshot has the sums of the valid move lines per period, it is
+        # aliased as account_move_line to share the conditions on periods
+        from_snapshot = filter_from == 'period' and snapshot_enabled()
+        table = from_snapshot and \
+            'account_webkit_balance_snapshot account_move_line' or \
+            'account_move_line'
         sql_select = """
-                 SELECT account_move_line.partner_id,
+                 SELECT account_move_line.account_id,
+                        account_move_line.partner_id,
                         sum(account_move_line.debit) AS debit,
                         sum(account_move_line.credit) AS credit
-                 FROM account_move_line"""
+                 FROM """ + table
         sql_joins = ''
-        sql_where = "WHERE account_move_line.account_id = %(account_id)s \
-                     AND account_move_line.state = 'valid' "
+        sql_where = "WHERE account_move_line.account_id in %(account_ids)s "
+        if not from_snapshot:
+            sql_where += "AND account_move_line.state = 'valid' "
         method = getattr(self, '_get_query_params_from_' + filter_from + 's')
         sql_conditions, search_params = method(start, stop, mode=mode)
         sql_where += sql_conditions
@@ -140,23 +97,87 @@ class CommonPartnerBalanceReportHeaderWebkit(CommonBalanceReportHeaderWebkit,
                              in %(partner_ids)s"
             search_params.update({'partner_ids': tuple(partner_filter_ids)})
 
-        if target_move == 'posted':
+        if target_move == 'posted' and from_snapshot:
+            sql_where += " AND account_move_line.move_state = %(target_move)s"
+            search_params.update({'target_move': target_move})
+        elif target_move == 'posted':
             sql_joins += "INNER JOIN account_move \
                             ON account_move_line.move_id = account_move.id"
             sql_where += " AND account_move.state = %(target_move)s"
             search_params.update({'target_move': target_move})
 
-        sql_groupby = "GROUP BY account_move_line.partner_id"
-
-        search_params.update({'account_id': account_id})
-        query = ' '.join((sql_select, sql_joins, sql_where, sql_groupby))
+        sql_groupby = "GROUP BY account_move_line.account_id, \
+                                account_move_line.partner_id"
+        search_params.update({'account_ids': tuple(account_ids)})
+        totals_query = ' '.join((sql_select, sql_joins, sql_where,
+                                 sql_groupby))
+
+        # we get the initial balance from the opening period
+        # (opening_balance) when the opening period is included in the start
+        # period and when there is at least one entry in the opening period.
+        # Otherwise we compute it from previous periods
+        # we'll never exclude reconciled entries in the legal reports
+        init_query = False
+        if initial_balance_mode == 'opening_balance':
+            init_query, init_params = \
+                self._get_partners_initial_balance_query(
+                    account_ids, start, partner_filter_ids,
+                    force_period_ids=self.get_included_opening_period(start),
+                    from_snapshot=snapshot_enabled())
+        elif initial_balance_mode == 'initial_balance':
+            init_query, init_params = \
+                self._get_partners_initial_balance_query(
+                    account_ids, start, partner_filter_ids,
+                    from_snapshot=snapshot_enabled())
+
+        if init_query:
+            search_params.update(init_params)
+            query = """
+                WITH totals AS (%s), init AS (%s)
+                SELECT COALESCE(totals.account_id, init.account_id)
+                            AS account_id,
+                       COALESCE(totals.partner_id, init.partner_id)
+                            AS partner_id,
+                       totals.account_id IS NOT NULL AS has_totals,
+                       COALESCE(totals.debit, 0.0) AS debit,
+                       COALESCE(totals.credit, 0.0) AS credit,
+                       COALESCE(init.init_balance, 0.0) AS init_balance
+                FROM totals
+                FULL OUTER JOIN init
+                    ON init.account_id = totals.account_id
+                    AND COALESCE(init.partner_id, 0) =
+                        COALESCE(totals.partner_id, 0)
+                WHERE (totals.account_id IS NOT NULL
+                       OR init.init_balance <> 0)""" % (totals_query,
+                                                        init_query)
+        else:
+            query = """
+                WITH totals AS (%s)
+                SELECT account_id, partner_id,
+                       TRUE AS has_totals,
+                       COALESCE(debit, 0.0) AS debit,
+                       COALESCE(credit, 0.0) AS credit,
+                       0.0 AS init_balance
+                FROM totals""" % (totals_query,)
+        if non_zero_balance:
+            query = """
+                SELECT * FROM (%s) AS balances
+                WHERE ROUND(init_balance + debit - credit, 5) <> 0""" % (
+                query,)
 
         self.cursor.execute(query, search_params)
-        res = self.cursor.dictfetchall()
-        if res:
-            for row in res:
-                final_res[row['partner_id']] = row
-        return final_res
+        for row in self.cursor.dictfetchall():
+            details = {}
+            if row['has_totals']:
+                details.update({'partner_id': row['partner_id'],
+                                'debit': row['debit'],
+                                'credit': row['credit']})
+            if row['init_balance']:
+                details['init_balance'] = row['init_balance']
+            details['balance'] = row['init_balance'] + \
+                row['debit'] - row['credit']
+            res[row['account_id']][row['partner_id']] = details
+        return res
 
     def _get_filter_type(self, result_selection):
         filter_type = ('payable', 'receivable')
@@ -306,6 +327,13 @@ class CommonPartnerBalanceReportHeaderWebkit(CommonBalanceReportHeaderWebkit,
         credit_accounts = {}
         balance_accounts = {}
 
+        self._get_partners_directory(
+            partner_id for details in chain(
+                partner_details_by_ids.itervalues(),
+                (values['partners_amounts']
+                 for comp_account_by_id in comp_accounts_by_ids
+                 for values in comp_account_by_id.itervalues()))
+            for partner_id in details)
         for account in objects:
             if not account.parent_id:  # hide top level account
                 continue
@@ -22,11 +22,11 @@
 # TODO refactor helper in order to act more like mixin
 # By using properties we will have a more simple signature in fuctions
 
+import heapq
 from collections import defaultdict
-from datetime import datetime
+from itertools import groupby
 
-from openerp.tools import DEFAULT_SERVER_DATE_FORMAT
-from .common_reports import CommonReportHeaderWebkit
+from .common_reports import CommonReportHeaderWebkit, MONSTER_SELECT
 
 
 class CommonPartnersReportHeaderWebkit(CommonReportHeaderWebkit):
@@ -52,6 +52,43 @@ class CommonPartnersReportHeaderWebkit(CommonReportHeaderWebkit):
                 exclude_reconcile=exclude_reconcile,
                 partner_filter=partner_filter)
 
+    def _iter_partners_move_line_datas(self, account_ids, main_filter, start,
+                                       stop, target_move,
+                                       exclude_reconcile=False,
+                                       partner_filter=False,
+                                       order='per.special DESC, l.date ASC, \
+                                       per.date_start ASC, m.name ASC'):
+        """Fetch the move lines of all the accounts and partners in one
+        ordered query.
+
+        Yield a tuple (account_id, partner_id, lines) per account and partner
+        having move lines, selected like `get_partners_move_lines_ids` and
+        sorted as in `_get_move_line_datas`. Rows are streamed from a server
+        side cursor, only the lines of the current partner are kept in
+        memory.
+        """
+        if not account_ids:
+            return
+        if main_filter in ('filter_period', 'filter_no'):
+            filter_from = 'period'
+        elif main_filter == 'filter_date':
+            filter_from = 'date'
+        else:
+            return
+        lines_sql, params = self._get_partners_move_lines_query(
+            filter_from, account_ids, start, stop, target_move,
+            exclude_reconcile=exclude_reconcile,
+            partner_filter=partner_filter)
+        sql = MONSTER_SELECT + \
+            " JOIN (" + lines_sql + ") partner_lines" \
+            " ON (partner_lines.id = l.id)" \
+            " ORDER BY l.account_id, l.partner_id, %s" % (order,)
+        rows = self._iter_query_dicts(sql, params)
+        for (account_id, partner_id), lines in groupby(
+                rows, key=lambda row: (row['account_id'],
+                                       row['lpartner_id'])):
+            yield account_id, partner_id, list(lines)
+
     def _get_first_special_period(self):
         """
         Returns the browse record of the period with the `special` flag, which
@@ -66,6 +103,9 @@ class CommonPartnersReportHeaderWebkit(CommonReportHeaderWebkit):
 
         :return: browse record of the first special period.
         """
+        if hasattr(self, '_first_special_period'):
+            return self._first_special_period
+        self._first_special_period = None
         move_line_obj = self.pool.get('account.move.line')
         first_entry_id = move_line_obj.search(
             self.cr, self.uid, [], order='date ASC', limit=1)
@@ -73,17 +113,21 @@ class CommonPartnersReportHeaderWebkit(CommonReportHeaderWebkit):
         # it may so
         if not first_entry_id:
             return
-        first_entry = move_line_obj.browse(
-            self.cr, self.uid, first_entry_id[0])
-        fiscalyear = first_entry.period_id.fiscalyear_id
-        special_periods = [
-            period for period in fiscalyear.period_ids if period.special]
+        first_entry = move_line_obj.read(
+            self.cr, self.uid, first_entry_id[0], ['period_id'],
+            load='_classic_write')
+        calendar = self._get_period_calendar()
+        first_period = calendar.by_id.get(first_entry['period_id'])
+        if not first_period:
+            return
+        special_periods = calendar.fiscalyear_special_periods(
+            first_period['fiscalyear_id'])
         # so, we have no opening period on the first year, nothing to return
         if not special_periods:
             return
-        return min(special_periods,
-                   key=lambda p: datetime.strptime(p.date_start,
-                                                   DEFAULT_SERVER_DATE_FORMAT))
+        self._first_special_period = self.pool.get('account.period').browse(
+            self.cr, self.uid, special_periods[0]['id'])
+        return self._first_special_period
 
     def _get_period_range_from_start_period(self, start_period,
                                             include_opening=False,
@@ -173,11 +217,42 @@ class CommonPartnersReportHeaderWebkit(CommonReportHeaderWebkit):
         """
 
         final_res = defaultdict(list)
+        for row in self._get_partners_move_lines(
+                filter_from, [account_id], start, stop, target_move,
+                exclude_reconcile=exclude_reconcile,
+                partner_filter=partner_filter):
+            final_res[row['partner_id']].append(row['id'])
+        return final_res
+
+    def _get_partners_move_lines(self, filter_from, account_ids, start, stop,
+                                 target_move, exclude_reconcile=False,
+                                 partner_filter=None):
+        """Same as `_get_partners_move_line_ids` for several accounts at once
 
+        :return: list of dicts with the keys id, account_id, partner_id and
+            reconcile_id
+        """
+        sql, search_params = self._get_partners_move_lines_query(
+            filter_from, account_ids, start, stop, target_move,
+            exclude_reconcile=exclude_reconcile,
+            partner_filter=partner_filter)
+        self.cursor.execute(sql, search_params)
+        return self.cursor.dictfetchall()
+
+    def _get_partners_move_lines_query(self, filter_from, account_ids, start,
+                                       stop, target_move,
+                                       exclude_reconcile=False,
+                                       partner_filter=None):
+        """Build the query of `_get_partners_move_lines`
+
+        :return: tuple (sql, params)
+        """
         sql_select = "SELECT account_move_line.id, \
-                        account_move_line.partner_id FROM account_move_line"
+                        account_move_line.account_id, \
+                        account_move_line.partner_id, \
+                        account_move_line.reconcile_id FROM account_move_line"
         sql_joins = ''
-        sql_where = " WHERE account_move_line.account_id = %(account_ids)s " \
+        sql_where = " WHERE account_move_line.account_id in %(account_ids)s " \
                     " AND account_move_line.state = 'valid' "
 
         method = getattr(self, '_get_query_params_from_' + filter_from + 's')
@@ -194,6 +269,7 @@ class CommonPartnersReportHeaderWebkit(CommonReportHeaderWebkit):
         if partner_filter:
             sql_where += "   AND account_move_line.partner_id \
                                                             in %(partner_ids)s"
+            search_params.update({'partner_ids': tuple(partner_filter)})
 
         if target_move == 'posted':
             sql_joins += "INNER JOIN account_move \
@@ -201,18 +277,10 @@ class CommonPartnersReportHeaderWebkit(CommonReportHeaderWebkit):
             sql_where += " AND account_move.state = %(target_move)s"
             search_params.update({'target_move': target_move})
 
-        search_params.update({
-            'account_ids': account_id,
-            'partner_ids': tuple(partner_filter),
-        })
+        search_params.update({'account_ids': tuple(account_ids)})
 
         sql = ' '.join((sql_select, sql_joins, sql_where))
-        self.cursor.execute(sql, search_params)
-        res = self.cursor.dictfetchall()
-        if res:
-            for row in res:
-                final_res[row['partner_id']].append(row['id'])
-        return final_res
+        return sql, search_params
 
     def _get_clearance_move_line_ids(self, move_line_ids, date_stop,
                                      date_until):
@@ -237,6 +305,21 @@ class CommonPartnersReportHeaderWebkit(CommonReportHeaderWebkit):
         else:
             return []
 
+    def _get_clearance_move_lines_by_reconcile(self, reconcile_ids, date_stop,
+                                               date_until):
+        """Return the move lines of the reconciliations dated between
+        date_stop and date_until, as a dict {reconcile_id: [line ids]}"""
+        res = defaultdict(list)
+        if not reconcile_ids:
+            return res
+        self.cursor.execute("SELECT id, reconcile_id FROM account_move_line"
+                            " WHERE reconcile_id in %s"
+                            " AND date >= %s AND date <= %s",
+                            (tuple(reconcile_ids), date_stop, date_until))
+        for line_id, reconcile_id in self.cursor.fetchall():
+            res[reconcile_id].append(line_id)
+        return res
+
     ##############################################
     # Initial Partner Balance helper             #
     ##############################################
@@ -264,11 +347,19 @@ class CommonPartnersReportHeaderWebkit(CommonReportHeaderWebkit):
                 res[account_id][partner_id] = row
         return res
 
-    def _partners_initial_balance_line_ids(self, account_ids, start_period,
-                                           partner_filter,
-                                           exclude_reconcile=False,
-                                           force_period_ids=False,
-                                           date_stop=None):
+    def _get_partners_initial_balance_where(self, account_ids, start_period,
+                                            partner_filter,
+                                            exclude_reconcile=False,
+                                            force_period_ids=False,
+                                            date_stop=None):
+        """Build the where clause selecting the move lines of the initial
+        balances, on the table account_move_line aliased as ml.
+
+        The names of the params are prefixed by init_ so the clause can be
+        used in a sub-query.
+
+        :return: tuple (sql, params)
+        """
         # take ALL previous periods
         period_ids = force_period_ids \
             if force_period_ids \
@@ -278,31 +369,96 @@ class CommonPartnersReportHeaderWebkit(CommonReportHeaderWebkit):
         if not period_ids:
             period_ids = [-1]
         search_param = {
-            'date_start': start_period.date_start,
-            'period_ids': tuple(period_ids),
-            'account_ids': tuple(account_ids),
+            'init_period_ids': tuple(period_ids),
+            'init_account_ids': tuple(account_ids),
         }
-        sql = ("SELECT ml.id, ml.account_id, ml.partner_id "
-               "FROM account_move_line ml "
-               "INNER JOIN account_account a "
-               "ON a.id = ml.account_id "
-               "WHERE ml.period_id in %(period_ids)s "
-               "AND ml.account_id in %(account_ids)s ")
+        sql = ("WHERE ml.period_id in %(init_period_ids)s "
+               "AND ml.account_id in %(init_account_ids)s ")
         if exclude_reconcile:
             if not date_stop:
                 raise Exception(
                     "Missing \"date_stop\" to compute the open invoices.")
-            search_param.update({'date_stop': date_stop})
+            search_param.update({'init_date_stop': date_stop})
             sql += ("AND ((ml.reconcile_id IS NULL) "
                     "OR (ml.reconcile_id IS NOT NULL \
-                    AND ml.last_rec_date > date(%(date_stop)s))) ")
+                    AND ml.last_rec_date > date(%(init_date_stop)s))) ")
         if partner_filter:
-            sql += "AND ml.partner_id in %(partner_ids)s "
-            search_param.update({'partner_ids': tuple(partner_filter)})
+            sql += "AND ml.partner_id in %(init_partner_ids)s "
+            search_param.update({'init_partner_ids': tuple(partner_filter)})
+        return sql, search_param
 
+    def _partners_initial_balance_line_ids(self, account_ids, start_period,
+                                           partner_filter,
+                                           exclude_reconcile=False,
+                                           force_period_ids=False,
+                                           date_stop=None):
+        """Return the ids of the move lines of the initial balances, only
+        needed when the lines themselves are displayed (open invoices).
+        Use `_compute_partners_initial_balances` to get the amounts."""
+        sql, search_param = self._get_partners_initial_balance_lines_query(
+            account_ids, start_period, partner_filter,
+            exclude_reconcile=exclude_reconcile,
+            force_period_ids=force_period_ids,
+            date_stop=date_stop)
         self.cursor.execute(sql, search_param)
         return self.cursor.dictfetchall()
 
+    def _get_partners_initial_balance_lines_query(self, account_ids,
+                                                  start_period,
+                                                  partner_filter,
+                                                  exclude_reconcile=False,
+                                                  force_period_ids=False,
+                                                  date_stop=None):
+        """Build the query of `_partners_initial_balance_line_ids`
+
+        :return: tuple (sql, params)
+        """
+        sql_where, search_param = self._get_partners_initial_balance_where(
+            account_ids, start_period, partner_filter,
+            exclude_reconcile=exclude_reconcile,
+            force_period_ids=force_period_ids,
+            date_stop=date_stop)
+        sql = ("SELECT ml.id, ml.account_id, ml.partner_id, ml.reconcile_id "
+               "FROM account_move_line ml "
+               "INNER JOIN account_account a "
+               "ON a.id = ml.account_id ") + sql_where
+        return sql, search_param
+
+    def _get_partners_initial_balance_query(self, account_ids, start_period,
+                                            partner_filter,
+                                            exclude_reconcile=False,
+                                            force_period_ids=False,
+                                            date_stop=None,
+                                            from_snapshot=False):
+        """Build the query of the initial balances grouped by account and
+        partner, directly from the periods and reconciliation conditions.
+
+        :param from_snapshot: sum the balance snapshot instead of the move
+            lines, the reconciled entries can not be excluded then
+        :return: tuple (sql, params)
+        """
+        table = from_snapshot and 'account_webkit_balance_snapshot' \
+            or 'account_move_line'
+        sql_where, search_param = self._get_partners_initial_balance_where(
+            account_ids, start_period, partner_filter,
+            exclude_reconcile=exclude_reconcile,
+            force_period_ids=force_period_ids,
+            date_stop=date_stop)
+        sql = ("SELECT ml.account_id, ml.partner_id,"
+               "       sum(ml.debit) as debit, sum(ml.credit) as credit,"
+               "       sum(ml.debit-ml.credit) as init_balance,"
+               "       CASE WHEN a.currency_id ISNULL THEN 0.0\
+                       ELSE sum(ml.amount_currency) \
+                       END as init_balance_currency, "
+               "       c.name as currency_name "
+               "FROM " + table + " ml "
+               "INNER JOIN account_account a "
+               "ON a.id = ml.account_id "
+               "LEFT JOIN res_currency c "
+               "ON c.id = a.currency_id ") + sql_where + \
+            "GROUP BY ml.account_id, ml.partner_id, a.currency_id, c.name"
+        return sql, search_param
+
     def _compute_partners_initial_balances(self, account_ids, start_period,
                                            partner_filter=None,
                                            exclude_reconcile=False,
@@ -313,29 +469,10 @@ class CommonPartnersReportHeaderWebkit(CommonReportHeaderWebkit):
         as no secondary currency"""
         if isinstance(account_ids, (int, long)):
             account_ids = [account_ids]
-        move_line_ids = self._partners_initial_balance_line_ids(
+        sql, search_param = self._get_partners_initial_balance_query(
             account_ids, start_period, partner_filter,
             exclude_reconcile=exclude_reconcile,
             force_period_ids=force_period_ids)
-        if not move_line_ids:
-            move_line_ids = [{'id': -1}]
-        sql = ("SELECT ml.account_id, ml.partner_id,"
-               "       sum(ml.debit) as debit, sum(ml.credit) as credit,"
-               "       sum(ml.debit-ml.credit) as init_balance,"
-               "       CASE WHEN a.currency_id ISNULL THEN 0.0\
-                       ELSE sum(ml.amount_currency) \
-                       END as init_balance_currency, "
-               "       c.name as currency_name "
-               "FROM account_move_line ml "
-               "INNER JOIN account_account a "
-               "ON a.id = ml.account_id "
-               "LEFT JOIN res_currency c "
-               "ON c.id = a.currency_id "
-               "WHERE ml.id in %(move_line_ids)s "
-               "GROUP BY ml.account_id, ml.partner_id, a.currency_id, c.name")
-        search_param = {
-            'move_line_ids': tuple([move_line['id'] for move_line in
-                                    move_line_ids])}
         self.cursor.execute(sql, search_param)
         res = self.cursor.dictfetchall()
         return self._tree_move_line_ids(res)
@@ -344,6 +481,41 @@ class CommonPartnersReportHeaderWebkit(CommonReportHeaderWebkit):
     # Partner specific helper                                  #
     ############################################################
 
+    def _get_partners_directory(self, partner_ids):
+        """Read the partners used by the report, once for the whole report
+
+        Partners are read with their rank in the order of the report, so the
+        partners of each account can be ordered without querying the
+        database again. When some partners are not in the directory yet,
+        only these partners are read and merged by their sort key into the
+        order of the known partners, then all the partners are ranked again.
+
+        :param partner_ids: iterable of partner ids, None is ignored
+        :return: dict {partner_id: (rank, (display name, id, ref, name))}
+        """
+        directory = getattr(self, '_partners_directory', None)
+        if directory is None:
+            directory = self._partners_directory = {}
+            self._partners_order = []
+        missing_ids = set(partner_id for partner_id in partner_ids
+                          if partner_id and partner_id not in directory)
+        if missing_ids:
+            sql = ("SELECT name|| ' ' ||CASE WHEN ref IS NOT NULL \
+                                THEN '('||ref||')' \
+                                ELSE '' END, id, ref, name, LOWER(name)"
+                   "  FROM res_partner \
+                      WHERE id IN %s ORDER BY LOWER(name), ref")
+            self.cursor.execute(sql, (tuple(missing_ids),))
+            # same order as the query, the null refs being last
+            missing = [((row[4] or '', row[2] is None, row[2] or ''),
+                        row[:4])
+                       for row in self.cursor.fetchall()]
+            self._partners_order = list(heapq.merge(self._partners_order,
+                                                    missing))
+            for rank, (__, row) in enumerate(self._partners_order):
+                directory[row[1]] = (rank, row)
+        return directory
+
     def _order_partners(self, *args):
         """We get the partner linked to all current accounts that are used.
             We also use ensure that partner are ordered by name
@@ -356,18 +528,14 @@ class CommonPartnersReportHeaderWebkit(CommonReportHeaderWebkit):
         if not partner_ids:
             return []
 
-        existing_partner_ids = [
-            partner_id for partner_id in partner_ids if partner_id]
+        existing_partner_ids = set(
+            partner_id for partner_id in partner_ids if partner_id)
         if existing_partner_ids:
-            # We may use orm here as the performance optimization is not that
-            # big
-            sql = ("SELECT name|| ' ' ||CASE WHEN ref IS NOT NULL \
-                                THEN '('||ref||')' \
-                                ELSE '' END, id, ref, name"
-                   "  FROM res_partner \
-                      WHERE id IN %s ORDER BY LOWER(name), ref")
-            self.cursor.execute(sql, (tuple(set(existing_partner_ids)),))
-            res = self.cursor.fetchall()
+            directory = self._get_partners_directory(existing_partner_ids)
+            ranked = sorted(directory[partner_id] for partner_id
+                            in existing_partner_ids
+                            if partner_id in directory)
+            res = [row for rank, row in ranked]
 
         # move lines without partners, set None for empty partner
         if not all(partner_ids):
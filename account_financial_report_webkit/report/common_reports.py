@@ -22,7 +22,11 @@
 # TODO refactor helper in order to act more like mixin
 # By using properties we will have a more simple signature in fuctions
 
+import itertools
 import logging
+from functools import partial
+
+from psycopg2.extensions import TRANSACTION_STATUS_INERROR
 
 from openerp.exceptions import except_orm
 from openerp.tools.translate import _
@@ -30,15 +34,72 @@ from openerp.addons.account.report.common_report_header \
     import common_report_header
 from collections import OrderedDict
 
+from ..models.account_balance_snapshot import snapshot_enabled
+from .account_tree import AccountTree
+from .period_calendar import PeriodCalendar
+from .progress import ProgressList
+
 _logger = logging.getLogger('financial.reports.webkit')
 
 MAX_MONSTER_SLICE = 50000
+# number of rows fetched at once from server side cursors
+STREAM_FETCH_SIZE = 10000
+
+_cursor_sequence = itertools.count()
+
+MONSTER_SELECT = """
+SELECT l.id AS id,
+            l.date AS ldate,
+            j.code AS jcode ,
+            j.type AS jtype,
+            l.currency_id,
+            l.account_id,
+            l.amount_currency,
+            l.ref AS lref,
+            l.name AS lname,
+            COALESCE(l.debit, 0.0) - COALESCE(l.credit, 0.0) AS balance,
+            l.debit,
+            l.credit,
+            l.period_id AS lperiod_id,
+            per.code as period_code,
+            per.special AS peropen,
+            l.partner_id AS lpartner_id,
+            p.name AS partner_name,
+            m.name AS move_name,
+            COALESCE(partialrec.name, fullrec.name, '') AS rec_name,
+            COALESCE(partialrec.id, fullrec.id, NULL) AS rec_id,
+            l.reconcile_partial_id,
+            m.id AS move_id,
+            c.name AS currency_code,
+            i.id AS invoice_id,
+            i.type AS invoice_type,
+            i.number AS invoice_number,
+            l.date_maturity
+FROM account_move_line l
+    JOIN account_move m on (l.move_id=m.id)
+    LEFT JOIN res_currency c on (l.currency_id=c.id)
+    LEFT JOIN account_move_reconcile partialrec
+        on (l.reconcile_partial_id = partialrec.id)
+    LEFT JOIN account_move_reconcile fullrec on (l.reconcile_id = fullrec.id)
+    LEFT JOIN res_partner p on (l.partner_id=p.id)
+    LEFT JOIN account_invoice i on (m.id =i.move_id)
+    LEFT JOIN account_period per on (per.id=l.period_id)
+    JOIN account_journal j on (l.journal_id=j.id)
+"""
 
 
 class CommonReportHeaderWebkit(common_report_header):
 
     """Define common helper for financial report"""
 
+    # set by the webkit parser when the report is rendered account by
+    # account (precise mode): the data of the accounts is not computed by
+    # set_context but by `_compute_batch`, for a few accounts at once
+    render_by_batch = False
+
+    # whether the parser yields its tables for the native pdf backend
+    native_pdf = False
+
     ######################################################################
     # From getter helper                                                 #
     ######################################################################
@@ -120,55 +181,99 @@ class CommonReportHeaderWebkit(common_report_header):
     def _get_form_param(self, param, data, default=False):
         return data.get('form', {}).get(param, default)
 
+    def _compute_batch(self, account_ids):
+        """Compute the data of a batch of accounts for the reports rendered
+        by batch, the reports which always compute all their data in
+        set_context have nothing to compute here.
+
+        :return: dict of values replacing the ones of the localcontext
+                 (those of the previous batch)
+        """
+        return {}
+
+    def _get_native_pdf_tables(self, objects):
+        """Yield the tables of the report printed by the native pdf
+        backend (see `native_pdf`), the data of the report is already
+        computed for the `objects` yielded so far"""
+        raise NotImplementedError
+
+    def _get_native_pdf_filters(self):
+        """Table of the filters of the report printed on top of the reports
+        by the native pdf backend"""
+        data = self.localcontext['data']
+        fiscalyear = self.localcontext.get('fiscalyear')
+        initial_balance_text = {'initial_balance': _('Computed'),
+                                'opening_balance': _('Opening Entries'),
+                                False: _('No')}
+        if self._get_filter(data) == 'filter_date':
+            filter_label = _('Dates Filter')
+            start = self.localcontext.get('start_date')
+            stop = self.localcontext.get('stop_date')
+            start = self.formatLang(start, date=True) if start else u''
+            stop = self.formatLang(stop, date=True) if stop else u''
+        else:
+            filter_label = _('Periods Filter')
+            start = self.localcontext.get('start_period')
+            stop = self.localcontext.get('stop_period')
+            start = start.name if start else u''
+            stop = stop.name if stop else u''
+        accounts = self._get_accounts_br(data)
+        return {
+            'title': False,
+            'columns': [(_('Chart of Account'), 1, 'left'),
+                        (_('Fiscal Year'), 1, 'left'),
+                        (filter_label, 1, 'left'),
+                        (_('Accounts Filter'), 1, 'left'),
+                        (_('Target Moves'), 1, 'left'),
+                        (_('Initial Balance'), 1, 'left')],
+            'rows': [([self.localcontext['chart_account'].name,
+                       fiscalyear.name if fiscalyear else u'-',
+                       u' '.join((_('From:'), start, _('To:'), stop)),
+                       u', '.join(account.code for account in accounts)
+                       if accounts else _('All'),
+                       self._get_display_target_move(data),
+                       initial_balance_text[
+                           self.localcontext['initial_balance_mode']]],
+                      False)],
+        }
+
+    def _track_progress(self, objects):
+        """Return the objects of the report, reporting the progress of the
+        background job rendering the report while they are iterated over"""
+        job_id = self.localcontext.get('webkit_report_job_id')
+        if not job_id:
+            return objects
+        job_obj = self.pool['account.webkit.report.job']
+        return ProgressList(objects, partial(job_obj.report_progress,
+                                             self.cursor, self.uid, job_id))
+
     #############################################
     # Account and account line filter helper    #
     #############################################
 
+    def _get_account_tree(self, account_ids, context=None):
+        """Return the tree of the accounts used by the report, read once and
+        shared by all the helpers, completed with account_ids if needed"""
+        tree = getattr(self, '_account_tree', None)
+        if tree is None:
+            tree = self._account_tree = AccountTree()
+        missing_ids = [account_id for account_id in account_ids
+                       if account_id not in tree]
+        if missing_ids:
+            tree.add(self.pool.get('account.account').read(
+                self.cr, self.uid, missing_ids,
+                ['id', 'parent_id', 'level', 'code', 'child_consol_ids'],
+                context=context))
+        return tree
+
     def sort_accounts_with_structure(self, root_account_ids, account_ids,
                                      context=None):
         """Sort accounts by code respecting their structure"""
-
-        def recursive_sort_by_code(accounts, parent):
-            sorted_accounts = []
-            # add all accounts with same parent
-            level_accounts = [
-                account for account in accounts
-                if account['parent_id'] and
-                account['parent_id'][0] == parent['id']]
-            # add consolidation children of parent, as they are logically on
-            # the same level
-            if parent.get('child_consol_ids'):
-                level_accounts.extend([account for account in accounts
-                                       if account['id']
-                                       in parent['child_consol_ids']])
-            # stop recursion if no children found
-            if not level_accounts:
-                return []
-
-            level_accounts = sorted(level_accounts, key=lambda a: a['code'])
-
-            for level_account in level_accounts:
-                sorted_accounts.append(level_account['id'])
-                sorted_accounts.extend(
-                    recursive_sort_by_code(accounts, parent=level_account))
-            return sorted_accounts
-
         if not account_ids:
             return []
 
-        accounts_data = self.pool.get('account.account').read(
-            self.cr, self.uid, account_ids,
-            ['id', 'parent_id', 'level', 'code', 'child_consol_ids'],
-            context=context)
-
-        sorted_accounts = []
-
-        root_accounts_data = [account_data for account_data in accounts_data
-                              if account_data['id'] in root_account_ids]
-        for root_account_data in root_accounts_data:
-            sorted_accounts.append(root_account_data['id'])
-            sorted_accounts.extend(
-                recursive_sort_by_code(accounts_data, root_account_data))
+        tree = self._get_account_tree(account_ids, context=context)
+        sorted_accounts = tree.sort(root_account_ids, account_ids)
 
         # fallback to unsorted accounts when sort failed
         # sort fails when the levels are miscalculated by account.account
@@ -235,7 +340,7 @@ class CommonReportHeaderWebkit(common_report_header):
             fetch_only_ids = self.cursor.fetchall()
             if not fetch_only_ids:
                 return []
-            only_ids = [only_id[0] for only_id in fetch_only_ids]
+            only_ids = set(only_id[0] for only_id in fetch_only_ids)
             # keep sorting but filter ids
             res_ids = [res_id for res_id in res_ids if res_id in only_ids]
         return res_ids
@@ -244,39 +349,58 @@ class CommonReportHeaderWebkit(common_report_header):
     # Periods and fiscal years  helper       #
     ##########################################
 
+    def _get_period_calendar(self):
+        """Return the periods of the accounting as a `PeriodCalendar`, read
+        once per report from the cache of `account.period`"""
+        calendar = getattr(self, '_period_calendar', None)
+        if calendar is None:
+            periods = self.pool.get('account.period').\
+                _get_webkit_report_periods(self.cursor, self.uid)
+            calendar = self._period_calendar = PeriodCalendar(periods)
+        return calendar
+
+    def _get_periods_with_move_lines(self, period_ids):
+        """Return the set of the periods of period_ids having move lines,
+        each period being checked once per report"""
+        cache = getattr(self, '_periods_move_lines', None)
+        if cache is None:
+            cache = self._periods_move_lines = {}
+        missing_ids = [period_id for period_id in set(period_ids)
+                       if period_id not in cache]
+        if missing_ids:
+            self.cursor.execute(
+                "SELECT p.id FROM account_period p"
+                " WHERE p.id in %s AND EXISTS ("
+                "   SELECT 1 FROM account_move_line l"
+                "   WHERE l.period_id = p.id)",
+                (tuple(missing_ids),))
+            with_lines = set(row[0] for row in self.cursor.fetchall())
+            for period_id in missing_ids:
+                cache[period_id] = period_id in with_lines
+        return set(period_id for period_id in period_ids if cache[period_id])
+
     def _get_opening_periods(self):
         """Return the list of all journal that can be use to create opening
         entries.
         We actually filter on this instead of opening period as older version
         of OpenERP did not have this notion"""
-        return self.pool.get('account.period').search(self.cursor, self.uid,
-                                                      [('special', '=', True)])
+        return self._get_period_calendar().opening_period_ids()
 
     def exclude_opening_periods(self, period_ids):
-        period_obj = self.pool.get('account.period')
-        return period_obj.search(self.cr, self.uid, [['special', '=', False],
-                                                     ['id', 'in', period_ids]])
+        return self._get_period_calendar().exclude_opening(period_ids)
 
     def get_included_opening_period(self, period):
         """Return the opening included in normal period we use the assumption
         that there is only one opening period per fiscal year"""
-        period_obj = self.pool.get('account.period')
-        return period_obj.search(self.cursor, self.uid,
-                                 [('special', '=', True),
-                                  ('date_start', '>=', period.date_start),
-                                  ('date_stop', '<=', period.date_stop),
-                                  ('company_id', '=', period.company_id.id)],
-                                 limit=1)
+        return self._get_period_calendar().included_opening_period_ids(
+            period.date_start, period.date_stop, period.company_id.id)
 
     def periods_contains_move_lines(self, period_ids):
         if not period_ids:
             return False
-        mv_line_obj = self.pool.get('account.move.line')
         if isinstance(period_ids, (int, long)):
             period_ids = [period_ids]
-        return mv_line_obj.search(self.cursor, self.uid,
-                                  [('period_id', 'in', period_ids)], limit=1) \
-            and True or False
+        return bool(self._get_periods_with_move_lines(period_ids))
 
     def _get_period_range_from_periods(self, start_period, stop_period,
                                        mode=None):
@@ -299,47 +423,27 @@ class CommonReportHeaderWebkit(common_report_header):
                                             fiscalyear=False,
                                             stop_at_previous_opening=False):
         """We retrieve all periods before start period"""
-        opening_period_id = False
-        past_limit = []
-        period_obj = self.pool.get('account.period')
-        mv_line_obj = self.pool.get('account.move.line')
+        calendar = self._get_period_calendar()
+        fiscalyear_id = fiscalyear and fiscalyear.id
+        opening_period = None
         # We look for previous opening period
         if stop_at_previous_opening:
-            opening_search = [('special', '=', True),
-                              ('date_stop', '<', start_period.date_start)]
-            if fiscalyear:
-                opening_search.append(('fiscalyear_id', '=', fiscalyear.id))
-
-            opening_periods = period_obj.search(self.cursor, self.uid,
-                                                opening_search,
-                                                order='date_stop desc')
-            for opening_period in opening_periods:
-                validation_res = mv_line_obj.search(self.cursor,
-                                                    self.uid,
-                                                    [('period_id', '=',
-                                                      opening_period)],
-                                                    limit=1)
-                if validation_res:
-                    opening_period_id = opening_period
+            opening_periods = calendar.previous_opening_periods(
+                start_period.date_start, fiscalyear_id=fiscalyear_id)
+            with_lines = self._get_periods_with_move_lines(
+                [period['id'] for period in opening_periods])
+            for period in opening_periods:
+                if period['id'] in with_lines:
+                    opening_period = period
                     break
-            if opening_period_id:
-                # we also look for overlapping periods
-                opening_period_br = period_obj.browse(
-                    self.cursor, self.uid, opening_period_id)
-                past_limit = [
-                    ('date_start', '>=', opening_period_br.date_stop)]
-
-        periods_search = [('date_stop', '<=', start_period.date_stop)]
-        periods_search += past_limit
-
-        if not include_opening:
-            periods_search += [('special', '=', False)]
-
-        if fiscalyear:
-            periods_search.append(('fiscalyear_id', '=', fiscalyear.id))
-        periods = period_obj.search(self.cursor, self.uid, periods_search)
-        if include_opening and opening_period_id:
-            periods.append(opening_period_id)
+
+        # we also look for overlapping periods
+        periods = calendar.previous_period_ids(
+            start_period.date_stop, include_opening=include_opening,
+            fiscalyear_id=fiscalyear_id,
+            date_start_from=opening_period and opening_period['date_stop'])
+        if include_opening and opening_period:
+            periods.append(opening_period['id'])
         periods = list(set(periods))
         if start_period.id in periods:
             periods.remove(start_period.id)
@@ -392,12 +496,65 @@ class CommonReportHeaderWebkit(common_report_header):
                 self.cursor.rollback()
                 raise
 
-        return {'debit': res.get('debit') or 0.0,
-                'credit': res.get('credit') or 0.0,
-                'init_balance': res.get('balance') or 0.0,
-                'init_balance_currency': res.get('curr_balance') or 0.0,
+        return self._format_init_balance(res, mode)
+
+    def _format_init_balance(self, values, mode):
+        return {'debit': values.get('debit') or 0.0,
+                'credit': values.get('credit') or 0.0,
+                'init_balance': values.get('balance') or 0.0,
+                'init_balance_currency': values.get('curr_balance') or 0.0,
                 'state': mode}
 
+    def _compute_init_balances(self, account_ids, period_ids,
+                               mode='computed'):
+        """Compute the initial balances of several accounts at once.
+
+        Same result as calling `_compute_init_balance` for each account, but
+        with one grouped query instead of one query per account.
+
+        :return: dict of initial balances, keys are the account ids
+        """
+        if not isinstance(period_ids, list):
+            period_ids = [period_ids]
+        res = dict((account_id, self._format_init_balance({}, mode))
+                   for account_id in account_ids)
+        if not account_ids or not period_ids:
+            return res
+        # the snapshot has the same amount columns as the move lines
+        table = snapshot_enabled() and 'account_webkit_balance_snapshot' \
+            or 'account_move_line'
+        try:
+            self.cursor.execute("SELECT account_id, "
+                                " sum(debit) AS debit, "
+                                " sum(credit) AS credit, "
+                                " sum(debit)-sum(credit) AS balance, "
+                                " sum(amount_currency) AS curr_balance"
+                                " FROM " + table +
+                                " WHERE period_id in %s"
+                                " AND account_id in %s"
+                                " GROUP BY account_id",
+                                (tuple(period_ids), tuple(account_ids)))
+            rows = self.cursor.dictfetchall()
+        except Exception:
+            self.cursor.rollback()
+            raise
+        for row in rows:
+            res[row['account_id']] = self._format_init_balance(row, mode)
+        return res
+
+    def _get_accounts_close_method(self, account_ids):
+        """Return the close method of the type of each account
+        as a dict {account_id: close_method}"""
+        if not account_ids:
+            return {}
+        self.cursor.execute("SELECT a.id, t.close_method"
+                            " FROM account_account a"
+                            " LEFT JOIN account_account_type t"
+                            " ON t.id = a.user_type"
+                            " WHERE a.id in %s",
+                            (tuple(account_ids),))
+        return dict(self.cursor.fetchall())
+
     def _read_opening_balance(self, account_ids, start_period):
         """ Read opening balances from the opening balance
         """
@@ -410,11 +567,8 @@ class CommonReportHeaderWebkit(common_report_header):
                   'You have to configure a period on the first of January'
                   ' with the special flag.'))
 
-        res = {}
-        for account_id in account_ids:
-            res[account_id] = self._compute_init_balance(
-                account_id, opening_period_selected, mode='read')
-        return res
+        return self._compute_init_balances(
+            account_ids, opening_period_selected, mode='read')
 
     def _compute_initial_balances(self, account_ids, start_period, fiscalyear):
         """We compute initial balance.
@@ -434,19 +588,21 @@ class CommonReportHeaderWebkit(common_report_header):
         opening_period_selected = self.get_included_opening_period(
             start_period)
 
-        for acc in self.pool.get('account.account').browse(self.cursor,
-                                                           self.uid,
-                                                           account_ids):
-            res[acc.id] = self._compute_init_balance(default_values=True)
-            if acc.user_type.close_method == 'none':
-                # we compute the initial balance for close_method == none only
-                # when we print a GL during the year, when the opening period
-                # is not included in the period selection!
-                if pnl_periods_ids and not opening_period_selected:
-                    res[acc.id] = self._compute_init_balance(
-                        acc.id, pnl_periods_ids)
-            else:
-                res[acc.id] = self._compute_init_balance(acc.id, bs_period_ids)
+        close_methods = self._get_accounts_close_method(account_ids)
+        pnl_account_ids = [acc_id for acc_id in account_ids
+                           if close_methods.get(acc_id) == 'none']
+        bs_account_ids = [acc_id for acc_id in account_ids
+                          if close_methods.get(acc_id) != 'none']
+
+        # we compute the initial balance for close_method == none only
+        # when we print a GL during the year, when the opening period
+        # is not included in the period selection!
+        if pnl_periods_ids and not opening_period_selected:
+            res.update(self._compute_init_balances(pnl_account_ids,
+                                                   pnl_periods_ids))
+        else:
+            res.update(self._compute_init_balances(pnl_account_ids, []))
+        res.update(self._compute_init_balances(bs_account_ids, bs_period_ids))
         return res
 
     ################################################
@@ -508,71 +664,201 @@ class CommonReportHeaderWebkit(common_report_header):
     def _get_move_line_datas(self, move_line_ids,
                              order='per.special DESC, l.date ASC, \
                              per.date_start ASC, m.name ASC'):
-        # Possible bang if move_line_ids is too long
-        # We can not slice here as we have to do the sort.
-        # If slice has to be done it means that we have to reorder in python
-        # after all is finished. That quite crapy...
-        # We have a defective desing here (mea culpa) that should be fixed
-        #
-        # TODO improve that by making a better domain or if not possible
-        # by using python sort
+        return list(self._iter_move_line_datas(move_line_ids, order=order))
+
+    def _iter_move_line_datas(self, move_line_ids,
+                              order='per.special DESC, l.date ASC, \
+                              per.date_start ASC, m.name ASC',
+                              slice_size=MAX_MONSTER_SLICE):
+        """Yield the details of the move lines sorted by `order`.
+
+        The rows are streamed from a server side cursor. When there are more
+        than `slice_size` ids, they are not sent as a single tuple but
+        inserted by slices in a temporary table joined to the query, so the
+        sort is still done by the database on the whole set.
+        """
         if not move_line_ids:
-            return []
+            return iter([])
         if not isinstance(move_line_ids, list):
             move_line_ids = [move_line_ids]
-        monster = """
-SELECT l.id AS id,
-            l.date AS ldate,
-            j.code AS jcode ,
-            j.type AS jtype,
-            l.currency_id,
-            l.account_id,
-            l.amount_currency,
-            l.ref AS lref,
-            l.name AS lname,
-            COALESCE(l.debit, 0.0) - COALESCE(l.credit, 0.0) AS balance,
-            l.debit,
-            l.credit,
-            l.period_id AS lperiod_id,
-            per.code as period_code,
-            per.special AS peropen,
-            l.partner_id AS lpartner_id,
-            p.name AS partner_name,
-            m.name AS move_name,
-            COALESCE(partialrec.name, fullrec.name, '') AS rec_name,
-            COALESCE(partialrec.id, fullrec.id, NULL) AS rec_id,
-            m.id AS move_id,
-            c.name AS currency_code,
-            i.id AS invoice_id,
-            i.type AS invoice_type,
-            i.number AS invoice_number,
-            l.date_maturity
-FROM account_move_line l
-    JOIN account_move m on (l.move_id=m.id)
-    LEFT JOIN res_currency c on (l.currency_id=c.id)
-    LEFT JOIN account_move_reconcile partialrec
-        on (l.reconcile_partial_id = partialrec.id)
-    LEFT JOIN account_move_reconcile fullrec on (l.reconcile_id = fullrec.id)
-    LEFT JOIN res_partner p on (l.partner_id=p.id)
-    LEFT JOIN account_invoice i on (m.id =i.move_id)
-    LEFT JOIN account_period per on (per.id=l.period_id)
-    JOIN account_journal j on (l.journal_id=j.id)
+        if len(move_line_ids) <= slice_size:
+            monster = MONSTER_SELECT + """
     WHERE l.id in %s"""
+            monster += (" ORDER BY %s" % (order,))
+            return self._iter_query_dicts(monster, (tuple(move_line_ids),))
+        return self._iter_move_line_datas_from_table(move_line_ids, order,
+                                                     slice_size)
+
+    def _iter_move_line_datas_from_table(self, move_line_ids, order,
+                                         slice_size):
+        table = 'webkit_report_ids_%d' % next(_cursor_sequence)
+        try:
+            self.cursor.execute("CREATE TEMPORARY TABLE %s "
+                                "(id integer PRIMARY KEY) ON COMMIT DROP"
+                                % (table,))
+            for index in xrange(0, len(move_line_ids), slice_size):
+                self.cursor.execute(
+                    "INSERT INTO %s SELECT DISTINCT unnest(%%s) "
+                    "EXCEPT SELECT id FROM %s" % (table, table),
+                    (move_line_ids[index:index + slice_size],))
+            self.cursor.execute("ANALYZE %s" % (table,))
+        except Exception:
+            self.cursor.rollback()
+            raise
+        monster = MONSTER_SELECT + """
+    JOIN %s ids on (ids.id=l.id)""" % (table,)
         monster += (" ORDER BY %s" % (order,))
         try:
-            self.cursor.execute(monster, (tuple(move_line_ids),))
-            res = self.cursor.dictfetchall()
+            for row in self._iter_query_dicts(monster, ()):
+                yield row
+        finally:
+            # dropped too when the iteration stops early, the rollback of
+            # a failed transaction already dropped it
+            if self.cursor.connection.get_transaction_status() != \
+                    TRANSACTION_STATUS_INERROR:
+                self.cursor.execute("DROP TABLE IF EXISTS %s" % (table,))
+
+    def _iter_query_dicts(self, sql, params, size=STREAM_FETCH_SIZE):
+        """Execute `sql` in a server side cursor and yield the rows as dicts.
+
+        Only `size` rows are transferred from the database at once so the
+        memory used does not depend on the number of rows of the query.
+        """
+        cursor_name = 'webkit_report_%d' % next(_cursor_sequence)
+        try:
+            self.cursor.execute(
+                "DECLARE %s NO SCROLL CURSOR FOR %s" % (cursor_name, sql),
+                params)
+            while True:
+                self.cursor.execute("FETCH %s FROM %s" % (size, cursor_name))
+                rows = self.cursor.dictfetchall()
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+            self.cursor.execute("CLOSE %s" % (cursor_name,))
         except Exception:
             self.cursor.rollback()
             raise
-        return res or []
+
+    def _get_accounts_move_lines_where(self, account_ids, main_filter, start,
+                                       stop, target_move):
+        """Build the where clause selecting the move lines of several
+        accounts, equivalent to the domain used by `get_move_lines_ids`,
+        including the record rules (multi-company) applied by its search.
+
+        :return: tuple (sql where clause, params) or None if no move line
+                 can match
+        """
+        sql_where = "WHERE l.account_id in %(account_ids)s"
+        params = {'account_ids': tuple(account_ids)}
+        if main_filter in ('filter_period', 'filter_no'):
+            period_ids = self.pool.get('account.period').build_ctx_periods(
+                self.cursor, self.uid, start.id, stop.id)
+            if not period_ids:
+                return None
+            sql_where += " AND l.period_id in %(period_ids)s"
+            params['period_ids'] = tuple(period_ids)
+        elif main_filter == 'filter_date':
+            sql_where += " AND l.date >= %(date_start)s" \
+                         " AND l.date <= %(date_stop)s"
+            params.update({'date_start': start, 'date_stop': stop})
+        else:
+            raise except_orm(
+                _('No valid filter'), _('Please set a valid time filter'))
+        if target_move == 'posted':
+            sql_where += " AND m.state = 'posted'"
+        sql_where += self._get_move_lines_rules_where()
+        return sql_where, params
+
+    def _get_move_lines_rules_where(self):
+        """Condition restricting the move lines aliased as l to the ones
+        the user can read according to the record rules, as done by
+        `account.move.line.search`. Empty when no rule applies."""
+        where_clause, where_params, tables = \
+            self.pool.get('ir.rule').domain_get(
+                self.cursor, self.uid, 'account.move.line')
+        if not where_clause:
+            return ''
+        sql = self.cursor.mogrify(
+            'SELECT "account_move_line".id FROM %s WHERE %s' % (
+                ', '.join(tables), ' AND '.join(where_clause)),
+            where_params)
+        # the params of the rules are inlined, escape them for the params
+        # of the main query
+        return " AND l.id IN (%s)" % (sql.replace('%', '%%'),)
+
+    def _iter_accounts_move_line_datas(self, account_ids, main_filter, start,
+                                       stop, target_move,
+                                       order='per.special DESC, l.date ASC, \
+                                       per.date_start ASC, m.name ASC'):
+        """Fetch the move lines of all the accounts in one ordered query.
+
+        Yield a tuple (account_id, lines) per account having move lines,
+        the lines of an account being sorted as in `_get_move_line_datas`.
+        Rows are streamed from a server side cursor, only the lines of the
+        current account are kept in memory.
+        """
+        if not account_ids:
+            return
+        where = self._get_accounts_move_lines_where(
+            account_ids, main_filter, start, stop, target_move)
+        if where is None:
+            return
+        sql_where, params = where
+        sql = MONSTER_SELECT + sql_where + \
+            " ORDER BY l.account_id, %s" % (order,)
+        rows = self._iter_query_dicts(sql, params)
+        for account_id, lines in itertools.groupby(
+                rows, key=lambda row: row['account_id']):
+            yield account_id, list(lines)
+
+    def _get_counterparts_cache(self, limit):
+        """Counterparts already computed while printing this report,
+        keys are tuples (move_id, excluded account_id)"""
+        if not hasattr(self, '_counterparts_cache'):
+            self._counterparts_cache = {}
+        return self._counterparts_cache.setdefault(limit, {})
+
+    def _precompute_moves_counterparts(self, account_ids, main_filter, start,
+                                       stop, target_move, limit=3):
+        """Compute the counterparts of all the move lines of the accounts
+        in one grouped query and store them in the counterparts cache, so
+        `_get_moves_counterparts` does not query the database anymore for
+        these accounts"""
+        if not account_ids:
+            return
+        where = self._get_accounts_move_lines_where(
+            account_ids, main_filter, start, stop, target_move)
+        if where is None:
+            return
+        sql_where, params = where
+        sql = """
+SELECT l.move_id, l.account_id, array_agg(DISTINCT a.code) AS codes
+FROM account_move_line l
+    JOIN account_move m on (l.move_id=m.id)
+    LEFT JOIN account_move_line l2
+        on (l2.move_id=l.move_id AND l2.account_id<>l.account_id)
+    LEFT JOIN account_account a on (l2.account_id=a.id)
+""" + sql_where + """
+GROUP BY l.move_id, l.account_id"""
+        cache = self._get_counterparts_cache(limit)
+        for row in self._iter_query_dicts(sql, params):
+            codes = [code for code in row['codes'] if code]
+            cache[(row['move_id'], row['account_id'])] = \
+                ', '.join(codes[:limit])
 
     def _get_moves_counterparts(self, move_ids, account_id, limit=3):
         if not move_ids:
             return {}
         if not isinstance(move_ids, list):
             move_ids = [move_ids]
-        sql = """
+        cache = self._get_counterparts_cache(limit)
+        move_ids = set(move_ids)
+        missing_move_ids = [move_id for move_id in move_ids
+                            if (move_id, account_id) not in cache]
+        if missing_move_ids:
+            sql = """
 SELECT account_move.id,
        array_to_string(
           ARRAY(SELECT DISTINCT a.code
@@ -588,13 +874,18 @@ FROM account_move
             on (account_move_line.account_id = account_account.id)
 WHERE move_id in %s"""
 
-        try:
-            self.cursor.execute(sql, (account_id, limit, tuple(move_ids)))
-            res = self.cursor.fetchall()
-        except Exception:
-            self.cursor.rollback()
-            raise
-        return res and dict(res) or {}
+            try:
+                self.cursor.execute(
+                    sql, (account_id, limit, tuple(missing_move_ids)))
+                res = self.cursor.fetchall()
+            except Exception:
+                self.cursor.rollback()
+                raise
+            for move_id, counterparts in res:
+                cache[(move_id, account_id)] = counterparts
+        return dict((move_id, cache[(move_id, account_id)])
+                    for move_id in move_ids
+                    if (move_id, account_id) in cache)
 
     def is_initial_balance_enabled(self, main_filter):
         if main_filter not in ('filter_no', 'filter_year', 'filter_period'):
@@ -32,6 +32,8 @@ from .webkit_parser_header_fix import HeaderFooterTextWebKitParser
 
 class GeneralLedgerWebkit(report_sxw.rml_parse, CommonReportHeaderWebkit):
 
+    native_pdf = True
+
     # pylint: disable=old-api7-method-defined
     def __init__(self, cursor, uid, name, context):
         super(GeneralLedgerWebkit, self).__init__(
@@ -51,6 +53,7 @@ class GeneralLedgerWebkit(report_sxw.rml_parse, CommonReportHeaderWebkit):
             'cr': cursor,
             'uid': uid,
             'report_name': _('General Ledger'),
+            'track_progress': self._track_progress,
             'display_account': self._get_display_account,
             'display_account_raw': self._get_display_account_raw,
             'filter_form': self._get_filter,
@@ -81,15 +84,14 @@ class GeneralLedgerWebkit(report_sxw.rml_parse, CommonReportHeaderWebkit):
         new_ids = data['form']['account_ids'] or data[
             'form']['chart_account_id']
 
-        # Account initial balance memoizer
-        init_balance_memoizer = {}
-
         # Reading form
         main_filter = self._get_form_param('filter', data, default='filter_no')
         target_move = self._get_form_param('target_move', data, default='all')
         start_date = self._get_form_param('date_from', data)
         stop_date = self._get_form_param('date_to', data)
         do_centralize = self._get_form_param('centralize', data)
+        display_counterparts = self._get_form_param(
+            'display_counterparts', data, default=True)
         start_period = self.get_start_period_br(data)
         stop_period = self.get_end_period_br(data)
         fiscalyear = self.get_fiscalyear_br(data)
@@ -113,33 +115,21 @@ class GeneralLedgerWebkit(report_sxw.rml_parse, CommonReportHeaderWebkit):
 
         # Retrieving accounts
         accounts = self.get_all_accounts(new_ids, exclude_type=['view'])
-        if initial_balance_mode == 'initial_balance':
-            init_balance_memoizer = self._compute_initial_balances(
-                accounts, start, fiscalyear)
-        elif initial_balance_mode == 'opening_balance':
-            init_balance_memoizer = self._read_opening_balance(accounts, start)
-
-        ledger_lines_memoizer = self._compute_account_ledger_lines(
-            accounts, init_balance_memoizer, main_filter, target_move, start,
-            stop)
         objects = self.pool.get('account.account').browse(self.cursor,
                                                           self.uid,
                                                           accounts,
                                                           context=lang_ctx)
 
-        init_balance = {}
-        ledger_lines = {}
-        for account in objects:
-            if do_centralize and account.centralized \
-                    and ledger_lines_memoizer.get(account.id):
-                ledger_lines[account.id] = self._centralize_lines(
-                    main_filter, ledger_lines_memoizer.get(account.id, []))
-            else:
-                ledger_lines[account.id] = ledger_lines_memoizer.get(
-                    account.id, [])
-            init_balance[account.id] = init_balance_memoizer.get(account.id,
-                                                                 {})
-
+        self._batch_params = {
+            'main_filter': main_filter,
+            'target_move': target_move,
+            'start': start,
+            'stop': stop,
+            'fiscalyear': fiscalyear,
+            'initial_balance_mode': initial_balance_mode,
+            'do_centralize': do_centralize,
+            'display_counterparts': display_counterparts,
+        }
         self.localcontext.update({
             'fiscalyear': fiscalyear,
             'start_date': start_date,
@@ -148,13 +138,139 @@ class GeneralLedgerWebkit(report_sxw.rml_parse, CommonReportHeaderWebkit):
             'stop_period': stop_period,
             'chart_account': chart_account,
             'initial_balance_mode': initial_balance_mode,
-            'init_balance': init_balance,
-            'ledger_lines': ledger_lines,
+            'init_balance': {},
+            'ledger_lines': {},
         })
+        if not self.render_by_batch:
+            self.localcontext.update(self._compute_batch(accounts))
 
         return super(GeneralLedgerWebkit, self).set_context(
             objects, data, new_ids, report_type=report_type)
 
+    def _compute_batch(self, account_ids):
+        """Compute the initial balances and the ledger lines of accounts"""
+        params = self._batch_params
+        main_filter = params['main_filter']
+        start = params['start']
+        init_balance_memoizer = {}
+        if params['initial_balance_mode'] == 'initial_balance':
+            init_balance_memoizer = self._compute_initial_balances(
+                account_ids, start, params['fiscalyear'])
+        elif params['initial_balance_mode'] == 'opening_balance':
+            init_balance_memoizer = self._read_opening_balance(account_ids,
+                                                               start)
+
+        # the counterparts of the previous batch are not used anymore
+        self._counterparts_cache = {}
+        ledger_lines_memoizer = self._compute_account_ledger_lines(
+            account_ids, init_balance_memoizer, main_filter,
+            params['target_move'], start, params['stop'],
+            counterparts=params['display_counterparts'])
+
+        init_balance = {}
+        ledger_lines = {}
+        for account in self.pool['account.account'].browse(
+                self.cursor, self.uid, account_ids):
+            if params['do_centralize'] and account.centralized \
+                    and ledger_lines_memoizer.get(account.id):
+                ledger_lines[account.id] = self._centralize_lines(
+                    main_filter, ledger_lines_memoizer.get(account.id, []))
+            else:
+                ledger_lines[account.id] = ledger_lines_memoizer.get(
+                    account.id, [])
+            init_balance[account.id] = init_balance_memoizer.get(account.id,
+                                                                 {})
+        return {'init_balance': init_balance, 'ledger_lines': ledger_lines}
+
+    def _get_native_pdf_tables(self, objects):
+        """Tables of the template of the general ledger"""
+        data = self.localcontext['data']
+        self.setLang(self.localcontext['user'].lang)
+        amount_currency = self._get_amount_currency(data)
+        display_all = self._get_display_account_raw(data) == 'all'
+        format_amount = self.formatLang
+        columns = [(_('Date'), 50, 'left'),
+                   (_('Period'), 50, 'left'),
+                   (_('Entry'), 100, 'left'),
+                   (_('Journal'), 70, 'left'),
+                   (_('Account'), 65, 'left'),
+                   (_('Partner'), 140, 'left'),
+                   (_('Reference'), 140, 'left'),
+                   (_('Label'), 160, 'left'),
+                   (_('Counter part'), 100, 'left'),
+                   (_('Debit'), 75, 'right'),
+                   (_('Credit'), 75, 'right'),
+                   (_('Cumul. Bal.'), 75, 'right')]
+        if amount_currency:
+            columns += [(_('Curr. Balance'), 75, 'right'),
+                        (_('Curr.'), 30, 'right')]
+        yield self._get_native_pdf_filters()
+        for account in objects:
+            init_balance = self.localcontext['init_balance'][account.id]
+            ledger_lines = self.localcontext['ledger_lines'][account.id]
+            display_initial_balance = init_balance and (
+                init_balance.get('debit') != 0.0 or
+                init_balance.get('credit', 0.0) != 0.0)
+            if not (display_all or ledger_lines or display_initial_balance):
+                continue
+            cumul_debit = cumul_credit = 0.0
+            cumul_balance = cumul_balance_curr = 0.0
+            rows = []
+            if display_initial_balance:
+                cumul_debit = init_balance.get('debit') or 0.0
+                cumul_credit = init_balance.get('credit') or 0.0
+                cumul_balance = init_balance.get('init_balance') or 0.0
+                cumul_balance_curr = \
+                    init_balance.get('init_balance_currency') or 0.0
+                cells = [u''] * 7 + [
+                    _('Initial Balance'), u'',
+                    format_amount(init_balance.get('debit')),
+                    format_amount(init_balance.get('credit')),
+                    format_amount(cumul_balance)]
+                if amount_currency:
+                    cells += [format_amount(cumul_balance_curr), u'']
+                rows.append((cells, False))
+            for line in ledger_lines:
+                cumul_debit += line.get('debit') or 0.0
+                cumul_credit += line.get('credit') or 0.0
+                cumul_balance_curr += line.get('amount_currency') or 0.0
+                cumul_balance += line.get('balance') or 0.0
+                label = line.get('lname') or u''
+                if line.get('invoice_number'):
+                    label = u'%s (%s)' % (label, line['invoice_number'])
+                cells = [
+                    self.formatLang(line.get('ldate') or '', date=True),
+                    line.get('period_code') or u'',
+                    line.get('move_name') or u'',
+                    line.get('jcode') or u'',
+                    account.code,
+                    line.get('partner_name') or u'',
+                    line.get('lref') or u'',
+                    label,
+                    line.get('counterparts') or u'',
+                    format_amount(line.get('debit', 0.0)),
+                    format_amount(line.get('credit', 0.0)),
+                    format_amount(cumul_balance)]
+                if amount_currency:
+                    cells += [
+                        format_amount(line.get('amount_currency') or 0.0),
+                        line.get('currency_code') or u'']
+                rows.append((cells, False))
+            cells = [u''] * 7 + [
+                _('Cumulated Balance on Account'), u'',
+                format_amount(cumul_debit),
+                format_amount(cumul_credit),
+                format_amount(cumul_balance)]
+            if amount_currency:
+                cells += [format_amount(cumul_balance_curr)
+                          if account.currency_id else u'-', u'']
+            rows.append((cells, True))
+            yield {
+                'title': u'%s - %s' % (account.code, account.name),
+                'columns': columns,
+                'rows': rows,
+            }
+
     def _centralize_lines(self, filter, ledger_lines, context=None):
         """ Group by period in filter mode 'period' or on one line in filter
             mode 'date' ledger_lines parameter is a list of dict built
@@ -213,16 +329,18 @@ class GeneralLedgerWebkit(report_sxw.rml_parse, CommonReportHeaderWebkit):
 
     def _compute_account_ledger_lines(self, accounts_ids,
                                       init_balance_memoizer, main_filter,
-                                      target_move, start, stop):
-        res = {}
-        for acc_id in accounts_ids:
-            move_line_ids = self.get_move_lines_ids(
-                acc_id, main_filter, start, stop, target_move)
-            if not move_line_ids:
-                res[acc_id] = []
-                continue
-
-            lines = self._get_ledger_lines(move_line_ids, acc_id)
+                                      target_move, start, stop,
+                                      counterparts=True):
+        """Fetch the ledger lines of all the accounts in a single query
+        streamed account by account"""
+        if counterparts:
+            self._precompute_moves_counterparts(
+                accounts_ids, main_filter, start, stop, target_move)
+        res = dict((acc_id, []) for acc_id in accounts_ids)
+        for acc_id, lines in self._iter_accounts_move_line_datas(
+                accounts_ids, main_filter, start, stop, target_move):
+            if counterparts:
+                lines = self._add_counterparts(lines, acc_id)
             res[acc_id] = lines
         return res
 
@@ -230,13 +348,16 @@ class GeneralLedgerWebkit(report_sxw.rml_parse, CommonReportHeaderWebkit):
         if not move_line_ids:
             return []
         res = self._get_move_line_datas(move_line_ids)
+        return self._add_counterparts(res, account_id)
+
+    def _add_counterparts(self, lines, account_id):
         # computing counter part is really heavy in term of ressouces
         # consuption looking for a king of SQL to help me improve it
-        move_ids = [x.get('move_id') for x in res]
+        move_ids = [x.get('move_id') for x in lines]
         counter_parts = self._get_moves_counterparts(move_ids, account_id)
-        for line in res:
+        for line in lines:
             line['counterparts'] = counter_parts.get(line.get('move_id'), '')
-        return res
+        return lines
 
 
 HeaderFooterTextWebKitParser(
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+"""Rendering of the templates directly in the html files given to
+wkhtmltopdf"""
+
+DOCTYPE = u'<!DOCTYPE'
+
+
+class HtmlFileWriter(object):
+
+    """Buffer of a Mako context writing the rendered html in a file, encoded
+    in UTF-8.
+
+    Like `WebKitParser._sanitize_html`, a doctype is added when the document
+    does not start with one: the beginning of the document is kept until
+    it can be checked.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.head = u''
+
+    def write(self, text):
+        if isinstance(text, str):
+            text = text.decode('utf-8')
+        if self.head is not None:
+            self.head += text
+            if len(self.head) < len(DOCTYPE):
+                return
+            text, self.head = self.head, None
+            if text[:len(DOCTYPE)].upper() != DOCTYPE:
+                text = u'<!DOCTYPE html>\n' + text
+        self.stream.write(text.encode('utf-8'))
+
+    def close(self):
+        """Write the beginning of a document shorter than a doctype"""
+        if self.head:
+            self.stream.write((u'<!DOCTYPE html>\n' + self.head)
+                              .encode('utf-8'))
+        self.head = None
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+"""Backend writing the tables of the reports straight to pdf with
+ReportLab, without rendering their html.
+
+The parsers supporting it set `native_pdf` and yield their tables from
+`_get_native_pdf_tables`, a table is a dict with:
+
+* title: caption printed above the table and repeated on each page
+* columns: list of tuples (label, width, align), the widths are relative
+* rows: list of tuples (cells, bold)
+"""
+import logging
+import time
+from cStringIO import StringIO
+from functools import partial
+from itertools import islice
+
+from openerp import tools
+
+from .pdf_chunks import PdfFileReader, has_page_numbers, merge_pdfs, \
+    stamp_page_numbers
+from .pdf_renderers import PdfRenderer, register_renderer
+from .webkit_parser_header_fix import BATCH_SIZE
+
+_logger = logging.getLogger('financial.reports.webkit')
+
+try:
+    from reportlab.lib import colors, pagesizes
+    from reportlab.lib.units import mm
+    from reportlab.pdfbase.pdfmetrics import stringWidth
+    from reportlab.pdfgen.canvas import Canvas
+    from reportlab.platypus import LongTable, SimpleDocTemplate, Spacer, \
+        TableStyle
+except ImportError:
+    Canvas = None
+    _logger.debug('Cannot import reportlab, the reports are rendered by '
+                  'wkhtmltopdf')
+
+FONT = 'Helvetica'
+BOLD_FONT = 'Helvetica-Bold'
+FONT_SIZE = 7
+CELL_PADDING = 2
+
+
+def fit_text(text, width, font=FONT, size=FONT_SIZE):
+    """Truncate a text to fit in a cell of `width` points"""
+    text = tools.ustr(text or u'')
+    # no character is wider than the font size
+    if len(text) * size <= width or \
+            stringWidth(text, font, size) <= width:
+        return text
+    while text and stringWidth(text + u'...', font, size) > width:
+        text = text[:-1]
+    return text + u'...'
+
+
+def header_footer_args(additional_args):
+    """Texts of the header and of the footer from the arguments passed to
+    wkhtmltopdf by the report"""
+    return dict((arg[0], arg[1] if len(arg) > 1 else True)
+                for arg in additional_args or [])
+
+
+def draw_header_footer(header_footer, margins, canvas, doc):
+    """Draw the texts of the header and of the footer in the margins of a
+    page, the texts printing page numbers are stamped once all the pages
+    are rendered"""
+    args = header_footer
+    width, height = canvas._pagesize
+    top, bottom, left, right = margins
+    header_size = float(args.get('--header-font-size') or 12)
+    footer_size = float(args.get('--footer-font-size') or 12)
+    header_y = height - top / 2.0
+    footer_y = bottom / 2.0
+    canvas.saveState()
+    canvas.setFont(args.get('--header-font-name') or FONT, header_size)
+    canvas.drawString(left, header_y, args.get('--header-left') or u'')
+    canvas.drawCentredString(width / 2.0, header_y,
+                             args.get('--header-center') or u'')
+    canvas.drawRightString(width - right, header_y,
+                           args.get('--header-right') or u'')
+    if args.get('--header-line'):
+        canvas.line(left, header_y - 3, width - right, header_y - 3)
+    canvas.setFont(args.get('--footer-font-name') or FONT, footer_size)
+    canvas.drawString(left, footer_y, args.get('--footer-left') or u'')
+    canvas.drawCentredString(width / 2.0, footer_y,
+                             args.get('--footer-center') or u'')
+    canvas.drawRightString(width - right, footer_y,
+                           args.get('--footer-right') or u'')
+    if args.get('--footer-line'):
+        canvas.line(left, footer_y + footer_size + 1, width - right,
+                    footer_y + footer_size + 1)
+    canvas.restoreState()
+
+
+def page_layout(webkit_header):
+    """Page size and margins (top, bottom, left, right) in points of a
+    webkit header"""
+    page_size = getattr(pagesizes, (webkit_header.format or 'A4').upper(),
+                        pagesizes.A4)
+    if (webkit_header.orientation or '').lower() == 'landscape':
+        page_size = pagesizes.landscape(page_size)
+    margins = tuple((margin or 0.0) * mm
+                    for margin in (webkit_header.margin_top,
+                                   webkit_header.margin_bottom,
+                                   webkit_header.margin_left,
+                                   webkit_header.margin_right))
+    return page_size, margins
+
+
+def table_flowable(table, width):
+    """ReportLab table of a table of the report, spread on `width`"""
+    columns = table['columns']
+    scale = width / float(sum(column[1] for column in columns))
+    widths = [column[1] * scale for column in columns]
+    style = [
+        ('FONT', (0, 0), (-1, -1), FONT, FONT_SIZE),
+        ('LEFTPADDING', (0, 0), (-1, -1), CELL_PADDING),
+        ('RIGHTPADDING', (0, 0), (-1, -1), CELL_PADDING),
+        ('TOPPADDING', (0, 0), (-1, -1), 1),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 1),
+    ]
+    data = []
+    header_rows = 0
+    if table.get('title'):
+        data.append([fit_text(table['title'], width, BOLD_FONT)] +
+                    [u''] * (len(columns) - 1))
+        style += [('SPAN', (0, 0), (-1, 0)),
+                  ('FONT', (0, 0), (-1, 0), BOLD_FONT, FONT_SIZE)]
+        header_rows += 1
+    data.append([fit_text(column[0], widths[index] - 2 * CELL_PADDING,
+                          BOLD_FONT)
+                 for index, column in enumerate(columns)])
+    style += [('FONT', (0, header_rows), (-1, header_rows), BOLD_FONT,
+               FONT_SIZE),
+              ('BACKGROUND', (0, header_rows), (-1, header_rows),
+               colors.HexColor('#EEEEEE')),
+              ('LINEBELOW', (0, header_rows), (-1, header_rows), 0.5,
+               colors.grey)]
+    header_rows += 1
+    for index, column in enumerate(columns):
+        if column[2] == 'right':
+            style.append(('ALIGN', (index, header_rows - 1), (index, -1),
+                          'RIGHT'))
+    for cells, bold in table['rows']:
+        font = BOLD_FONT if bold else FONT
+        if bold:
+            style.append(('FONT', (0, len(data)), (-1, len(data)), font,
+                          FONT_SIZE))
+        data.append([fit_text(cell, widths[index] - 2 * CELL_PADDING, font)
+                     for index, cell in enumerate(cells)])
+    return LongTable(data, colWidths=widths, repeatRows=header_rows,
+                     style=TableStyle(style))
+
+
+@register_renderer
+class NativePdfRenderer(PdfRenderer):
+    """Write the tables of the report to pdf.
+
+    In precise mode, the pdf is built for each batch of accounts so the
+    tables of only one batch are held in memory, the parts are merged and
+    the page numbers are stamped on the merged pdf.
+    """
+
+    name = 'native'
+
+    def supports(self, report_xml, parser_instance):
+        return bool(Canvas and PdfFileReader and
+                    getattr(parser_instance, 'native_pdf', False) and
+                    not report_xml.webkit_debug)
+
+    def _iter_objects(self, report, report_xml, parser_instance):
+        objects = parser_instance.localcontext['objects']
+        if not report_xml.precise_mode:
+            return parser_instance._track_progress(objects)
+        return (obj for batch in report._iter_objects_by_batch(
+            parser_instance, objects) for obj in batch)
+
+    def _build_pdf(self, tables, page_size, margins, header_footer):
+        """Pdf of tables, with the texts of the header and the footer"""
+        top, bottom, left, right = margins
+        result = StringIO()
+        doc = SimpleDocTemplate(result, pagesize=page_size, topMargin=top,
+                                bottomMargin=bottom, leftMargin=left,
+                                rightMargin=right)
+        story = []
+        for table in tables:
+            story += [table_flowable(table, doc.width), Spacer(0, 4 * mm)]
+        on_page = partial(draw_header_footer, header_footer, margins)
+        doc.build(story, onFirstPage=on_page, onLaterPages=on_page)
+        return result.getvalue()
+
+    def render(self, report, cursor, uid, report_xml, parser_instance,
+               context=None):
+        start = time.time()
+        webkit_header = report_xml.webkit_header
+        page_size, margins = page_layout(webkit_header)
+        additional_args = \
+            parser_instance.localcontext.get('additional_args') or []
+        header_footer = header_footer_args(
+            [arg for arg in additional_args
+             if not has_page_numbers(arg[1:])])
+        numbered_texts = [(arg[0], arg[1]) for arg in additional_args
+                          if has_page_numbers(arg[1:])]
+
+        objects = self._iter_objects(report, report_xml, parser_instance)
+        tables = parser_instance._get_native_pdf_tables(objects)
+        if report_xml.precise_mode:
+            parts = []
+            while True:
+                batch = list(islice(tables, BATCH_SIZE))
+                if not batch:
+                    break
+                parts.append(self._build_pdf(batch, page_size, margins,
+                                             header_footer))
+            pdf = merge_pdfs(parts) if len(parts) > 1 else parts[0]
+        else:
+            pdf = self._build_pdf(tables, page_size, margins, header_footer)
+
+        if numbered_texts:
+            # the page numbers are printed like wkhtmltopdf prints them
+            command = ['native']
+            for side in ('top', 'bottom', 'left', 'right'):
+                command += ['--margin-' + side,
+                            str(getattr(webkit_header, 'margin_' + side) or
+                                0.0)]
+            for arg in additional_args:
+                command.extend(arg)
+            pdf = stamp_page_numbers(pdf, command, numbered_texts)
+        _logger.info('Report %s written to pdf in %.3fs', report.name,
+                     time.time() - start)
+        return pdf, 'pdf'
@@ -21,7 +21,7 @@
 
 from collections import defaultdict
 from datetime import datetime
-from itertools import groupby
+from itertools import chain, groupby
 from operator import itemgetter
 from mako.template import Template
 
@@ -66,6 +66,7 @@ class PartnersOpenInvoicesWebkit(report_sxw.rml_parse,
             'cr': cursor,
             'uid': uid,
             'report_name': _('Open Invoices Report'),
+            'track_progress': self._track_progress,
             'display_account_raw': self._get_display_account_raw,
             'filter_form': self._get_filter,
             'target_move': self._get_target_move,
@@ -156,6 +157,11 @@ class PartnersOpenInvoicesWebkit(report_sxw.rml_parse,
         ledger_lines = {}
         init_balance = {}
         partners_order = {}
+        self._get_partners_directory(
+            partner_id for partners in chain(
+                ledger_lines_memoizer.itervalues(),
+                init_balance_memoizer.itervalues())
+            for partner_id in partners)
         for account in objects:
             ledger_lines[account.id] = ledger_lines_memoizer.get(account.id,
                                                                  {})
@@ -203,66 +209,127 @@ class PartnersOpenInvoicesWebkit(report_sxw.rml_parse,
                                          partner_filter=False):
         res = defaultdict(dict)
 
+        date_stop, date_until_match = self._get_open_transactions_date_stop(
+            main_filter, stop, date_until)
+
+        initial_lines = []
+        if main_filter in ('filter_period', 'filter_no'):
+            filter_from = 'period'
+            initial_lines = self._partners_initial_balance_line_ids(
+                accounts_ids, start, partner_filter, exclude_reconcile=True,
+                force_period_ids=False, date_stop=date_stop)
+        else:
+            filter_from = 'date'
+
+        # We get the move line ids of all the accounts at once
+        open_lines = self._get_partners_move_lines(
+            filter_from, accounts_ids, start, stop, target_move,
+            exclude_reconcile=True, partner_filter=partner_filter)
+
+        line_ids = set()
+        initial_line_ids = set()
+        # (account, partner) groups having lines of a reconciliation
+        groups_per_reconcile = defaultdict(set)
+        for lines, from_previous_periods in ((open_lines, False),
+                                             (initial_lines, True)):
+            for line in lines:
+                line_ids.add(line['id'])
+                if from_previous_periods:
+                    initial_line_ids.add(line['id'])
+                if line['reconcile_id']:
+                    groups_per_reconcile[line['reconcile_id']].add(
+                        (line['account_id'], line['partner_id']))
+
+        # a clearance line is displayed in all the groups having a line
+        # of its reconciliation
+        clearance_groups = defaultdict(set)
+        if date_until and not date_until_match:
+            clearance_per_reconcile = \
+                self._get_clearance_move_lines_by_reconcile(
+                    groups_per_reconcile.keys(), date_stop, date_until)
+            for rec_id, clearance_ids in clearance_per_reconcile.iteritems():
+                for clearance_id in clearance_ids:
+                    clearance_groups[clearance_id].update(
+                        groups_per_reconcile[rec_id])
+
+        for line in self._iter_move_line_datas(
+                list(line_ids.union(clearance_groups))):
+            group = (line['account_id'], line['lpartner_id'])
+            groups = clearance_groups.get(line['id'], ())
+            for clearance_group in groups:
+                if clearance_group == group and line['id'] in line_ids:
+                    continue
+                account_id, partner_id = clearance_group
+                res[account_id].setdefault(partner_id, []).append(
+                    dict(line, is_clearance_line=True))
+            if line['id'] not in line_ids:
+                continue
+            if line['id'] in initial_line_ids:
+                line['is_from_previous_periods'] = True
+            if group in groups:
+                line['is_clearance_line'] = True
+            account_id, partner_id = group
+            res[account_id].setdefault(partner_id, []).append(line)
+        return res
+
+    def _get_open_transactions_date_stop(self, main_filter, stop, date_until):
+        """Return the end date of the report and wether the until date
+        matches it
+
+        :return: tuple (date_stop, date_until_match)
+        """
         # we check if until date and date stop have the same value
         if main_filter in ('filter_period', 'filter_no'):
             date_stop = stop.date_stop
-            date_until_match = (date_stop == date_until)
-
         elif main_filter == 'filter_date':
             date_stop = stop
-            date_until_match = (stop == date_until)
-
         else:
             raise except_orm(
                 _('Unsuported filter'),
                 _('Filter has to be in filter date, period, or none'))
-
-        initial_move_lines_per_account = {}
-        if main_filter in ('filter_period', 'filter_no'):
-            initial_move_lines_per_account = self._tree_move_line_ids(
-                self._partners_initial_balance_line_ids(accounts_ids,
-                                                        start,
-                                                        partner_filter,
-                                                        exclude_reconcile=True,
-                                                        force_period_ids=False,
-                                                        date_stop=date_stop),
-                key='id')
-
-        for account_id in accounts_ids:
-            initial_move_lines_ids_per_partner = \
-                initial_move_lines_per_account.get(account_id, {})
-
-            # We get the move line ids of the account
-            move_line_ids_per_partner = self.get_partners_move_lines_ids(
-                account_id, main_filter, start, stop, target_move,
-                exclude_reconcile=True, partner_filter=partner_filter)
-
-            if not initial_move_lines_ids_per_partner \
-                    and not move_line_ids_per_partner:
-                continue
-            for partner_id in list(
-                    set(initial_move_lines_ids_per_partner.keys() +
-                        move_line_ids_per_partner.keys())):
-                partner_line_ids = (
-                    move_line_ids_per_partner.get(partner_id, []) +
-                    initial_move_lines_ids_per_partner.get(partner_id, []))
-
-                clearance_line_ids = []
-                if date_until and not date_until_match and partner_line_ids:
-                    clearance_line_ids = self._get_clearance_move_line_ids(
-                        partner_line_ids, date_stop, date_until)
-                    partner_line_ids += clearance_line_ids
-
-                lines = self._get_move_line_datas(list(set(partner_line_ids)))
-                for line in lines:
-                    if line['id'] in initial_move_lines_ids_per_partner.\
-                            get(partner_id, []):
-                        line['is_from_previous_periods'] = True
-                    if line['id'] in clearance_line_ids:
-                        line['is_clearance_line'] = True
-
-                res[account_id][partner_id] = lines
-        return res
+        return date_stop, date_stop == date_until
+
+    def _get_open_transactions_lines_query(self, accounts_ids, main_filter,
+                                           target_move, start, stop,
+                                           date_until=False,
+                                           partner_filter=False):
+        """Build a query returning the same lines as
+        `_compute_open_transactions_lines`, without their details, so it
+        can be used as a sub-query.
+
+        A clearance line is returned once for each account and partner
+        having a line of its reconciliation.
+
+        :return: tuple (sql, params), the query returns the columns id,
+            account_id and partner_id
+        """
+        date_stop, date_until_match = self._get_open_transactions_date_stop(
+            main_filter, stop, date_until)
+        filter_from = main_filter == 'filter_date' and 'date' or 'period'
+        sql, params = self._get_partners_move_lines_query(
+            filter_from, accounts_ids, start, stop, target_move,
+            exclude_reconcile=True, partner_filter=partner_filter)
+        if filter_from == 'period':
+            init_sql, init_params = \
+                self._get_partners_initial_balance_lines_query(
+                    accounts_ids, start, partner_filter,
+                    exclude_reconcile=True, force_period_ids=False,
+                    date_stop=date_stop)
+            sql = "%s UNION ALL %s" % (sql, init_sql)
+            params.update(init_params)
+        sql = ("WITH open_lines AS (%s) "
+               "SELECT id, account_id, partner_id FROM open_lines" % sql)
+        if date_until and not date_until_match:
+            sql += (" UNION"
+                    " SELECT cl.id, o.account_id, o.partner_id"
+                    " FROM open_lines o"
+                    " INNER JOIN account_move_line cl"
+                    " ON cl.reconcile_id = o.reconcile_id"
+                    " WHERE cl.date >= date(%(clear_date_stop)s)"
+                    " AND cl.date <= date(%(clear_date_until)s)")
+            params.update({'clear_date_stop': date_stop,
+                           'clear_date_until': date_until})
+        return sql, params
 
 
 HeaderFooterTextWebKitParser(
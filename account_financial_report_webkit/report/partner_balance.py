@@ -52,6 +52,7 @@ class PartnerBalanceWebkit(report_sxw.rml_parse,
             'cr': cursor,
             'uid': uid,
             'report_name': _('Partner Balance'),
+            'track_progress': self._track_progress,
             'display_account': self._get_display_account,
             'display_account_raw': self._get_display_account_raw,
             'filter_form': self._get_filter,
@@ -21,6 +21,7 @@
 
 from collections import defaultdict
 from datetime import datetime
+from itertools import chain
 
 from openerp.modules.registry import RegistryManager
 from openerp.exceptions import except_orm
@@ -53,6 +54,7 @@ class PartnersLedgerWebkit(report_sxw.rml_parse,
             'cr': cursor,
             'uid': uid,
             'report_name': _('Partner Ledger'),
+            'track_progress': self._track_progress,
             'display_account_raw': self._get_display_account_raw,
             'filter_form': self._get_filter,
             'target_move': self._get_target_move,
@@ -140,77 +142,97 @@ class PartnersLedgerWebkit(report_sxw.rml_parse,
         initial_balance_mode = init_balance and self._get_initial_balance_mode(
             start) or False
 
+        objects = self.pool.get('account.account').browse(self.cursor,
+                                                          self.uid,
+                                                          accounts,
+                                                          context=lang_ctx)
+
+        self._batch_params = {
+            'main_filter': main_filter,
+            'target_move': target_move,
+            'start': start,
+            'stop': stop,
+            'start_period': start_period,
+            'partner_ids': partner_ids,
+            'initial_balance_mode': initial_balance_mode,
+        }
+        self.localcontext.update({
+            'fiscalyear': fiscalyear,
+            'start_date': start_date,
+            'stop_date': stop_date,
+            'start_period': start_period,
+            'stop_period': stop_period,
+            'partner_ids': partner_ids,
+            'chart_account': chart_account,
+            'initial_balance_mode': initial_balance_mode,
+            'init_balance': {},
+            'ledger_lines': {},
+            'partners_order': {},
+        })
+        if not self.render_by_batch:
+            self.localcontext.update(self._compute_batch(accounts))
+
+        return super(PartnersLedgerWebkit, self).set_context(
+            objects, data, new_ids, report_type=report_type)
+
+    def _compute_batch(self, account_ids):
+        """Compute the initial balances, the ledger lines and the order of
+        the partners of accounts"""
+        params = self._batch_params
+        initial_balance_mode = params['initial_balance_mode']
+        partner_ids = params['partner_ids']
         initial_balance_lines = {}
         if initial_balance_mode == 'initial_balance':
             initial_balance_lines = self._compute_partners_initial_balances(
-                accounts, start_period, partner_filter=partner_ids,
-                exclude_reconcile=False)
+                account_ids, params['start_period'],
+                partner_filter=partner_ids, exclude_reconcile=False)
 
         ledger_lines = self._compute_partner_ledger_lines(
-            accounts, main_filter, target_move, start, stop,
-            partner_filter=partner_ids)
-        objects = self.pool.get('account.account').browse(self.cursor,
-                                                          self.uid,
-                                                          accounts,
-                                                          context=lang_ctx)
+            account_ids, params['main_filter'], params['target_move'],
+            params['start'], params['stop'], partner_filter=partner_ids)
 
         init_balance = {}
         ledger_lines_dict = {}
         partners_order = {}
-        for account in objects:
-            ledger_lines_dict[account.id] = ledger_lines.get(account.id, {})
-            init_balance[account.id] = initial_balance_lines.get(account.id,
+        self._get_partners_directory(
+            partner_id for partners in chain(
+                ledger_lines.itervalues(),
+                initial_balance_lines.itervalues())
+            for partner_id in partners)
+        for account_id in account_ids:
+            ledger_lines_dict[account_id] = ledger_lines.get(account_id, {})
+            init_balance[account_id] = initial_balance_lines.get(account_id,
                                                                  {})
             # we have to compute partner order based on inital balance
             # and ledger line as we may have partner with init bal
             # that are not in ledger line and vice versa
-            ledg_lines_pids = ledger_lines.get(account.id, {}).keys()
+            ledg_lines_pids = ledger_lines.get(account_id, {}).keys()
             if initial_balance_mode:
                 non_null_init_balances = dict(
                     [(ib, amounts) for ib, amounts
-                     in init_balance[account.id].iteritems()
+                     in init_balance[account_id].iteritems()
                      if amounts['init_balance'] or
                      amounts['init_balance_currency']])
                 init_bal_lines_pids = non_null_init_balances.keys()
             else:
-                init_balance[account.id] = {}
+                init_balance[account_id] = {}
                 init_bal_lines_pids = []
 
-            partners_order[account.id] = self._order_partners(
+            partners_order[account_id] = self._order_partners(
                 ledg_lines_pids, init_bal_lines_pids)
-
-        self.localcontext.update({
-            'fiscalyear': fiscalyear,
-            'start_date': start_date,
-            'stop_date': stop_date,
-            'start_period': start_period,
-            'stop_period': stop_period,
-            'partner_ids': partner_ids,
-            'chart_account': chart_account,
-            'initial_balance_mode': initial_balance_mode,
-            'init_balance': init_balance,
-            'ledger_lines': ledger_lines_dict,
-            'partners_order': partners_order
-        })
-
-        return super(PartnersLedgerWebkit, self).set_context(
-            objects, data, new_ids, report_type=report_type)
+        return {'init_balance': init_balance,
+                'ledger_lines': ledger_lines_dict,
+                'partners_order': partners_order}
 
     def _compute_partner_ledger_lines(self, accounts_ids, main_filter,
                                       target_move, start, stop,
                                       partner_filter=False):
         res = defaultdict(dict)
 
-        for acc_id in accounts_ids:
-            move_line_ids = self.get_partners_move_lines_ids(
-                acc_id, main_filter, start, stop, target_move,
-                exclude_reconcile=False, partner_filter=partner_filter)
-            if not move_line_ids:
-                continue
-            for partner_id in move_line_ids:
-                partner_line_ids = move_line_ids.get(partner_id, [])
-                lines = self._get_move_line_datas(list(set(partner_line_ids)))
-                res[acc_id][partner_id] = lines
+        for acc_id, partner_id, lines in self._iter_partners_move_line_datas(
+                accounts_ids, main_filter, start, stop, target_move,
+                exclude_reconcile=False, partner_filter=partner_filter):
+            res[acc_id][partner_id] = lines
         return res
 
 
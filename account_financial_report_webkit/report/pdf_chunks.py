@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+"""Helpers to render the pdf of a report in several chunks and to merge
+them with the page numbers of the whole document"""
+import logging
+from cStringIO import StringIO
+
+_logger = logging.getLogger('financial.reports.webkit')
+
+try:
+    from pyPdf import PdfFileReader, PdfFileWriter
+except ImportError:
+    PdfFileReader = PdfFileWriter = None
+    _logger.debug('Cannot import pyPdf, the pdf are not rendered in '
+                  'parallel')
+
+try:
+    from reportlab.lib.units import mm
+    from reportlab.pdfgen.canvas import Canvas
+except ImportError:
+    Canvas = None
+    _logger.debug('Cannot import reportlab, the chunks printing page '
+                  'numbers are rendered twice')
+
+PAGE_NUMBERS = ('[page]', '[topage]')
+
+
+def split_chunks(items, sizes, count):
+    """Split items in at most `count` chunks of consecutive items with
+    about the same total size"""
+    total = float(sum(sizes)) or 1.0
+    chunks = [[]]
+    done = 0
+    for item, size in zip(items, sizes):
+        if chunks[-1] and len(chunks) < count and \
+                done >= total * len(chunks) / count:
+            chunks.append([])
+        chunks[-1].append(item)
+        done += size
+    return chunks
+
+
+def has_page_numbers(command):
+    """Whether the arguments of wkhtmltopdf print page numbers"""
+    return any(number in arg for arg in command for number in PAGE_NUMBERS)
+
+
+def number_pages(command, offset, total):
+    """Arguments of wkhtmltopdf to print a chunk starting after `offset`
+    pages in a document of `total` pages"""
+    return [command[0], '--page-offset', str(offset)] + \
+        [arg.replace('[topage]', str(total)) for arg in command[1:]]
+
+
+def split_page_numbers(command):
+    """Remove the texts printing page numbers from the arguments of
+    wkhtmltopdf
+
+    :return: tuple (command, texts), texts being a list of tuples
+             (option, text) such as ('--footer-right', 'Page [page]')
+    """
+    result = []
+    texts = []
+    for arg in command:
+        if result and result[-1].startswith('--') and \
+                has_page_numbers([arg]):
+            texts.append((result.pop(), arg))
+        else:
+            result.append(arg)
+    return result, texts
+
+
+def _get_option(command, option, default):
+    if option in command[:-1]:
+        return command[command.index(option) + 1]
+    return default
+
+
+def stamp_page_numbers(pdf, command, texts):
+    """Print the texts with page numbers removed by `split_page_numbers`
+    on the pages of a pdf rendered with `command`, in the margins like
+    wkhtmltopdf prints its text headers and footers"""
+    reader = PdfFileReader(StringIO(pdf))
+    total = reader.getNumPages()
+    margins = dict(
+        (side, float(_get_option(command, '--margin-' + side, '10')
+                     .replace(',', '.')) * mm)
+        for side in ('top', 'bottom', 'left', 'right'))
+    overlay = StringIO()
+    canvas = Canvas(overlay)
+    for index in range(total):
+        box = reader.getPage(index).mediaBox
+        width, height = float(box.getWidth()), float(box.getHeight())
+        canvas.setPageSize((width, height))
+        for option, text in texts:
+            place, position = option[2:].split('-')
+            canvas.setFont(
+                _get_option(command, '--%s-font-name' % place, 'Helvetica'),
+                float(_get_option(command, '--%s-font-size' % place, '12')))
+            text = text.replace('[page]', str(index + 1)).replace(
+                '[topage]', str(total))
+            y = height - margins['top'] / 2.0 if place == 'header' \
+                else margins['bottom'] / 2.0
+            if position == 'left':
+                canvas.drawString(margins['left'], y, text)
+            elif position == 'center':
+                canvas.drawCentredString(width / 2.0, y, text)
+            else:
+                canvas.drawRightString(width - margins['right'], y, text)
+        canvas.showPage()
+    canvas.save()
+    overlay_reader = PdfFileReader(StringIO(overlay.getvalue()))
+    writer = PdfFileWriter()
+    for index in range(total):
+        page = reader.getPage(index)
+        page.mergePage(overlay_reader.getPage(index))
+        writer.addPage(page)
+    result = StringIO()
+    writer.write(result)
+    return result.getvalue()
+
+
+def count_pages(pdf):
+    return PdfFileReader(StringIO(pdf)).getNumPages()
+
+
+def merge_pdfs(pdfs):
+    """Concatenate the pages of several pdf"""
+    writer = PdfFileWriter()
+    for pdf in pdfs:
+        reader = PdfFileReader(StringIO(pdf))
+        for index in range(reader.getNumPages()):
+            writer.addPage(reader.getPage(index))
+    result = StringIO()
+    writer.write(result)
+    return result.getvalue()
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+"""Backends rendering the pdf of the financial reports.
+
+A backend is registered with `register_renderer` under its name, the
+backend used by the reports is set by the `webkit_report_pdf_renderer`
+option of the server, or by the `webkit_pdf_renderer` key of the context.
+The reports fall back on wkhtmltopdf when a backend does not support them.
+"""
+from openerp import tools
+
+DEFAULT_RENDERER = 'wkhtmltopdf'
+
+PDF_RENDERER = tools.config.get('webkit_report_pdf_renderer',
+                                DEFAULT_RENDERER)
+
+_renderers = {}
+
+
+def register_renderer(cls):
+    """Class decorator registering a backend under its name"""
+    _renderers[cls.name] = cls()
+    return cls
+
+
+def get_renderer(report_xml, parser_instance, context=None):
+    """Backend rendering the pdf of a report"""
+    name = (context or {}).get('webkit_pdf_renderer') or PDF_RENDERER
+    renderer = _renderers.get(name)
+    if renderer is None or \
+            not renderer.supports(report_xml, parser_instance):
+        renderer = _renderers[DEFAULT_RENDERER]
+    return renderer
+
+
+class PdfRenderer(object):
+    """Interface of the backends rendering the reports"""
+
+    name = None
+
+    def supports(self, report_xml, parser_instance):
+        """Whether the backend can render the report of the parser"""
+        return True
+
+    def render(self, report, cursor, uid, report_xml, parser_instance,
+               context=None):
+        """Render the report once the context of its parser is set
+
+        :param report: the webkit report (`HeaderFooterTextWebKitParser`)
+        :return: tuple (content, format)
+        """
+        raise NotImplementedError
+
+
+@register_renderer
+class WkhtmltopdfRenderer(PdfRenderer):
+    """Render the Mako template of the report in html, converted in pdf by
+    wkhtmltopdf"""
+
+    name = 'wkhtmltopdf'
+
+    def render(self, report, cursor, uid, report_xml, parser_instance,
+               context=None):
+        return report._render_with_wkhtmltopdf(
+            cursor, uid, report_xml, parser_instance, context=context)
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+
+class PeriodCalendar(object):
+
+    """Periods of the accounting kept in memory.
+
+    The periods are sorted like `account.period` (date_start, special desc)
+    so the searches of the reports can be answered without querying the
+    database.
+    """
+
+    def __init__(self, periods):
+        """
+        :param periods: list of dicts with the keys id, date_start,
+            date_stop, special, fiscalyear_id and company_id, the many2one
+            being ids
+        """
+        self.periods = sorted(
+            periods, key=lambda period: (period['date_start'],
+                                         not period['special']))
+        self.by_id = dict((period['id'], period) for period in self.periods)
+
+    def __contains__(self, period_id):
+        return period_id in self.by_id
+
+    def opening_period_ids(self):
+        """Ids of all the special periods"""
+        return [period['id'] for period in self.periods if period['special']]
+
+    def exclude_opening(self, period_ids):
+        """Ids of the periods of period_ids which are not special"""
+        period_ids = set(period_ids)
+        return [period['id'] for period in self.periods
+                if period['id'] in period_ids and not period['special']]
+
+    def included_opening_period_ids(self, date_start, date_stop, company_id):
+        """Id of the first special period between date_start and date_stop
+        in a list, empty when there is none"""
+        for period in self.periods:
+            if (period['special'] and
+                    period['date_start'] >= date_start and
+                    period['date_stop'] <= date_stop and
+                    period['company_id'] == company_id):
+                return [period['id']]
+        return []
+
+    def fiscalyear_special_periods(self, fiscalyear_id):
+        """Special periods of a fiscal year sorted by start date"""
+        return [period for period in self.periods
+                if period['special'] and
+                period['fiscalyear_id'] == fiscalyear_id]
+
+    def previous_opening_periods(self, date_start, fiscalyear_id=False):
+        """Special periods ending before date_start, the latest first"""
+        periods = [period for period in self.periods
+                   if period['special'] and
+                   period['date_stop'] < date_start and
+                   (not fiscalyear_id or
+                    period['fiscalyear_id'] == fiscalyear_id)]
+        periods.sort(key=lambda period: period['date_stop'], reverse=True)
+        return periods
+
+    def previous_period_ids(self, date_stop, include_opening=False,
+                            fiscalyear_id=False, date_start_from=False):
+        """Ids of the periods ending at date_stop or before
+
+        :param include_opening: if False, special periods are excluded
+        :param fiscalyear_id: only keep the periods of this fiscal year
+        :param date_start_from: only keep the periods starting at this date
+            or after
+        """
+        return [period['id'] for period in self.periods
+                if period['date_stop'] <= date_stop and
+                (include_opening or not period['special']) and
+                (not fiscalyear_id or
+                 period['fiscalyear_id'] == fiscalyear_id) and
+                (not date_start_from or
+                 period['date_start'] >= date_start_from)]
@@ -57,6 +57,7 @@ class PrintJournalWebkit(report_sxw.rml_parse, CommonReportHeaderWebkit):
             'cr': cursor,
             'uid': uid,
             'report_name': _('Journals'),
+            'track_progress': self._track_progress,
             'display_account_raw': self._get_display_account_raw,
             'filter_form': self._get_filter,
             'target_move': self._get_target_move,
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+"""Progress of the reports rendered in background"""
+
+
+class ProgressList(list):
+
+    """List of the objects of a report calling `callback(done, total)` while
+    it is iterated over, each time the count of objects done reaches a new
+    percent of the total and at the end.
+
+    When a template loops several times over the objects, the progress is
+    the one of the current loop.
+    """
+
+    def __init__(self, objects, callback):
+        super(ProgressList, self).__init__(objects)
+        self.callback = callback
+
+    def __iter__(self):
+        total = len(self)
+        step = max(total // 100, 1)
+        for done, obj in enumerate(super(ProgressList, self).__iter__()):
+            if not done % step:
+                self.callback(done, total)
+            yield obj
+        self.callback(total, total)
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+"""Cache of the rendered reports, shared by the users printing the same
+report with the same parameters and the same access rights"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from openerp import tools
+
+# keys of the form which do not change the content of the report
+VOLATILE_FORM_KEYS = ('id', 'create_uid', 'create_date', 'write_uid',
+                      'write_date', '__last_update')
+
+
+def _normalize(value):
+    """Normalize the values of the form: the many2one read as (id, name)
+    are reduced to their id and the lists of ids are sorted"""
+    if isinstance(value, dict):
+        return dict((key, _normalize(val)) for key, val in value.items())
+    if isinstance(value, (list, tuple)):
+        if len(value) == 2 and isinstance(value[0], (int, long)) and \
+                isinstance(value[1], basestring):
+            return value[0]
+        if all(isinstance(item, (int, long)) for item in value):
+            return sorted(value)
+        return [_normalize(item) for item in value]
+    return value
+
+
+def cache_key(report_name, ids, data, *parts):
+    """Hash of the report, its ids, the form of the wizard and any other
+    part changing the result (access rights, ledger watermark...)"""
+    form = dict((key, value)
+                for key, value in (data.get('form') or {}).items()
+                if key not in VOLATILE_FORM_KEYS)
+    payload = json.dumps([report_name, _normalize(list(ids or [])),
+                          _normalize(form), parts],
+                         sort_keys=True, default=unicode)
+    return hashlib.sha1(payload).hexdigest()
+
+
+class ResultCache(object):
+
+    """Least recently used rendered reports, bounded by the total size of
+    their content
+
+    The entries are tuples (content, format) as returned by the report
+    services.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            result = self.entries.pop(key, None)
+            if result is not None:
+                self.entries[key] = result
+            return result
+
+    def set(self, key, result):
+        size = len(result[0])
+        if size > self.max_size:
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous[0])
+            self.entries[key] = result
+            self.size += size
+            while self.size > self.max_size:
+                __, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted[0])
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+# size of the cache in megabytes, the cache is disabled when it is 0
+result_cache = ResultCache(
+    int(tools.config.get('webkit_report_cache_size', 0)) * 1024 * 1024)
@@ -36,6 +36,8 @@ def sign(number):
 class TrialBalanceWebkit(report_sxw.rml_parse,
                          CommonBalanceReportHeaderWebkit):
 
+    native_pdf = True
+
     # pylint: disable=old-api7-method-defined
     def __init__(self, cursor, uid, name, context):
         super(TrialBalanceWebkit, self).__init__(cursor, uid, name,
@@ -55,6 +57,7 @@ class TrialBalanceWebkit(report_sxw.rml_parse,
             'cr': cursor,
             'uid': uid,
             'report_name': _('Trial Balance'),
+            'track_progress': self._track_progress,
             'display_account': self._get_display_account,
             'display_account_raw': self._get_display_account_raw,
             'filter_form': self._get_filter,
@@ -86,6 +89,73 @@ class TrialBalanceWebkit(report_sxw.rml_parse,
         return super(TrialBalanceWebkit, self).set_context(
             objects, data, new_ids, report_type=report_type)
 
+    def _get_native_pdf_tables(self, objects):
+        """Tables of the template of the trial balance"""
+        context = self.localcontext
+        self.setLang(context['user'].lang)
+        comparison_mode = context['comparison_mode']
+        fiscalyear = context['fiscalyear']
+        columns = [(_('Code'), 20, 'left'), (_('Account'), 80, 'left')]
+        if comparison_mode == 'no_comparison':
+            if context['initial_balance_mode']:
+                columns.append((_('Initial Balance'), 30, 'right'))
+            columns += [(_('Debit'), 30, 'right'),
+                        (_('Credit'), 30, 'right')]
+        if comparison_mode == 'no_comparison' or not fiscalyear:
+            columns.append((_('Balance'), 30, 'right'))
+        else:
+            columns.append((_('Balance %s') % (fiscalyear.name,), 30,
+                            'right'))
+        if comparison_mode in ('single', 'multiple'):
+            for index, params in enumerate(context['comp_params']):
+                if params['comparison_filter'] == 'filter_year' and \
+                        params.get('fiscalyear'):
+                    label = _('Balance %s') % (params['fiscalyear'].name,)
+                else:
+                    label = _('Balance C%s') % (index + 1,)
+                columns.append((label, 30, 'right'))
+                if comparison_mode == 'single':
+                    columns += [(_('Difference'), 30, 'right'),
+                                (_('% Difference'), 30, 'right')]
+
+        rows = []
+        last_child_consol_ids = []
+        last_level = False
+        for account in objects:
+            if not context['to_display_accounts'][account.id]:
+                continue
+            if account.id in last_child_consol_ids:
+                level = last_level
+            else:
+                level = account.level or 0
+                last_child_consol_ids = [child.id for child
+                                         in account.child_consol_ids]
+                last_level = account.level
+            cells = [account.code, u'  ' * (level or 0) + account.name]
+            if comparison_mode == 'no_comparison':
+                if context['initial_balance_mode']:
+                    cells.append(self.formatLang(
+                        context['init_balance_accounts'][account.id]))
+                cells += [
+                    self.formatLang(context['debit_accounts'][account.id]),
+                    self.formatLang(context['credit_accounts'][account.id])]
+            cells.append(
+                self.formatLang(context['balance_accounts'][account.id]))
+            if comparison_mode in ('single', 'multiple'):
+                for comp_account in \
+                        context['comparisons_accounts'][account.id]:
+                    cells.append(self.formatLang(comp_account['balance']))
+                    if comparison_mode == 'single':
+                        cells.append(self.formatLang(comp_account['diff']))
+                        if comp_account['percent_diff'] is False:
+                            cells.append(u'-')
+                        else:
+                            cells.append(u'%s %%' % (
+                                int(round(comp_account['percent_diff'])),))
+            rows.append((cells, account.type == 'view'))
+        yield self._get_native_pdf_filters()
+        yield {'title': False, 'columns': columns, 'rows': rows}
+
 
 HeaderFooterTextWebKitParser(
     'report.account.account_report_trial_balance_webkit',
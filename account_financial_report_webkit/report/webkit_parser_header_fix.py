@@ -30,14 +30,19 @@
 from mako.template import Template
 from mako.lookup import TemplateLookup
 
+import hashlib
 import os
 import subprocess
 import tempfile
+import time
 import logging
 from functools import partial
+from itertools import islice
+from multiprocessing.pool import ThreadPool
 
 
 from mako import exceptions
+from mako.runtime import Context
 from openerp.exceptions import except_orm
 from openerp.tools.translate import _
 from openerp.modules.registry import RegistryManager
@@ -46,8 +51,22 @@ from openerp.addons.report_webkit import webkit_report
 from openerp.addons.report_webkit.report_helper import WebKitHelper
 from openerp.modules.module import get_module_resource
 
+from .html_stream import HtmlFileWriter
+from .pdf_chunks import Canvas, PdfFileReader, count_pages, \
+    has_page_numbers, merge_pdfs, number_pages, split_chunks, \
+    split_page_numbers, stamp_page_numbers
+from .pdf_renderers import get_renderer
+from .wkhtmltopdf_pool import pdf_pool
+
 _logger = logging.getLogger('financial.reports.webkit')
 
+# number of wkhtmltopdf processes rendering the chunks of a report in
+# parallel, the reports are rendered by one process when it is 1
+PDF_WORKERS = int(tools.config.get('webkit_report_pdf_workers', 1))
+
+# number of accounts computed at once by the reports rendered in precise mode
+BATCH_SIZE = int(tools.config.get('webkit_report_batch_size', 100))
+
 # Class used only as a workaround to bug:
 # http://code.google.com/p/wkhtmltopdf/issues/detail?id=656
 
@@ -91,16 +110,49 @@ def mako_template(text):
                     lookup=tmp_lookup)
 
 
+# compiled templates of the process, by path of template file or by hash of
+# template stored in the database, the files are compiled again when their
+# modification time changes
+_compiled_templates = {}
+
+# directory where Mako stores the python modules compiled from the template
+# files, so they are not compiled again when the server restarts
+MAKO_MODULE_DIRECTORY = tools.config.get('webkit_report_mako_directory')
+
+
+def cached_mako_template(path=None, text=None):
+    """Compiled Mako template of a file or of a text, compiled once per
+    process (per modification time for the files)."""
+    if path:
+        key = path
+        version = os.path.getmtime(path)
+    else:
+        key = hashlib.sha1(tools.ustr(text).encode('utf-8')).hexdigest()
+        version = None
+    cached = _compiled_templates.get(key)
+    if cached and cached[0] == version:
+        return cached[1]
+    start = time.time()
+    if path:
+        template = Template(filename=path,
+                            module_directory=MAKO_MODULE_DIRECTORY or None,
+                            input_encoding='utf-8', output_encoding='utf-8',
+                            lookup=TemplateLookup())
+    else:
+        template = mako_template(text)
+    _logger.info('Mako template %s compiled in %.3fs', path or key,
+                 time.time() - start)
+    _compiled_templates[key] = (version, template)
+    return template
+
+
 class HeaderFooterTextWebKitParser(webkit_report.WebKitParser):
 
-    def generate_pdf(self, comm_path, report_xml, header, footer, html_list,
-                     webkit_header=False, parser_instance=False):
-        """Call webkit in order to generate pdf"""
-        if not webkit_header:
-            webkit_header = report_xml.webkit_header
-        fd, out_filename = tempfile.mkstemp(suffix=".pdf",
-                                            prefix="webkit.tmp.")
-        file_to_del = [out_filename]
+    def _get_wkhtmltopdf_command(self, comm_path, webkit_header,
+                                 parser_instance):
+        """Arguments of wkhtmltopdf for the page layout of the header and the
+        additional arguments of the report, without the input and output
+        files"""
         if comm_path:
             command = [comm_path]
         else:
@@ -138,20 +190,35 @@ class HeaderFooterTextWebKitParser(webkit_report.WebKitParser):
         if parser_instance.localcontext.get('additional_args', False):
             for arg in parser_instance.localcontext['additional_args']:
                 command.extend(arg)
+        return command
+
+    def _remove_files(self, paths):
+        for f_to_del in paths:
+            try:
+                os.unlink(f_to_del)
+            except (OSError, IOError), exc:
+                _logger.error('cannot remove file %s: %s', f_to_del, exc)
 
-        count = 0
-        for html in html_list:
-            with tempfile.NamedTemporaryFile(suffix="%d.body.html" % count,
-                                             delete=False) as html_file:
-                count += 1
-                html_file.write(self._sanitize_html(html))
-            file_to_del.append(html_file.name)
-            command.append(html_file.name)
-        command.append(out_filename)
+    def _call_wkhtmltopdf(self, command, html_paths):
+        """Render html files in one pdf with wkhtmltopdf, by a process of
+        the pool when one is available, else by a new process"""
+        fd, out_filename = tempfile.mkstemp(suffix=".pdf",
+                                            prefix="webkit.tmp.")
+        os.close(fd)
+        try:
+            if not pdf_pool.convert(command, html_paths + [out_filename]):
+                self._spawn_wkhtmltopdf(command, html_paths + [out_filename])
+            with open(out_filename, 'rb') as pdf_file:
+                pdf = pdf_file.read()
+        finally:
+            self._remove_files([out_filename])
+        return pdf
+
+    def _spawn_wkhtmltopdf(self, command, args):
+        """Convert html files to pdf with a new wkhtmltopdf process"""
         stderr_fd, stderr_path = tempfile.mkstemp(text=True)
-        file_to_del.append(stderr_path)
         try:
-            status = subprocess.call(command, stderr=stderr_fd)
+            status = subprocess.call(command + args, stderr=stderr_fd)
             os.close(stderr_fd)  # ensure flush before reading
             stderr_fd = None  # avoid closing again in finally block
             fobj = open(stderr_path, 'r')
@@ -168,19 +235,114 @@ class HeaderFooterTextWebKitParser(webkit_report.WebKitParser):
                                  _("The command 'wkhtmltopdf' failed with \
                                  error code = %s. Message: %s") %
                                  (status, error_message))
-            with open(out_filename, 'rb') as pdf_file:
-                pdf = pdf_file.read()
-            os.close(fd)
         finally:
             if stderr_fd is not None:
                 os.close(stderr_fd)
-            for f_to_del in file_to_del:
-                try:
-                    os.unlink(f_to_del)
-                except (OSError, IOError), exc:
-                    _logger.error('cannot remove file %s: %s', f_to_del, exc)
+            self._remove_files([stderr_path])
+
+    def _generate_pdf_in_chunks(self, command, html_paths, workers):
+        """Render the html files in chunks of consecutive files (one file
+        per account in precise mode) by parallel wkhtmltopdf processes, and
+        merge the chunks.
+
+        The page numbers of a chunk depend on the pages of the previous
+        ones, so when the header or the footer prints them, the chunks are
+        rendered without them and the page numbers are printed on the
+        merged pdf. Without reportlab, the chunks are rendered once to
+        count their pages then again with their page offset and the total
+        of pages.
+        """
+        chunks = split_chunks(html_paths,
+                              [os.path.getsize(path) for path in html_paths],
+                              workers)
+        _logger.debug('Rendering %s html files in %s chunks',
+                      len(html_paths), len(chunks))
+        numbered_texts = []
+        if has_page_numbers(command) and Canvas:
+            command, numbered_texts = split_page_numbers(command)
+        pool = ThreadPool(len(chunks))
+        try:
+            pdfs = pool.map(partial(self._call_wkhtmltopdf, command), chunks)
+            if has_page_numbers(command):
+                page_counts = [count_pages(pdf) for pdf in pdfs]
+                total = sum(page_counts)
+                commands = [number_pages(command, sum(page_counts[:index]),
+                                         total)
+                            for index in range(len(chunks))]
+                pdfs = pool.map(
+                    lambda args: self._call_wkhtmltopdf(*args),
+                    zip(commands, chunks))
+        finally:
+            pool.close()
+            pool.join()
+        pdf = merge_pdfs(pdfs)
+        if numbered_texts:
+            pdf = stamp_page_numbers(pdf, command, numbered_texts)
         return pdf
 
+    def generate_pdf(self, comm_path, report_xml, header, footer, html_list,
+                     webkit_header=False, parser_instance=False):
+        """Call webkit in order to generate pdf"""
+        html_paths = []
+        try:
+            for count, html in enumerate(html_list):
+                with tempfile.NamedTemporaryFile(
+                        suffix="%d.body.html" % count,
+                        delete=False) as html_file:
+                    html_paths.append(html_file.name)
+                    html_file.write(self._sanitize_html(html))
+            return self.generate_pdf_from_files(
+                comm_path, report_xml, html_paths,
+                webkit_header=webkit_header, parser_instance=parser_instance)
+        finally:
+            self._remove_files(html_paths)
+
+    def generate_pdf_from_files(self, comm_path, report_xml, html_paths,
+                                webkit_header=False, parser_instance=False):
+        """Call webkit in order to generate the pdf of html files"""
+        if not webkit_header:
+            webkit_header = report_xml.webkit_header
+        command = self._get_wkhtmltopdf_command(comm_path, webkit_header,
+                                                parser_instance)
+        workers = min(PDF_WORKERS, len(html_paths))
+        if workers > 1 and PdfFileReader:
+            return self._generate_pdf_in_chunks(command, html_paths, workers)
+        return self._call_wkhtmltopdf(command, html_paths)
+
+    def _render_html(self, template, values, html_path=None):
+        """Render a template, directly in the file `html_path` when it is
+        given so the html is never held in memory
+
+        :return: the html, or html_path
+        """
+        try:
+            if not html_path:
+                return template.render(**values)
+            with open(html_path, 'wb') as html_file:
+                writer = HtmlFileWriter(html_file)
+                template.render_context(Context(writer, **values))
+                writer.close()
+            return html_path
+        except Exception:
+            msg = exceptions.text_error_template().render()
+            _logger.error(msg)
+            raise except_orm(_('Webkit render'), msg)
+
+    def _iter_objects_by_batch(self, parser_instance, objects):
+        """Yield the objects of a report rendered in precise mode one by one
+        in a list, the data of the objects being computed by batch with
+        `_compute_batch` of the parser before the objects of the batch are
+        rendered, and replaced by the data of the next batch"""
+        objects = iter(parser_instance._track_progress(objects))
+        while True:
+            batch = list(islice(objects, BATCH_SIZE))
+            if not batch:
+                break
+            parser_instance.localcontext.update(
+                parser_instance._compute_batch([obj.id for obj in batch]))
+            for obj in batch:
+                yield [obj]
+
     # override needed to keep the attachments' storing procedure
     # pylint: disable=old-api7-method-defined
     def create_single_pdf(self, cursor, uid, ids, data, report_xml,
@@ -189,7 +351,6 @@ class HeaderFooterTextWebKitParser(webkit_report.WebKitParser):
 
         if context is None:
             context = {}
-        htmls = []
         if report_xml.report_type != 'webkit':
             return super(HeaderFooterTextWebKitParser, self
                          ).create_single_pdf(cursor, uid, ids, data,
@@ -202,18 +363,31 @@ class HeaderFooterTextWebKitParser(webkit_report.WebKitParser):
 
         self.pool = RegistryManager.get(cursor.dbname)
         objs = self.getObjects(cursor, uid, ids, context)
+        # in precise mode, the data of the accounts is computed and dropped
+        # by batch while they are rendered
+        parser_instance.render_by_batch = bool(report_xml.precise_mode)
         parser_instance.set_context(objs, data, ids, report_xml.report_type)
 
-        template = False
+        renderer = get_renderer(report_xml, parser_instance, context=context)
+        return renderer.render(self, cursor, uid, report_xml, parser_instance,
+                               context=context)
+
+    def _render_with_wkhtmltopdf(self, cursor, uid, report_xml,
+                                 parser_instance, context=None):
+        """Render the Mako template of a report in html and convert it in
+        pdf with wkhtmltopdf"""
+        htmls = []
+        body_mako_tpl = False
 
         if report_xml.report_file:
             path = get_module_resource(
                 *report_xml.report_file.split(os.path.sep))
             if os.path.exists(path):
-                template = file(path).read()
-        if not template and report_xml.report_webkit_data:
-            template = report_xml.report_webkit_data
-        if not template:
+                body_mako_tpl = cached_mako_template(path=path)
+        if not body_mako_tpl and report_xml.report_webkit_data:
+            body_mako_tpl = cached_mako_template(
+                text=report_xml.report_webkit_data)
+        if not body_mako_tpl:
             raise except_orm(
                 _('Error!'), _('Webkit Report template not found !'))
         header = report_xml.webkit_header.html
@@ -229,52 +403,48 @@ class HeaderFooterTextWebKitParser(webkit_report.WebKitParser):
             css = ''
 
         translate_call = partial(self.translate_call, parser_instance)
-        # default_filters=['unicode', 'entity'] can be used to set global
-        # filter
-        body_mako_tpl = mako_template(template)
         helper = WebKitHelper(cursor, uid, report_xml.id, context)
+        # the html are rendered in files, except to print them in debug mode
+        stream = not report_xml.webkit_debug
         if report_xml.precise_mode:
-            for obj in objs:
-                parser_instance.localcontext['objects'] = [obj]
-                try:
-                    html = body_mako_tpl.render(helper=helper,
-                                                css=css,
-                                                _=translate_call,
-                                                **parser_instance.localcontext)
-                    htmls.append(html)
-                except Exception:
-                    msg = exceptions.text_error_template().render()
-                    _logger.error(msg)
-                    raise except_orm(_('Webkit render'), msg)
+            objects_list = self._iter_objects_by_batch(
+                parser_instance, parser_instance.localcontext['objects'])
         else:
-            try:
-                html = body_mako_tpl.render(helper=helper,
-                                            css=css,
-                                            _=translate_call,
-                                            **parser_instance.localcontext)
-                htmls.append(html)
-            except Exception:
-                msg = exceptions.text_error_template().render()
-                _logger.error(msg)
-                raise except_orm(_('Webkit render'), msg)
-
-        # NO html footer and header because we write them as text with
-        # wkhtmltopdf
-        head = foot = False
-
-        if report_xml.webkit_debug:
-            try:
-                deb = body_mako_tpl.render(helper=helper,
-                                           css=css,
-                                           _debug=tools.ustr("\n".join(htmls)),
-                                           _=translate_call,
-                                           **parser_instance.localcontext)
-            except Exception:
-                msg = exceptions.text_error_template().render()
-                _logger.error(msg)
-                raise except_orm(_('Webkit render'), msg)
-            return (deb, 'html')
-        bin = self.get_lib(cursor, uid)
-        pdf = self.generate_pdf(bin, report_xml, head, foot, htmls,
-                                parser_instance=parser_instance)
+            parser_instance.localcontext['objects'] = \
+                parser_instance._track_progress(
+                    parser_instance.localcontext['objects'])
+            objects_list = [None]
+        start = time.time()
+        try:
+            for index, objects in enumerate(objects_list):
+                if objects is not None:
+                    parser_instance.localcontext['objects'] = objects
+                values = dict(parser_instance.localcontext, helper=helper,
+                              css=css, _=translate_call)
+                if stream:
+                    fd, html_path = tempfile.mkstemp(
+                        suffix="%d.body.html" % index)
+                    os.close(fd)
+                    htmls.append(html_path)
+                    self._render_html(body_mako_tpl, values,
+                                      html_path=html_path)
+                else:
+                    htmls.append(self._render_html(body_mako_tpl, values))
+            _logger.info('Report %s rendered in %.3fs', self.name,
+                         time.time() - start)
+
+            if report_xml.webkit_debug:
+                values = dict(parser_instance.localcontext, helper=helper,
+                              css=css, _=translate_call,
+                              _debug=tools.ustr("\n".join(htmls)))
+                return (self._render_html(body_mako_tpl, values), 'html')
+
+            # NO html footer and header because we write them as text with
+            # wkhtmltopdf
+            bin = self.get_lib(cursor, uid)
+            pdf = self.generate_pdf_from_files(
+                bin, report_xml, htmls, parser_instance=parser_instance)
+        finally:
+            if stream:
+                self._remove_files(htmls)
         return (pdf, 'pdf')
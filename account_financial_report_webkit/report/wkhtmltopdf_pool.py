@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+"""Pool of wkhtmltopdf processes kept running between the reports.
+
+The processes are started with `--read-args-from-stdin`: they read the
+arguments of a conversion per line and print `Done` when it is finished,
+so they do not load Qt and WebKit again for each report. Their messages
+are read line by line, the errors printed up to the end of a conversion
+fail it as a non-zero exit status does for a new process. A process is
+stopped when it fails, when it does not answer in time, when it prints an
+error between two conversions and after a number of conversions. When
+no process of the pool is available or when the conversion fails, the
+caller falls back on a wkhtmltopdf process started for the report.
+"""
+import atexit
+import logging
+import os
+import re
+import select
+import subprocess
+import threading
+import time
+
+from openerp import tools
+
+_logger = logging.getLogger('financial.reports.webkit')
+
+# number of wkhtmltopdf processes kept running by each server process, the
+# pool is disabled when it is 0
+POOL_SIZE = int(tools.config.get('webkit_report_pdf_pool_size', 0))
+# the processes are replaced after this number of conversions
+MAX_JOBS = int(tools.config.get('webkit_report_pdf_pool_max_jobs', 50))
+# seconds waited for a conversion before the process is killed
+TIMEOUT = float(tools.config.get('webkit_report_pdf_pool_timeout', 600))
+
+# the progress is printed on the same line, separated by carriage returns
+LINE_END = re.compile(r'\r\n?|\n')
+ERROR_PREFIXES = ('Error:', 'Exit with code')
+# wkhtmltopdf reads the lines of arguments in a buffer of 20400 bytes, a
+# longer line would be split in several conversions
+MAX_LINE_LENGTH = 20000
+
+
+class WorkerError(Exception):
+    pass
+
+
+def quote_args(args):
+    """Line of arguments read by wkhtmltopdf"""
+    quoted = []
+    for arg in args:
+        arg = tools.ustr(arg).encode('utf-8').replace('\n', ' ')
+        quoted.append('"%s"' % arg.replace('\\', '\\\\').replace('"', '\\"'))
+    return ' '.join(quoted) + '\n'
+
+
+def job_line(args):
+    """Line of arguments of a conversion sent to a process of the pool"""
+    # the conversion is confirmed by its progress, so it is not quiet
+    return quote_args([arg for arg in args if arg != '--quiet'])
+
+
+class WkhtmltopdfWorker(object):
+    """wkhtmltopdf process converting the html files of several reports"""
+
+    def __init__(self, binary):
+        self.binary = binary
+        self.jobs = 0
+        # end of the messages read without its line break yet
+        self._partial = ''
+        with open(os.devnull, 'wb') as devnull:
+            self.process = subprocess.Popen(
+                [binary, '--read-args-from-stdin'], stdin=subprocess.PIPE,
+                stdout=devnull, stderr=subprocess.PIPE, close_fds=True)
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def _read_lines(self, timeout):
+        """Complete lines printed by the process, None when it printed
+        nothing within the timeout"""
+        fd = self.process.stderr.fileno()
+        if not select.select([fd], [], [], timeout)[0]:
+            return None
+        chunk = os.read(fd, 4096)
+        if not chunk:
+            raise WorkerError('the process exited')
+        lines = LINE_END.split(self._partial + chunk)
+        self._partial = lines.pop()
+        return lines
+
+    def _drain(self):
+        """Error lines among the lines already printed by the process"""
+        errors = []
+        lines = self._read_lines(0)
+        while lines is not None:
+            errors += [line for line in lines
+                       if line.startswith(ERROR_PREFIXES)]
+            lines = self._read_lines(0)
+        return errors
+
+    def clean(self):
+        """The process is running and printed no error since its last
+        conversion"""
+        try:
+            return self.alive() and not self._drain()
+        except (WorkerError, IOError, OSError):
+            return False
+
+    def convert(self, args, timeout=TIMEOUT):
+        """Convert the html files in the pdf file, the output file being
+        the last of the arguments
+
+        :raise WorkerError: when the arguments are too long, the process
+                            exits, does not answer within the timeout or
+                            prints an error
+        """
+        line = job_line(args)
+        if len(line) > MAX_LINE_LENGTH:
+            raise WorkerError('too many arguments')
+        self.jobs += 1
+        try:
+            self.process.stdin.write(line)
+            self.process.stdin.flush()
+        except (IOError, OSError), exc:
+            raise WorkerError('cannot send the job: %s' % exc)
+        deadline = time.time() + timeout
+        errors = []
+        done = False
+        while not done:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise WorkerError('no answer after %ss' % timeout)
+            for line in self._read_lines(remaining) or []:
+                if line.strip() == 'Done':
+                    done = True
+                elif line.startswith(ERROR_PREFIXES):
+                    errors.append(line)
+        # the messages printed with the end of the conversion belong to it
+        errors += self._drain()
+        if errors:
+            raise WorkerError('\n'.join(errors))
+
+    def stop(self):
+        try:
+            self.process.stdin.close()
+            if self.alive():
+                # a conversion may be hanging, it is not waited for
+                self.process.kill()
+            self.process.wait()
+        except (IOError, OSError), exc:
+            _logger.debug('cannot stop wkhtmltopdf process %s: %s',
+                          self.process.pid, exc)
+
+
+class WkhtmltopdfPool(object):
+    """wkhtmltopdf processes of the server process, by binary"""
+
+    def __init__(self, size=POOL_SIZE, max_jobs=MAX_JOBS, timeout=TIMEOUT):
+        self.size = size
+        self.max_jobs = max_jobs
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = []
+        self._busy = 0
+
+    def _acquire(self, binary):
+        """Idle process of the binary, a new one when the pool is not
+        full, None when all the processes are busy
+
+        The idle processes which exited or printed an error after their
+        last conversion are stopped, so the error does not fail the next
+        conversion.
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                # forked server process, the processes belong to the parent
+                self._reset()
+            while self._idle:
+                worker = self._idle.pop()
+                if worker.binary == binary and worker.clean():
+                    self._busy += 1
+                    return worker
+                worker.stop()
+            if self._busy >= self.size:
+                return None
+            self._busy += 1
+        try:
+            return WkhtmltopdfWorker(binary)
+        except (IOError, OSError), exc:
+            _logger.warning('cannot start wkhtmltopdf process: %s', exc)
+            with self._lock:
+                self._busy -= 1
+            return None
+
+    def _release(self, worker, healthy):
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            self._busy -= 1
+            if healthy and worker.jobs < self.max_jobs and worker.alive():
+                self._idle.append(worker)
+                return
+        worker.stop()
+
+    def convert(self, command, args):
+        """Convert html files to pdf with a process of the pool
+
+        :param command: wkhtmltopdf and its arguments
+        :param args: html files and pdf file
+        :return: True when the pdf is written, False when the pool is
+                 disabled, full, the arguments do not fit on the line read
+                 by wkhtmltopdf or the conversion failed
+        """
+        if not self.size:
+            return False
+        if len(job_line(command[1:] + args)) > MAX_LINE_LENGTH:
+            # many html files, one per account in precise mode
+            return False
+        worker = self._acquire(command[0])
+        if worker is None:
+            return False
+        healthy = False
+        try:
+            worker.convert(command[1:] + args, timeout=self.timeout)
+            healthy = os.path.getsize(args[-1]) > 0
+        except (WorkerError, OSError), exc:
+            _logger.warning('wkhtmltopdf process %s failed, the report is '
+                            'rendered by a new process: %s',
+                            worker.process.pid, exc)
+        finally:
+            self._release(worker, healthy)
+        return healthy
+
+    def stop(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                for worker in self._idle:
+                    worker.stop()
+            self._reset()
+
+
+pdf_pool = WkhtmltopdfPool()
+atexit.register(pdf_pool.stop)
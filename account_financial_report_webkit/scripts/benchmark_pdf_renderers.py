@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
+"""Compare the pages rendered per second by the pdf backends of the
+financial reports, on the general ledger and the trial balance of a
+database where the module is installed.
+
+    python benchmark_pdf_renderers.py -c openerp-server.conf -d DATABASE \\
+        [--report general_ledger] [--precise-mode] [--repeat 3]
+
+The reports are printed for the first chart of accounts and the default
+fiscal year of the wizards, nothing is written in the database.
+"""
+import argparse
+import re
+import time
+
+import openerp
+from openerp.report.interface import report_int
+
+REPORTS = {
+    'general_ledger': ('general.ledger.webkit',
+                       'account.account_report_general_ledger_webkit'),
+    'trial_balance': ('trial.balance.webkit',
+                      'account.account_report_trial_balance_webkit'),
+}
+RENDERERS = ('wkhtmltopdf', 'native')
+
+
+def count_pages(pdf):
+    return len(re.findall(r'/Type\s*/Page[^s]', pdf))
+
+
+def report_data(env, wizard_model):
+    """Ids and datas of the report printed by the wizard"""
+    chart = env['account.account'].search([('parent_id', '=', False)],
+                                          limit=1)
+    wizard = env[wizard_model].create({'chart_account_id': chart.id})
+    action = wizard.check_report()
+    return action['datas'].get('ids') or [], action['datas']
+
+
+def benchmark(cr, uid, report_name, ids, data, renderer, repeat):
+    """Render a report `repeat` times with a backend
+
+    :return: tuple (pages, seconds) of the fastest rendering
+    """
+    report = report_int._reports['report.%s' % report_name]
+    best = None
+    pages = 0
+    for __ in range(repeat):
+        start = time.time()
+        content, report_format = report.create(
+            cr, uid, ids, data, {'webkit_pdf_renderer': renderer})
+        duration = time.time() - start
+        pages = count_pages(content) if report_format == 'pdf' else 0
+        best = duration if best is None else min(best, duration)
+    return pages, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-c', '--config', required=True)
+    parser.add_argument('-d', '--database', required=True)
+    parser.add_argument('--report', choices=sorted(REPORTS), action='append')
+    parser.add_argument('--precise-mode', action='store_true')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    openerp.tools.config.parse_config(['-c', args.config,
+                                       '-d', args.database])
+    registry = openerp.modules.registry.RegistryManager.get(args.database)
+    with openerp.api.Environment.manage():
+        cr = registry.cursor()
+        try:
+            env = openerp.api.Environment(cr, openerp.SUPERUSER_ID, {})
+            for name in args.report or sorted(REPORTS):
+                wizard_model, report_name = REPORTS[name]
+                env['ir.actions.report.xml'].search(
+                    [('report_name', '=', report_name)]).write(
+                    {'precise_mode': args.precise_mode})
+                ids, data = report_data(env, wizard_model)
+                for renderer in RENDERERS:
+                    pages, seconds = benchmark(cr, env.uid, report_name, ids,
+                                               data, renderer, args.repeat)
+                    print('%-15s %-12s %6d pages %8.2fs %8.1f pages/s' % (
+                        name, renderer, pages, seconds,
+                        pages / seconds if seconds else 0.0))
+        finally:
+            cr.rollback()
+            cr.close()
+
+
+if __name__ == '__main__':
+    main()
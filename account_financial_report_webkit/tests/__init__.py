@@ -1,5 +1,12 @@
 # -*- coding: utf-8 -*-
 from . import test_account_move_line
+from . import test_balance_snapshot
+from . import test_account_tree
+from . import test_native_pdf
+from . import test_pdf_chunks
+from . import test_period_calendar
+from . import test_result_cache
+from . import test_wkhtmltopdf_pool
 from . import test_general_leger
 from . import test_partner_ledger
 from . import test_trial_balance
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
+
+from openerp.tests import common
+
+from ..report.account_tree import AccountTree
+
+
+def _account(account_id, code, parent_id=False, consol_ids=None):
+    return {'id': account_id,
+            'code': code,
+            'parent_id': parent_id and (parent_id, code) or False,
+            'level': 0,
+            'child_consol_ids': consol_ids or []}
+
+
+class TestAccountTree(common.TransactionCase):
+
+    def setUp(self):
+        super(TestAccountTree, self).setUp()
+        self.tree = AccountTree([
+            _account(1, '0'),
+            _account(2, '2', parent_id=1),
+            _account(3, '1', parent_id=1, consol_ids=[6]),
+            _account(4, '11', parent_id=3),
+            _account(5, '10', parent_id=3),
+            _account(6, '05'),
+        ])
+
+    def test_sort(self):
+        self.assertEqual(self.tree.sort([1], [1, 2, 3, 4, 5, 6]),
+                         [1, 3, 6, 5, 4, 2])
+
+    def test_sort_subset(self):
+        self.assertEqual(self.tree.sort([1], [1, 2, 4]), [1, 2])
+
+    def test_descendants(self):
+        self.assertEqual(sorted(self.tree.descendants(3)), [3, 4, 5, 6])
+        self.assertEqual(self.tree.descendants(2), [2])
+
+    def test_rollup(self):
+        values = {2: {'init_balance': 1.0},
+                  4: {'init_balance': 2.0, 'debit': 5.0},
+                  6: {'init_balance': 4.0}}
+        totals = self.tree.rollup(values, ('init_balance', 'debit'))
+        self.assertEqual(totals[1], {'init_balance': 7.0, 'debit': 5.0})
+        self.assertEqual(totals[3], {'init_balance': 6.0, 'debit': 5.0})
+        self.assertEqual(totals[5], {'init_balance': 0.0, 'debit': 0.0})
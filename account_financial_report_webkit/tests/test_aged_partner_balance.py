@@ -2,6 +2,7 @@
 # Copyright 2009-2017 Noviat.
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
 from .test_common import TestCommon
+from ..report.aged_partner_balance import AccountAgedTrialBalanceWebkit
 
 
 class TestAgedPartnerBalance(TestCommon):
@@ -24,3 +25,23 @@ class TestAgedPartnerBalance(TestCommon):
             if callable(getattr(self, x)) and x.startswith('common_test_')]
         for test in common_tests:
             getattr(self, test)()
+
+    def _get_aged_lines(self, data, aging_mode):
+        data['form']['aging_mode'] = aging_mode
+        parser = AccountAgedTrialBalanceWebkit(
+            self.cr, self.uid, 'aged_trial_balance', {})
+        parser.set_context([], data, [])
+        return dict(
+            ((acc_id, partner_id),
+             (round(aged['balance'], 2),
+              dict((drange, round(amount, 2))
+                   for drange, amount in aged['aged_lines'].items())))
+            for acc_id, partners
+            in parser.localcontext['agged_lines_accounts'].items()
+            for partner_id, aged in partners.items())
+
+    def test_sql_aging_mode(self):
+        """ Check the sql aging mode gives the same amounts """
+        data = self.report.check_report()['datas']
+        self.assertEqual(self._get_aged_lines(data, 'python'),
+                         self._get_aged_lines(data, 'sql'))
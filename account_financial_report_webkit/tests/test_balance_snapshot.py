@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
+
+from openerp import fields, tools
+from openerp.tests import common
+
+from ..models.account_balance_snapshot import SNAPSHOT_COLUMNS, \
+    SNAPSHOT_KEY_WHERE, SNAPSHOT_SELECT, add_snapshot_sums, \
+    merge_pending_sums
+
+
+class TestBalanceSnapshot(common.TransactionCase):
+
+    def setUp(self):
+        super(TestBalanceSnapshot, self).setUp()
+        enabled = tools.config.get('webkit_report_balance_snapshot', False)
+        tools.config['webkit_report_balance_snapshot'] = True
+        self.addCleanup(tools.config.__setitem__,
+                        'webkit_report_balance_snapshot', enabled)
+        self.env['account.webkit.balance.snapshot'].rebuild()
+
+        self.journal = self.env['account.journal'].search([
+            ('type', '=', 'bank'),
+        ], limit=1)
+        self.journal.update_posted = True
+        self.account_receivable = self.env['account.account'].search([
+            ('type', '=', 'receivable'),
+        ], limit=1)
+        self.account_expense = self.env['account.account'].search([
+            ('type', '=', 'other'),
+        ], limit=1)
+
+    def assertSnapshotSums(self):
+        """The snapshot has the sums of the valid move lines"""
+        columns = ', '.join(SNAPSHOT_COLUMNS)
+        self.cr.execute(SNAPSHOT_SELECT + "GROUP BY 1, 2, 3, 4, 5, 6 "
+                        "ORDER BY 1, 2, 3, 4, 5, 6")
+        expected = [row for row in self.cr.fetchall() if any(row[6:])]
+        self.cr.execute("SELECT %s, SUM(debit), SUM(credit), "
+                        "SUM(amount_currency) "
+                        "FROM account_webkit_balance_snapshot "
+                        "GROUP BY 1, 2, 3, 4, 5, 6 "
+                        "ORDER BY 1, 2, 3, 4, 5, 6" % columns)
+        self.assertEqual(
+            [row for row in self.cr.fetchall() if any(row[6:])], expected)
+
+    def test_entries(self):
+        """ The changes of the entries are added to the snapshot """
+        move = self.env['account.move'].create({
+            'name': '/',
+            'journal_id': self.journal.id,
+            'date': fields.Date.today(),
+            'line_id': [
+                (0, 0, {'name': '/',
+                        'account_id': self.account_receivable.id,
+                        'debit': 100.1}),
+                (0, 0, {'name': '/',
+                        'account_id': self.account_expense.id,
+                        'credit': 100.1}),
+            ],
+        })
+        self.assertSnapshotSums()
+        receivable, expense = move.line_id.sorted(lambda l: l.debit)[::-1]
+        move.write({'line_id': [(1, receivable.id, {'debit': 40.3}),
+                                (1, expense.id, {'credit': 40.3})]})
+        self.assertSnapshotSums()
+        move.post()
+        self.assertSnapshotSums()
+        move.button_cancel()
+        self.assertSnapshotSums()
+        expense.unlink()
+        self.assertSnapshotSums()
+        move.unlink()
+        self.assertSnapshotSums()
+
+
+class TestBalanceSnapshotConcurrency(common.TransactionCase):
+    """ The sums are added by committed transactions, the test does not
+    rebuild the snapshot in its own transaction to not wait for it """
+
+    def setUp(self):
+        super(TestBalanceSnapshotConcurrency, self).setUp()
+        period = self.env['account.period'].find()
+        # key of unposted entries in a currency, not in the demo data
+        self.key = (period.company_id.id,
+                    self.env.ref('account.a_recv').id, None, period.id,
+                    'draft', self.env.ref('base.CHF').id)
+        self.cursors = [self.registry.cursor(), self.registry.cursor()]
+        self.addCleanup(self._close_cursors)
+        self.cursors[0].execute(
+            "SELECT 1 FROM account_webkit_balance_snapshot"
+            + SNAPSHOT_KEY_WHERE, self.key)
+        if self.cursors[0].rowcount:
+            self.skipTest('the snapshot has sums of the key')
+
+    def _close_cursors(self):
+        cr = self.cursors[0]
+        cr.rollback()
+        cr.execute("DELETE FROM account_webkit_balance_snapshot "
+                   "WHERE account_id = %s AND period_id = %s "
+                   "AND move_state = 'draft' AND currency_id = %s",
+                   (self.key[1], self.key[3], self.key[5]))
+        cr.commit()
+        for cr in self.cursors:
+            cr.close()
+
+    def _get_rows(self):
+        cr = self.cursors[0]
+        cr.execute("SELECT debit, credit, amount_currency, pending "
+                   "FROM account_webkit_balance_snapshot "
+                   "WHERE account_id = %s AND period_id = %s "
+                   "AND move_state = 'draft' AND currency_id = %s "
+                   "ORDER BY pending, id",
+                   (self.key[1], self.key[3], self.key[5]))
+        rows = cr.fetchall()
+        cr.commit()
+        return rows
+
+    def _add_concurrently(self, first_deltas, second_deltas):
+        """Add sums in two transactions, the second one starting before
+        the first one commits"""
+        for cr in self.cursors:
+            cr.execute("SELECT 1")
+        first, second = self.cursors
+        add_snapshot_sums(first, {self.key: first_deltas})
+        first.commit()
+        add_snapshot_sums(second, {self.key: second_deltas})
+        second.commit()
+
+    def test_concurrent_transactions(self):
+        """ The sums inserted or updated by a concurrent transaction are
+        kept, the amounts of the second transaction are pending """
+        self._add_concurrently((10.0, 0.0, 1.0), (5.0, 0.0, 2.0))
+        self.assertEqual(self._get_rows(), [(10.0, 0.0, 1.0, False),
+                                            (5.0, 0.0, 2.0, True)])
+        merge_pending_sums(self.cursors[0])
+        self.cursors[0].commit()
+        self.assertEqual(self._get_rows(), [(15.0, 0.0, 3.0, False)])
+
+        self._add_concurrently((1.0, 2.0, 0.0), (0.0, 4.0, -3.0))
+        self.assertEqual(self._get_rows(), [(16.0, 2.0, 3.0, False),
+                                            (0.0, 4.0, -3.0, True)])
+        merge_pending_sums(self.cursors[0])
+        self.cursors[0].commit()
+        self.assertEqual(self._get_rows(), [(16.0, 6.0, 0.0, False)])
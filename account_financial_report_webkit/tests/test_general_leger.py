@@ -1,7 +1,10 @@
 # -*- coding: utf-8 -*-
 # Copyright 2009-2017 Noviat.
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+from openerp.report.interface import report_int
+
 from .test_common import TestCommon
+from ..report.general_ledger import GeneralLedgerWebkit
 
 
 class TestGeneralLedger(TestCommon):
@@ -21,3 +24,102 @@ class TestGeneralLedger(TestCommon):
             if callable(getattr(self, x)) and x.startswith('common_test_')]
         for test in common_tests:
             getattr(self, test)()
+
+    def test_compute_by_batch(self):
+        """ Check the accounts computed by batch get the same lines """
+        data = self.report.check_report()['datas']
+        parser = GeneralLedgerWebkit(self.cr, self.uid, 'general_ledger', {})
+        parser.set_context([], data, [])
+        account_ids = [account.id for account
+                       in parser.localcontext['objects']]
+
+        batch_parser = GeneralLedgerWebkit(
+            self.cr, self.uid, 'general_ledger', {})
+        batch_parser.render_by_batch = True
+        batch_parser.set_context([], data, [])
+        self.assertEqual(batch_parser.localcontext['ledger_lines'], {})
+        ledger_lines = {}
+        init_balance = {}
+        half = len(account_ids) // 2
+        for batch in (account_ids[:half], account_ids[half:]):
+            values = batch_parser._compute_batch(batch)
+            ledger_lines.update(values['ledger_lines'])
+            init_balance.update(values['init_balance'])
+        self.assertEqual(ledger_lines, parser.localcontext['ledger_lines'])
+        self.assertEqual(init_balance, parser.localcontext['init_balance'])
+
+    def _get_lines_per_account(self, uid, main_filter, start, stop):
+        """Ids of the move lines per account, fetched in one query and
+        searched account by account"""
+        parser = GeneralLedgerWebkit(self.cr, uid, 'general_ledger', {})
+        account_ids = self.env['account.account'].search([
+            ('type', 'not in', ('view', 'consolidation')),
+        ]).ids
+        lines = dict(
+            (account_id, sorted(line['id'] for line in account_lines))
+            for account_id, account_lines
+            in parser._iter_accounts_move_line_datas(
+                account_ids, main_filter, start, stop, 'all'))
+        searched_lines = {}
+        for account_id in account_ids:
+            line_ids = parser.get_move_lines_ids(
+                account_id, main_filter, start, stop, 'all')
+            if line_ids:
+                searched_lines[account_id] = sorted(line_ids)
+        return lines, searched_lines
+
+    def test_accounts_move_lines(self):
+        """ Check the lines of the accounts fetched in one query are the
+        ones of the search, with its record rules """
+        period = self.env['account.period'].find()
+        fiscalyear = period.fiscalyear_id
+        accountant = self.env['res.users'].create({
+            'name': 'Accountant',
+            'login': 'webkit_accountant',
+            'groups_id': [(6, 0, [
+                self.env.ref('account.group_account_manager').id])],
+        })
+        for uid in (self.uid, accountant.id):
+            lines, searched_lines = self._get_lines_per_account(
+                uid, 'filter_period', fiscalyear.period_ids[0], period)
+            self.assertTrue(lines)
+            self.assertEqual(lines, searched_lines)
+            lines, searched_lines = self._get_lines_per_account(
+                uid, 'filter_date', fiscalyear.date_start, period.date_stop)
+            self.assertEqual(lines, searched_lines)
+
+    def _count_ids_tables(self):
+        self.cr.execute("SELECT count(*) FROM pg_class "
+                        "WHERE relnamespace = pg_my_temp_schema() "
+                        "AND relname LIKE 'webkit_report_ids_%'")
+        return self.cr.fetchone()[0]
+
+    def test_move_line_datas_stopped(self):
+        """ The table of the ids is dropped when the lines are not all
+        read """
+        line_ids = self.env['account.move.line'].search([], limit=10).ids
+        parser = GeneralLedgerWebkit(self.cr, self.uid, 'general_ledger', {})
+        tables = self._count_ids_tables()
+        lines = parser._iter_move_line_datas(line_ids, slice_size=3)
+        next(lines)
+        lines.close()
+        self.assertEqual(self._count_ids_tables(), tables)
+        lines = parser._iter_move_line_datas(line_ids, slice_size=3)
+        self.assertEqual(sorted(line['id'] for line in lines),
+                         sorted(line_ids))
+        self.assertEqual(self._count_ids_tables(), tables)
+
+    def test_native_pdf(self):
+        """ Check the general ledger is written to pdf by the native backend,
+        by batch of accounts in precise mode """
+        data = self.report.check_report()['datas']
+        report = report_int._reports['report.%s' % self.report_name]
+        for precise_mode in (False, True):
+            self.env.ref('account_financial_report_webkit.'
+                         'account_report_general_ledger_webkit'
+                         ).precise_mode = precise_mode
+            content, report_format = report.create(
+                self.cr, self.uid, data.get('ids') or [], data,
+                {'webkit_pdf_renderer': 'native'})
+            self.assertEqual(report_format, 'pdf')
+            self.assertTrue(content.startswith('%PDF'))
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
+
+from openerp.tests import common
+
+from ..report.native_pdf import fit_text, header_footer_args
+
+
+class TestNativePdf(common.TransactionCase):
+
+    def test_fit_text(self):
+        self.assertEqual(fit_text('100.00', 100), u'100.00')
+        text = fit_text('A long label of a move line', 40)
+        self.assertTrue(text.endswith(u'...'))
+        self.assertTrue(len(text) < 20)
+
+    def test_header_footer_args(self):
+        args = header_footer_args([('--header-left', 'GENERAL LEDGER'),
+                                   ('--footer-line',)])
+        self.assertEqual(args, {'--header-left': 'GENERAL LEDGER',
+                                '--footer-line': True})
@@ -3,6 +3,7 @@
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
 from datetime import datetime
 from .test_common import TestCommon
+from ..report.open_invoices import PartnersOpenInvoicesWebkit
 
 
 class TestOpenInvoices(TestCommon):
@@ -22,3 +23,94 @@ class TestOpenInvoices(TestCommon):
             if callable(getattr(self, x)) and x.startswith('common_test_')]
         for test in common_tests:
             getattr(self, test)()
+
+    def _create_move_line(self, date, partner, debit=0.0, credit=0.0):
+        """Receivable line of the partner, with its counterpart"""
+        move = self.env['account.move'].create({
+            'name': '/',
+            'journal_id': self.journal.id,
+            'date': date,
+            'period_id': self.env['account.period'].find(date).id,
+            'line_id': [
+                (0, 0, {'name': '/',
+                        'account_id': self.account_receivable.id,
+                        'partner_id': partner.id,
+                        'debit': debit,
+                        'credit': credit}),
+                (0, 0, {'name': '/',
+                        'account_id': self.account_expense.id,
+                        'debit': credit,
+                        'credit': debit}),
+            ],
+        })
+        return move.line_id.filtered(
+            lambda l: l.account_id == self.account_receivable)
+
+    def test_clearance_lines(self):
+        """ The invoices reconciled after the stop date are open, with the
+        lines of their reconciliation dated before the until date """
+        year = datetime.now().year
+        self.journal = self.env['account.journal'].search([
+            ('type', '=', 'bank'),
+        ], limit=1)
+        self.account_receivable = self.env.ref('account.a_recv')
+        self.account_expense = self.env['account.account'].search([
+            ('type', '=', 'other'),
+        ], limit=1)
+        # new partners, without the lines of the demo data
+        partner = self.env['res.partner'].create({'name': 'Customer'})
+        other_partner = self.env['res.partner'].create({'name': 'Payer'})
+
+        previous_invoice = self._create_move_line(
+            '%s-01-15' % year, partner, debit=100.0)
+        invoice = self._create_move_line(
+            '%s-02-15' % year, partner, debit=50.0)
+        other_invoice = self._create_move_line(
+            '%s-02-20' % year, other_partner, debit=30.0)
+        # paid by the other partner after the stop date
+        payment = self._create_move_line(
+            '%s-03-10' % year, other_partner, credit=150.0)
+        self.env['account.move.reconcile'].create({
+            'name': 'Test clearance',
+            'type': 'manual',
+            'line_id': [(4, line.id) for line in
+                        previous_invoice | invoice | payment],
+        })
+
+        period = self.env['account.period'].find('%s-02-15' % year)
+        parser = PartnersOpenInvoicesWebkit(self.cr, self.uid,
+                                            'open_invoices', {})
+        res = parser._compute_open_transactions_lines(
+            [self.account_receivable.id], 'filter_period', 'all', period,
+            period, date_until='%s-03-31' % year,
+            partner_filter=[partner.id, other_partner.id])
+
+        groups = {}
+        for account_id, lines_per_partner in res.iteritems():
+            for partner_id, lines in lines_per_partner.iteritems():
+                groups[(account_id, partner_id)] = sorted(
+                    (line['id'],
+                     bool(line.get('is_from_previous_periods')),
+                     bool(line.get('is_clearance_line')))
+                    for line in lines)
+        account_id = self.account_receivable.id
+        self.assertEqual(groups, {
+            (account_id, partner.id): sorted([
+                (previous_invoice.id, True, False),
+                (invoice.id, False, False),
+                (payment.id, False, True),
+            ]),
+            (account_id, other_partner.id): [
+                (other_invoice.id, False, False),
+            ],
+        })
+
+        # the payment is not displayed when it is dated after the until
+        # date
+        res = parser._compute_open_transactions_lines(
+            [self.account_receivable.id], 'filter_period', 'all', period,
+            period, date_until='%s-03-05' % year,
+            partner_filter=[partner.id, other_partner.id])
+        self.assertEqual(
+            sorted(line['id'] for line in res[account_id][partner.id]),
+            sorted([previous_invoice.id, invoice.id]))
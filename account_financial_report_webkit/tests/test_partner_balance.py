@@ -1,7 +1,13 @@
 # -*- coding: utf-8 -*-
 # Copyright 2009-2017 Noviat.
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+from collections import defaultdict
+
+from openerp import tools
+from openerp.tools import float_is_zero
+
 from .test_common import TestCommon
+from ..report.partner_balance import PartnerBalanceWebkit
 
 
 class TestPartnerBalance(TestCommon):
@@ -21,3 +27,106 @@ class TestPartnerBalance(TestCommon):
             if callable(getattr(self, x)) and x.startswith('common_test_')]
         for test in common_tests:
             getattr(self, test)()
+
+    def _compute_partners_amounts(self, snapshot, **filters):
+        """Amounts of the partners by account printed with the filters"""
+        enabled = tools.config.get('webkit_report_balance_snapshot', False)
+        tools.config['webkit_report_balance_snapshot'] = snapshot
+        try:
+            self.report.write(filters)
+            data = self.report.check_report()['datas']
+            parser = PartnerBalanceWebkit(self.cr, self.uid,
+                                          'partner_balance', {})
+            parser.set_context([], data, [])
+        finally:
+            tools.config['webkit_report_balance_snapshot'] = enabled
+        return parser.localcontext['partners_amounts_accounts']
+
+    def test_balance_snapshot(self):
+        """ Check the partner balance read from the balance snapshot, with
+        the initial balances of the previous periods """
+        self.env['account.webkit.balance.snapshot'].rebuild()
+        period = self.env['account.period'].find()
+        filters = {'filter': 'filter_period',
+                   'fiscalyear_id': period.fiscalyear_id.id,
+                   'period_from': period.id,
+                   'period_to': period.id}
+        for display_partner in ('all', 'non-zero_balance'):
+            filters['display_partner'] = display_partner
+            self.assertEqual(
+                self._compute_partners_amounts(True, **filters),
+                self._compute_partners_amounts(False, **filters))
+
+    def _get_partners_details_by_account(self, parser, account_ids, start,
+                                         stop, initial_balance_mode,
+                                         display_partner):
+        """Amounts of the partners computed account by account, as before
+        the grouped query of `_get_partners_balances`"""
+        sql_conditions, params = parser._get_query_params_from_periods(
+            start, stop)
+        force_period_ids = initial_balance_mode == 'opening_balance' and \
+            parser.get_included_opening_period(start)
+        res = {}
+        for account_id in account_ids:
+            init_balances = {}
+            if initial_balance_mode:
+                init_balances = parser._compute_partners_initial_balances(
+                    account_id, start, force_period_ids=force_period_ids
+                ).get(account_id, {})
+            self.cr.execute(
+                "SELECT account_move_line.partner_id, "
+                "       sum(account_move_line.debit) AS debit, "
+                "       sum(account_move_line.credit) AS credit "
+                "FROM account_move_line "
+                "WHERE account_move_line.account_id = %(account_id)s "
+                "AND account_move_line.state = 'valid' " + sql_conditions +
+                " GROUP BY account_move_line.partner_id",
+                dict(params, account_id=account_id))
+            details = defaultdict(dict)
+            for row in self.cr.dictfetchall():
+                details[row['partner_id']] = row
+            for partner_id, values in init_balances.iteritems():
+                if values.get('init_balance'):
+                    details[partner_id]['init_balance'] = \
+                        values['init_balance']
+            for values in details.itervalues():
+                values['balance'] = values.get('init_balance', 0.0) + \
+                    values.get('debit', 0.0) - values.get('credit', 0.0)
+            if display_partner == 'non-zero_balance':
+                details = dict(
+                    (partner_id, values)
+                    for partner_id, values in details.iteritems()
+                    if not float_is_zero(values['balance'],
+                                         precision_digits=5))
+            res[account_id] = dict(details)
+        return res
+
+    def test_partners_balances(self):
+        """ Check the amounts of the partners of all the accounts computed
+        in one query are the amounts computed account by account """
+        parser = PartnerBalanceWebkit(self.cr, self.uid, 'partner_balance',
+                                      {})
+        account_ids = parser.get_all_accounts(
+            [self.env.ref('account.chart0').id],
+            only_type=('payable', 'receivable'))
+        period = self.env['account.period'].find()
+        fiscalyear = period.fiscalyear_id
+        filters = [
+            ('filter_no', parser.get_first_fiscalyear_period(fiscalyear),
+             parser.get_last_fiscalyear_period(fiscalyear)),
+            ('filter_period', period, period),
+        ]
+        for main_filter, start, stop in filters:
+            initial_balance_mode = parser._get_initial_balance_mode(start)
+            for display_partner in ('all', 'non-zero_balance'):
+                details = parser._get_account_partners_details(
+                    dict.fromkeys(account_ids), main_filter, 'all', start,
+                    stop, initial_balance_mode,
+                    display_partner=display_partner)
+                self.assertEqual(
+                    dict((account_id, dict(partners))
+                         for account_id, partners in details.iteritems()),
+                    self._get_partners_details_by_account(
+                        parser, account_ids, start, stop,
+                        initial_balance_mode, display_partner),
+                    '%s, %s' % (main_filter, display_partner))
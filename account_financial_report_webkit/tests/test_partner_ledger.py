@@ -2,6 +2,7 @@
 # Copyright 2009-2017 Noviat.
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
 from .test_common import TestCommon
+from ..report.partners_ledger import PartnersLedgerWebkit
 
 
 class TestPartnerLedger(TestCommon):
@@ -21,3 +22,24 @@ class TestPartnerLedger(TestCommon):
             if callable(getattr(self, x)) and x.startswith('common_test_')]
         for test in common_tests:
             getattr(self, test)()
+
+    def test_partners_directory(self):
+        """ The partners missing in the directory are merged in the order
+        of the known partners """
+        partners = self.env['res.partner']
+        for name, ref in (('Webkit Alpha', False), ('Webkit Beta', 'B'),
+                          ('webkit beta', False), ('Webkit Gamma', False)):
+            partners |= partners.create({'name': name, 'ref': ref})
+        alpha, beta, beta_no_ref, gamma = partners.ids
+        parser = PartnersLedgerWebkit(self.cr, self.uid, 'partners_ledger',
+                                      {})
+        parser._get_partners_directory([gamma, None, alpha])
+        directory = parser._get_partners_directory([beta_no_ref, beta])
+        self.assertEqual(
+            sorted(partners.ids, key=lambda p_id: directory[p_id][0]),
+            [alpha, beta, beta_no_ref, gamma])
+        self.assertEqual(directory[beta][1],
+                         ('Webkit Beta (B)', beta, 'B', 'Webkit Beta'))
+        self.assertEqual(
+            [row[1] for row in parser._order_partners([gamma, beta, None])],
+            [beta, gamma, None])
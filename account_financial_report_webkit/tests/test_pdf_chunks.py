@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
+
+import os
+import tempfile
+from cStringIO import StringIO
+
+from openerp.exceptions import except_orm
+from openerp.report.interface import report_int
+from openerp.tests import common
+
+from ..report.pdf_chunks import PdfFileReader, count_pages, \
+    has_page_numbers, number_pages, split_chunks, split_page_numbers
+
+
+class TestPdfChunks(common.TransactionCase):
+
+    def test_split_chunks(self):
+        self.assertEqual(split_chunks('abcd', [10, 10, 10, 10], 2),
+                         [['a', 'b'], ['c', 'd']])
+        self.assertEqual(split_chunks('abcd', [30, 1, 1, 1], 2),
+                         [['a'], ['b', 'c', 'd']])
+        self.assertEqual(split_chunks('ab', [1, 1], 4), [['a'], ['b']])
+
+    def test_number_pages(self):
+        command = ['wkhtmltopdf', '--quiet',
+                   '--footer-right', 'Page [page] of [topage]']
+        self.assertTrue(has_page_numbers(command))
+        self.assertFalse(has_page_numbers(command[:2]))
+        self.assertEqual(number_pages(command, 12, 30),
+                         ['wkhtmltopdf', '--page-offset', '12', '--quiet',
+                          '--footer-right', 'Page [page] of 30'])
+
+    def test_split_page_numbers(self):
+        command = ['wkhtmltopdf', '--footer-left', 'Today',
+                   '--footer-right', 'Page [page] of [topage]',
+                   '--footer-line']
+        self.assertEqual(split_page_numbers(command),
+                         (['wkhtmltopdf', '--footer-left', 'Today',
+                           '--footer-line'],
+                          [('--footer-right', 'Page [page] of [topage]')]))
+
+    def test_generate_pdf_in_chunks(self):
+        """ Render html files in 2 chunks numbered as one document """
+        if not PdfFileReader:
+            self.skipTest('pyPdf is not installed')
+        report = report_int._reports[
+            'report.account.account_report_general_ledger_webkit']
+        try:
+            binary = report.get_lib(self.cr, self.uid)
+        except except_orm:
+            self.skipTest('wkhtmltopdf is not installed')
+        html_paths = []
+        try:
+            for index in range(3):
+                with tempfile.NamedTemporaryFile(suffix='.html',
+                                                 delete=False) as html_file:
+                    html_paths.append(html_file.name)
+                    html_file.write('<html><body>Account %s</body></html>'
+                                    % index)
+            command = [binary, '--quiet',
+                       '--footer-right', 'Page [page] of [topage]']
+            pdf = report._generate_pdf_in_chunks(command, html_paths, 2)
+        finally:
+            for path in html_paths:
+                os.unlink(path)
+        self.assertEqual(count_pages(pdf), 3)
+        reader = PdfFileReader(StringIO(pdf))
+        self.assertIn('Page 3 of 3', reader.getPage(2).extractText())
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
+
+from openerp.tests import common
+
+from ..report.period_calendar import PeriodCalendar
+
+
+def _period(period_id, date_start, date_stop, special=False,
+            fiscalyear_id=1):
+    return {'id': period_id,
+            'date_start': date_start,
+            'date_stop': date_stop,
+            'special': special,
+            'fiscalyear_id': fiscalyear_id,
+            'company_id': 1}
+
+
+class TestPeriodCalendar(common.TransactionCase):
+
+    def setUp(self):
+        super(TestPeriodCalendar, self).setUp()
+        self.calendar = PeriodCalendar([
+            _period(3, '2016-02-01', '2016-02-29'),
+            _period(2, '2016-01-01', '2016-01-31'),
+            _period(1, '2016-01-01', '2016-01-01', special=True),
+            _period(5, '2017-01-01', '2017-01-31', fiscalyear_id=2),
+            _period(4, '2017-01-01', '2017-01-01', special=True,
+                    fiscalyear_id=2),
+        ])
+
+    def test_opening_periods(self):
+        self.assertEqual(self.calendar.opening_period_ids(), [1, 4])
+        self.assertEqual(self.calendar.exclude_opening([1, 2, 4, 5]),
+                         [2, 5])
+        self.assertEqual(self.calendar.included_opening_period_ids(
+            '2017-01-01', '2017-01-31', 1), [4])
+        self.assertEqual(self.calendar.included_opening_period_ids(
+            '2016-02-01', '2016-02-29', 1), [])
+
+    def test_previous_periods(self):
+        self.assertEqual(
+            self.calendar.previous_period_ids('2017-01-31'), [2, 3, 5])
+        self.assertEqual(
+            self.calendar.previous_period_ids(
+                '2017-01-31', include_opening=True, fiscalyear_id=2), [4, 5])
+        self.assertEqual(
+            [period['id'] for period
+             in self.calendar.previous_opening_periods('2017-02-01')],
+            [4, 1])
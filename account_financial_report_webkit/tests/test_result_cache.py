@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
+
+from openerp.tests import common
+
+from ..models.ir_actions_report_xml import LEDGER_WATERMARK_QUERY
+from ..report.result_cache import ResultCache, cache_key, result_cache
+
+
+class TestResultCache(common.TransactionCase):
+
+    def test_lru_eviction(self):
+        cache = ResultCache(10)
+        cache.set('a', ('aaaa', 'pdf'))
+        cache.set('b', ('bbbb', 'pdf'))
+        self.assertEqual(cache.get('a'), ('aaaa', 'pdf'))
+        # b is the least recently used
+        cache.set('c', ('cccc', 'pdf'))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), ('aaaa', 'pdf'))
+        self.assertEqual(cache.size, 8)
+        # too large to be cached
+        cache.set('d', ('d' * 11, 'pdf'))
+        self.assertIsNone(cache.get('d'))
+
+    def test_key_normalization(self):
+        data = {'form': {'id': 1, 'fiscalyear_id': (3, '2017'),
+                         'account_ids': [5, 4], 'target_move': 'posted'}}
+        same = {'form': {'id': 2, 'fiscalyear_id': 3,
+                         'account_ids': [4, 5], 'target_move': 'posted'}}
+        other = {'form': {'id': 1, 'fiscalyear_id': 3,
+                          'account_ids': [4, 5], 'target_move': 'all'}}
+        key = cache_key('report', [1], data, 'watermark')
+        self.assertEqual(key, cache_key('report', [1], same, 'watermark'))
+        self.assertNotEqual(key, cache_key('report', [1], other, 'watermark'))
+        self.assertNotEqual(key, cache_key('report', [1], data, 'changed'))
+
+    def _get_watermark(self):
+        self.cr.execute(LEDGER_WATERMARK_QUERY,
+                        ('account.account_report_general_ledger_webkit',))
+        return self.cr.fetchone()
+
+    def test_ledger_watermark(self):
+        line = self.env['account.move.line'].search([], limit=1)
+        if not line:
+            self.skipTest('No move line to change')
+        max_size = result_cache.max_size
+        result_cache.max_size = 1024
+        try:
+            before = self._get_watermark()
+            line.write({'name': 'Changed for the report cache'})
+            after = self._get_watermark()
+            self.assertNotEqual(before, after)
+            # a transaction changes the version of the ledger once
+            self.env['account.webkit.ledger.change'].record()
+            self.assertEqual(after, self._get_watermark())
+        finally:
+            result_cache.max_size = max_size
@@ -1,7 +1,12 @@
 # -*- coding: utf-8 -*-
 # Copyright 2009-2017 Noviat.
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+from openerp.report.interface import report_int
+
+from openerp import fields
+
 from .test_common import TestCommon
+from ..report.trial_balance import TrialBalanceWebkit
 
 
 class TestTrialBalance(TestCommon):
@@ -21,3 +26,113 @@ class TestTrialBalance(TestCommon):
             if callable(getattr(self, x)) and x.startswith('common_test_')]
         for test in common_tests:
             getattr(self, test)()
+
+    def test_background_job(self):
+        """ Check the report printed in background is attached to its job """
+        self.env.ref('account_financial_report_webkit.'
+                     'account_report_trial_balance_webkit').webkit_debug = True
+        action = self.report.with_context(
+            webkit_report_background=True).check_report()
+        self.assertEqual(action['res_model'], 'account.webkit.report.job')
+        job = self.env['account.webkit.report.job'].browse(action['res_id'])
+        self.assertEqual(job.state, 'pending')
+        self.assertEqual(job.report_name, self.report_name)
+
+        self.env['account.webkit.report.job'].run_pending()
+        self.assertEqual(job.state, 'done', job.error)
+        self.assertEqual(job.progress, 100.0)
+        self.assertTrue(job.attachment_id.datas)
+
+    def test_interrupted_job(self):
+        """ Check a job interrupted while running can be retried """
+        job_obj = self.env['account.webkit.report.job']
+        job = job_obj.browse(job_obj.enqueue(self.report_name, {}))
+        job.write({'state': 'running'})
+        job.button_retry()
+        self.assertEqual(job.state, 'running')
+        self.cr.execute("UPDATE account_webkit_report_job "
+                        "SET write_date = write_date - interval '1 day' "
+                        "WHERE id = %s", (job.id,))
+        job.invalidate_cache()
+        self.assertTrue(job._is_stale())
+        job.button_retry()
+        self.assertEqual(job.state, 'pending')
+
+        job.write({'state': 'running'})
+        self.cr.execute("UPDATE account_webkit_report_job "
+                        "SET write_date = write_date - interval '1 day' "
+                        "WHERE id = %s", (job.id,))
+        self.assertEqual(job_obj._fail_stale_jobs(), [job.id])
+        self.assertEqual(job.state, 'failed')
+        self.assertTrue(job.error)
+
+    def test_claim_pending_jobs(self):
+        """ Check the pending jobs are claimed once, in order """
+        job_obj = self.env['account.webkit.report.job']
+        self.cr.execute("UPDATE account_webkit_report_job "
+                        "SET state = 'done' WHERE state = 'pending'")
+        job_ids = [job_obj.enqueue(self.report_name, {}) for i in range(2)]
+        self.assertEqual(job_obj._claim_pending(), job_ids[0])
+        self.assertEqual(job_obj._claim_pending(), job_ids[1])
+        self.assertIsNone(job_obj._claim_pending())
+        job_obj.browse(job_ids).invalidate_cache()
+        self.assertEqual(job_obj.browse(job_ids).mapped('state'),
+                         ['running', 'running'])
+
+    def test_native_pdf(self):
+        """ Check the trial balance is written to pdf by the native backend """
+        data = self.report.check_report()['datas']
+        report = report_int._reports['report.%s' % self.report_name]
+        content, report_format = report.create(
+            self.cr, self.uid, data.get('ids') or [], data,
+            {'webkit_pdf_renderer': 'native'})
+        self.assertEqual(report_format, 'pdf')
+        self.assertTrue(content.startswith('%PDF'))
+
+    def _get_column(self, parser, main_filter, fiscalyear, start_period=None,
+                    stop_period=None, start_date=None, stop_date=None):
+        start_period, stop_period, start, stop = \
+            parser._get_start_stop_for_filter(
+                main_filter, fiscalyear, start_date, stop_date, start_period,
+                stop_period)
+        initial_balance_mode = \
+            parser.is_initial_balance_enabled(main_filter) and \
+            parser._get_initial_balance_mode(start) or False
+        return {'fiscalyear': fiscalyear,
+                'main_filter': main_filter,
+                'start': start,
+                'stop': stop,
+                'initial_balance_mode': initial_balance_mode}
+
+    def test_accounts_details_by_columns(self):
+        """ Check the amounts of the accounts computed by one grouped query
+        are the amounts read with the orm, with and without comparisons """
+        parser = TrialBalanceWebkit(self.cr, self.uid, 'trial_balance', {})
+        account_ids = parser.get_all_accounts(
+            [self.env.ref('account.chart0').id])
+        period = self.env['account.period'].find()
+        fiscalyear = period.fiscalyear_id
+        columns = [
+            self._get_column(parser, 'filter_no', fiscalyear),
+            self._get_column(parser, 'filter_period', fiscalyear,
+                             start_period=period, stop_period=period),
+            self._get_column(parser, 'filter_date', fiscalyear,
+                             start_date=fiscalyear.date_start,
+                             stop_date=fields.Date.today()),
+        ]
+        for target_move in ('all', 'posted'):
+            for columns_by_report in ([columns[0]], columns):
+                details_by_columns = parser._get_accounts_details_by_columns(
+                    account_ids, target_move, columns_by_report)
+                for column, details in zip(columns_by_report,
+                                           details_by_columns):
+                    expected = parser._read_account_details(
+                        account_ids, target_move, column)
+                    for account_id in account_ids:
+                        for key in ('debit', 'credit', 'balance',
+                                    'init_balance'):
+                            self.assertAlmostEqual(
+                                details[account_id].get(key, 0.0),
+                                expected[account_id].get(key, 0.0),
+                                msg='%s of account %s, %s' % (
+                                    key, account_id, column['main_filter']))
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
+
+import os
+import sys
+import tempfile
+import time
+
+from openerp.report.interface import report_int
+from openerp.tests import common
+
+from ..report import webkit_parser_header_fix
+from ..report.wkhtmltopdf_pool import WkhtmltopdfPool, quote_args
+
+# wkhtmltopdf writing its pid in the pdf: in the pool, the conversions with
+# "hang" never end, the ones with "crash" stop the process, the ones with
+# "fail" print an error with their end and the ones with "late" print an
+# error after their end
+FAKE_WKHTMLTOPDF = """
+import os
+import shlex
+import sys
+import time
+
+
+def convert(args):
+    with open(args[-1], 'w') as pdf:
+        pdf.write('%PDF ' + str(os.getpid()))
+
+
+if sys.argv[1:] != ['--read-args-from-stdin']:
+    convert(sys.argv[1:])
+    sys.exit(0)
+sys.stderr.write('Loading pages (1/6)\\n')
+sys.stderr.flush()
+for line in iter(sys.stdin.readline, ''):
+    args = shlex.split(line)
+    if 'hang' in args:
+        continue
+    if 'crash' in args:
+        sys.exit(1)
+    convert(args)
+    done = '[====>   ] 50%\\r[========] 100%\\rDone\\n'
+    if 'fail' in args:
+        done += 'Exit with code 1 due to network error\\n'
+    sys.stderr.write(done)
+    sys.stderr.flush()
+    if 'late' in args:
+        time.sleep(0.2)
+        sys.stderr.write('Error: late error\\n')
+        sys.stderr.flush()
+"""
+
+
+class TestWkhtmltopdfPool(common.TransactionCase):
+
+    def setUp(self):
+        super(TestWkhtmltopdfPool, self).setUp()
+        fd, self.binary = tempfile.mkstemp(prefix='wkhtmltopdf.')
+        os.write(fd, '#!%s\n%s' % (sys.executable, FAKE_WKHTMLTOPDF))
+        os.close(fd)
+        os.chmod(self.binary, 0o755)
+        self.paths = [self.binary]
+        self.pools = []
+
+    def tearDown(self):
+        for pool in self.pools:
+            pool.stop()
+        for path in self.paths:
+            if os.path.exists(path):
+                os.unlink(path)
+        super(TestWkhtmltopdfPool, self).tearDown()
+
+    def _get_pool(self, **kwargs):
+        pool = WkhtmltopdfPool(**kwargs)
+        self.pools.append(pool)
+        return pool
+
+    def _convert(self, pool, *options):
+        """Pid of the process of the pool which wrote the pdf, None when
+        the conversion failed"""
+        fd, path = tempfile.mkstemp(suffix='.pdf')
+        os.close(fd)
+        self.paths.append(path)
+        if not pool.convert([self.binary, '--quiet'] + list(options),
+                            ['a.html', path]):
+            return None
+        with open(path) as pdf:
+            return int(pdf.read().split()[1])
+
+    def assertStopped(self, pid):
+        self.assertRaises(OSError, os.kill, pid, 0)
+
+    def test_quote_args(self):
+        self.assertEqual(
+            quote_args(['--header-left', u'Grand "livre" \\ é', 'a.html']),
+            '"--header-left" "Grand \\"livre\\" \\\\ \xc3\xa9" '
+            '"a.html"\n')
+
+    def test_disabled_pool(self):
+        pool = WkhtmltopdfPool(size=0)
+        self.assertFalse(pool.convert(['wkhtmltopdf'], ['a.html', 'a.pdf']))
+
+    def test_reuse(self):
+        """ The process converts the next reports """
+        pool = self._get_pool(size=1, max_jobs=10)
+        pid = self._convert(pool)
+        self.assertTrue(pid)
+        self.assertEqual(self._convert(pool), pid)
+        self.assertEqual(self._convert(pool, '--landscape'), pid)
+
+    def test_max_jobs(self):
+        """ The process is replaced after max_jobs conversions """
+        pool = self._get_pool(size=1, max_jobs=2)
+        pid = self._convert(pool)
+        self.assertEqual(self._convert(pool), pid)
+        new_pid = self._convert(pool)
+        self.assertTrue(new_pid)
+        self.assertNotEqual(new_pid, pid)
+        self.assertStopped(pid)
+
+    def test_timeout(self):
+        """ The process not answering in time is killed """
+        pool = self._get_pool(size=1, max_jobs=10, timeout=0.5)
+        pid = self._convert(pool)
+        self.assertIsNone(self._convert(pool, 'hang'))
+        self.assertStopped(pid)
+        self.assertEqual(pool._idle, [])
+        self.assertEqual(pool._busy, 0)
+        new_pid = self._convert(pool)
+        self.assertTrue(new_pid)
+        self.assertNotEqual(new_pid, pid)
+
+    def test_errors(self):
+        """ The errors fail their conversion, even when the pdf is written,
+        and not the next one """
+        pool = self._get_pool(size=1, max_jobs=10)
+        pid = self._convert(pool)
+        self.assertIsNone(self._convert(pool, 'crash'))
+        self.assertStopped(pid)
+        pid = self._convert(pool)
+        self.assertIsNone(self._convert(pool, 'fail'))
+        self.assertStopped(pid)
+        pid = self._convert(pool, 'late')
+        self.assertTrue(pid)
+        time.sleep(0.5)
+        new_pid = self._convert(pool)
+        self.assertTrue(new_pid)
+        self.assertNotEqual(new_pid, pid)
+        self.assertStopped(pid)
+
+    def test_long_arguments(self):
+        """ The conversions with more arguments than the line read by
+        wkhtmltopdf are left to a new process """
+        pool = self._get_pool(size=1, max_jobs=10)
+        html_paths = ['/tmp/webkit.tmp.%06d.html' % index
+                      for index in range(1000)]
+        self.assertIsNone(self._convert(pool, *html_paths))
+        self.assertEqual(pool._idle, [])
+        self.assertEqual(pool._busy, 0)
+        self.assertTrue(self._convert(pool, *html_paths[:10]))
+
+    def test_full_pool(self):
+        pool = self._get_pool(size=1, max_jobs=10)
+        worker = pool._acquire(self.binary)
+        self.assertIsNone(self._convert(pool))
+        pool._release(worker, True)
+        self.assertEqual(self._convert(pool), worker.process.pid)
+
+    def test_fallback(self):
+        """ The report is rendered by a new process when the process of
+        the pool fails """
+        report = report_int._reports[
+            'report.account.account_report_general_ledger_webkit']
+        pool = self._get_pool(size=1, max_jobs=10)
+        pdf_pool = webkit_parser_header_fix.pdf_pool
+        webkit_parser_header_fix.pdf_pool = pool
+        try:
+            pdf = report._call_wkhtmltopdf([self.binary, 'crash'],
+                                           ['a.html'])
+        finally:
+            webkit_parser_header_fix.pdf_pool = pdf_pool
+        self.assertTrue(pdf.startswith('%PDF'))
+        self.assertEqual(pool._idle, [])
@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+from . import common_report
 from . import balance_common
 from . import general_ledger_wizard
 from . import partners_ledger_wizard
@@ -32,7 +32,7 @@ import time
 
 from lxml import etree
 from datetime import datetime
-from openerp import fields, models
+from openerp import fields, models, tools
 from openerp.tools.translate import _
 # pylint: disable=deprecated-module
 from openerp.osv.orm import setup_modifiers
@@ -59,7 +59,8 @@ class AccountBalanceCommonWizard(models.TransientModel):
 
     # an update module should be done if changed
     # in order to create fields in db
-    COMPARISON_LEVEL = 3
+    COMPARISON_LEVEL = int(
+        tools.config.get('webkit_report_comparison_level', 3))
 
     COMPARE_SELECTION = [('filter_no', 'No Comparison'),
                          ('filter_year', 'Fiscal Year'),
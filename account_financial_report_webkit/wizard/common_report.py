@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
+
+from openerp import models
+
+
+class AccountCommonReport(models.TransientModel):
+
+    """Print the reports in background when the wizard is called with the
+    `webkit_report_background` key in the context"""
+
+    _inherit = "account.common.report"
+
+    # pylint: disable=old-api7-method-defined
+    def check_report(self, cr, uid, ids, context=None):
+        action = super(AccountCommonReport, self).check_report(
+            cr, uid, ids, context=context)
+        if not (context or {}).get('webkit_report_background') or \
+                action.get('type') != 'ir.actions.report.xml':
+            return action
+        job_id = self.pool['account.webkit.report.job'].enqueue(
+            cr, uid, action['report_name'], action['datas'], context=context)
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': 'account.webkit.report.job',
+            'res_id': job_id,
+            'view_mode': 'form',
+            'target': 'current',
+        }
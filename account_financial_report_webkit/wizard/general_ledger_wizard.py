@@ -58,6 +58,11 @@ class AccountReportGeneralLedgerWizard(models.TransientModel):
         'Activate Centralization', default=True,
         help='Uncheck to display all the details of centralized accounts.',
     )
+    display_counterparts = fields.Boolean(
+        'Display Counterparts', default=True,
+        help='Uncheck to print the report faster, without the counterpart '
+        'accounts of the entries.',
+    )
 
     # pylint: disable=old-api7-method-defined
     def _check_fiscalyear(self, cr, uid, ids, context=None):
@@ -83,7 +88,8 @@ class AccountReportGeneralLedgerWizard(models.TransientModel):
                          ['amount_currency',
                           'display_account',
                           'account_ids',
-                          'centralize'],
+                          'centralize',
+                          'display_counterparts'],
                          context=context)[0]
         data['form'].update(vals)
         return data
@@ -270,7 +270,7 @@ class AccountAgedTrialBalanceWebkitXls(report_xls):
         row_pos = self._print_empty_row(_p, _xs, data, row_pos)
         row_pos = self._print_header(_p, _xs, data, row_pos)
 
-        for account in objects:
+        for account in _p.track_progress(objects):
             row_pos = self._print_account_data(
                 _p, _xs, data, row_pos, account)
 
@@ -178,7 +178,7 @@ class GeneralLedgerXls(report_xls):
             num_format_str=report_xls.decimal_format)
 
         cnt = 0
-        for account in objects:
+        for account in _p.track_progress(objects):
 
             display_initial_balance = _p['init_balance'][account.id] and \
                 (_p['init_balance'][account.id].get(
@@ -793,7 +793,7 @@ class OpenInvoicesXls(report_xls):
         # Print empty row
         row_pos = self.print_empty_row(row_pos)
 
-        for acc in objects:
+        for acc in _p.track_progress(objects):
             if hasattr(acc, 'grouped_ledger_lines'):
                 # call xls equivalent of
                 # "grouped_by_curr_open_invoices_inclusion.mako.html"
@@ -194,7 +194,7 @@ class PartnerLedgerXls(report_xls):
             num_format_str=report_xls.decimal_format)
 
         cnt = 0
-        for account in objects:
+        for account in _p.track_progress(objects):
             if _p['ledger_lines'].get(account.id, False) or \
                     _p['init_balance'].get(account.id, False):
                 if not _p['partners_order'].get(account.id, False):
@@ -281,7 +281,7 @@ class PartnersBalanceXls(report_xls):
             num_format_str=report_xls.decimal_format)
 
         row_pos += 1
-        for current_account in objects:
+        for current_account in _p.track_progress(objects):
 
             partners_order = _p['partners_order_accounts']\
                 .get(current_account.id, False)
@@ -222,7 +222,7 @@ class TrialBalanceXls(report_xls):
         regular_cell_style_pct = xlwt.easyxf(
             regular_cell_format + _xs['center'], num_format_str='0')
 
-        for current_account in objects:
+        for current_account in _p.track_progress(objects):
 
             if not _p['to_display_accounts'][current_account.id]:
                 continue
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 # Copyright 2009-2017 Noviat.
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+from openerp.report.interface import report_int
 from openerp.tests.common import TransactionCase
 
 
@@ -35,6 +36,15 @@ class TestCommonXls(TransactionCase):
         self.assertGreaterEqual(len(report_xls[0]), 1)
         self.assertEqual(report_xls[1], 'xls')
 
+    def common_test_03_create_xls(self):
+        """ Check the report service renders the XLS export """
+        report = report_int._reports['report.%s' % self.xls_report_name]
+        content, report_format = report.create(
+            self.cr, self.uid, self.report.ids, self.render_dict,
+            {'xls_export': 1})
+        self.assertTrue(content)
+        self.assertEqual(report_format, 'xls')
+
     def _getReportModel(self):
         """
             :return: the report model name